@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure data_validation() on a synthetic query file where one row out of
+--blank-every has a blank cell.
+
+    $ python benchmarks/bench_data_validation.py -n 200000 -p 1 -p 4
+
+Log messages go to log.txt of a temporary directory, as in a normal run,
+so the cost of logging is included.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info import specimen_info  # noqa: E402
+
+
+def make_files(row_num, blank_every):
+    """Write data.xlsx and query.xlsx in the cwd."""
+    xlsx_writer = specimen_info.XlsxStreamWriter()
+    xlsx_writer.append(['header %d' % _ for _ in range(19)])
+    for i in range(1000):
+        xlsx_writer.append(['%d' % i, '中文名%d' % i,
+                            'Genus%d species%d' % (i, i)]
+                           + ['%d' % _ for _ in range(3, 19)])
+    xlsx_writer.save('data.xlsx')
+
+    xlsx_writer = specimen_info.XlsxStreamWriter()
+    for i in range(row_num):
+        xlsx_writer.append(['%d' % i, '%d' % i,
+                            'Genus%d species%d' % (i % 1100, i % 1100),
+                            '' if i % blank_every == 0 else '1'])
+    xlsx_writer.save('query.xlsx')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='row_num', type=int, default=200000,
+                        help="Number of query rows")
+    parser.add_argument('--blank-every', dest='blank_every', type=int,
+                        default=10, help="One row out of N has a blank cell")
+    parser.add_argument('-p', dest='process_num_list', type=int,
+                        action='append',
+                        help="VALIDATION_PROCESS_NUM to measure")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        make_files(args.row_num, args.blank_every)
+        logger = specimen_info.logging.getLogger('')
+        for handler in logger.handlers[:]:
+            if not isinstance(handler, specimen_info.logging.FileHandler):
+                logger.removeHandler(handler)
+        logger.addHandler(specimen_info.logging.FileHandler('log.txt'))
+        for process_num in args.process_num_list or [1]:
+            specimen_info.VALIDATION_PROCESS_NUM = process_num
+            time_start = time.time()
+            validator = specimen_info.data_validation('data.xlsx',
+                                                      'query.xlsx')
+            seconds = time.time() - time_start
+            print('processes: %2d  rows/sec: %10.1f  (%.2f s)  '
+                  'blank cells: %d  log size: %d KB'
+                  % (process_num, args.row_num / seconds, seconds,
+                     validator.report.count('blank_cell'),
+                     os.path.getsize('log.txt') // 1024))
+    finally:
+        os.chdir('/')
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure rows/sec of Query.do_multi_query() on synthetic query rows, in
+'row' and 'batch' QUERY_MODE.
+
+    $ python benchmarks/bench_do_multi_query.py -n 100000 --species 1000
+
+The web cache is filled beforehand, so no request is sent and only the
+local work (loading caches, formatting output rows) is measured. Logging
+is turned down to errors.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import openpyxl  # noqa: E402
+from specimen_info import specimen_info  # noqa: E402
+
+
+def make_files(row_num, species_num):
+    """Write query.xlsx, data.xlsx and a filled web cache in the cwd."""
+    species_name_list = ['Genus%d species%d' % (i, i)
+                         for i in range(species_num)]
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for i, species_name in enumerate(species_name_list):
+        ws.append(['%d' % i, '中文名%d' % i, species_name, '科%d' % i,
+                   'Family%d' % i, '省', '市', '地名', '30.1', '120.2',
+                   '100', '2016-01-01', '1', '草本', '采集人', '鉴定人',
+                   '2016-02-01', '录入员', '2016-03-01'])
+    wb.save('data.xlsx')
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for i in range(row_num):
+        ws.append(['%d' % i, '%d' % i, species_name_list[i % species_num],
+                   '%d' % (i % 3 + 1)])
+    wb.save('query.xlsx')
+
+    web_cache = specimen_info.open_web_cache()
+    for species_name in species_name_list:
+        genus, species = species_name.split()
+        web_cache.put(species_name, (genus, species, 'L.', '', '高1米',
+                                     '', '茎直立', '叶对生', '花白色',
+                                     '果实球形', ''))
+    web_cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='row_num', type=int, default=100000,
+                        help="Number of query rows")
+    parser.add_argument('--species', dest='species_num', type=int,
+                        default=1000, help="Number of distinct species")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        make_files(args.row_num, args.species_num)
+        specimen_info.logging.getLogger('').setLevel(
+            specimen_info.logging.ERROR)
+
+        out_tuple_list_dict = {}
+        for query_mode in ('row', 'batch'):
+            specimen_info.QUERY_MODE = query_mode
+            specimen_info._web_data_cache_dict.clear()
+            specimen_info._xlsx_data_cache_dict = {}
+            time_start = time.time()
+            q = specimen_info.Query('query.xlsx', 'data.xlsx')
+            out_tuple_list = q.do_multi_query()
+            seconds = time.time() - time_start
+            assert len(out_tuple_list) == args.row_num
+            out_tuple_list_dict[query_mode] = out_tuple_list
+            print('do_multi_query (%-5s)    rows/sec: %10.1f  (%.2f s)'
+                  % (query_mode, args.row_num / seconds, seconds))
+        assert out_tuple_list_dict['row'] == out_tuple_list_dict['batch']
+
+        # Formatting only: caches are loaded and the query file is parsed
+        query_tuple_list = q.query_tuple_list
+        time_start = time.time()
+        [q._formatted_single_output(_) for _ in query_tuple_list]
+        seconds = time.time() - time_start
+        print('format rows one by one    rows/sec: %10.1f  (%.2f s)'
+              % (args.row_num / seconds, seconds))
+
+        time_start = time.time()
+        q._format_query_batch(query_tuple_list, {})
+        seconds = time.time() - time_start
+        print('format rows in batch      rows/sec: %10.1f  (%.2f s)'
+              % (args.row_num / seconds, seconds))
+    finally:
+        os.chdir('/')
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
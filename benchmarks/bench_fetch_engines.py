@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the 'threads', 'asyncio' and 'pipeline' fetch engines against a
+local stand-in for the species web site.
+
+    $ python benchmarks/bench_fetch_engines.py -n 2000 --delay 0.05
+
+Each engine runs in its own process and working directory, so peak RSS and
+the local web cache are not shared.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import openpyxl  # noqa: E402
+from specimen_info import specimen_info  # noqa: E402
+
+PAGE = """<html><body>
+<p><b>{genus}</b> <b>{species}</b> L.<span>Sp. Pl.</span></p>
+<p>多年生草本，高10-30厘米。茎直立，分枝。叶对生，卵形。花白色，顶生。果实球形。</p>
+</body></html>"""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(delay):
+    class SpeciesPageHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            genus, _, species = self.path.rpartition('/')[2].partition('%20')
+            body = PAGE.format(genus=genus, species=species).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return SpeciesPageHandler
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+def run_engine(engine, base_url, species_num, result_queue):
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for i in range(species_num):
+        ws.append(('%d' % i, '%08d' % i, 'Genus%d species%d' % (i, i), '1'))
+    wb.save('query.xlsx')
+
+    specimen_info.WEB_BASE_URL = base_url
+    logging_level = specimen_info.logging.getLogger('').level
+    specimen_info.logging.getLogger('').setLevel(specimen_info.logging.ERROR)
+    time_start = time.time()
+    web_info_cache = specimen_info.WebInfoCacheMultithreading(
+        'query.xlsx', fetch_engine=engine)
+    web_info_cache.get_web_dict_multithreading()
+    seconds = time.time() - time_start
+    specimen_info.logging.getLogger('').setLevel(logging_level)
+    fetched_num = len(specimen_info._web_data_cache_dict)
+    os.chdir('/')
+    shutil.rmtree(work_dir)
+    result_queue.put((fetched_num, seconds, peak_rss_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='species_num', type=int, default=1000,
+                        help="Number of species pages to fetch")
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help="Server side latency per page, in seconds")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.delay))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    base_url = 'http://127.0.0.1:%d/frps/' % server.server_address[1]
+
+    result_queue = multiprocessing.Queue()
+    for engine in ('threads', 'asyncio', 'pipeline'):
+        process = multiprocessing.Process(
+            target=run_engine,
+            args=(engine, base_url, args.species_num, result_queue))
+        process.start()
+        fetched_num, seconds, peak_rss = result_queue.get()
+        process.join()
+        print('%-8s  pages: %6d  pages/sec: %8.1f  peak RSS: %7.1f MB'
+              % (engine, fetched_num, fetched_num / seconds, peak_rss))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
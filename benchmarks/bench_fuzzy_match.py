@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure LatinNameMatcher and Query.do_multi_query() with FUZZY_MATCH on
+query rows where some species names are misspelled.
+
+    $ python benchmarks/bench_fuzzy_match.py -n 100000 --typos 0.1
+
+Data file species are taken from the built-in latin name list. The web
+cache is filled beforehand, so no request is sent.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info import specimen_info  # noqa: E402
+
+
+def misspell(latin_name, rand):
+    """Replace, drop or double one letter of the name."""
+    i = rand.randrange(1, len(latin_name) - 1)
+    if latin_name[i] == ' ':
+        i -= 1
+    edit = rand.choice(('replace', 'drop', 'double'))
+    if edit == 'replace':
+        return latin_name[:i] + rand.choice('aeiouln') + latin_name[i + 1:]
+    if edit == 'drop':
+        return latin_name[:i] + latin_name[i + 1:]
+    return latin_name[:i] + latin_name[i] + latin_name[i:]
+
+
+def make_files(row_num, species_num, typo_rate, rand):
+    """Write data.xlsx, query.xlsx and a filled web cache in the cwd.
+    Return the list of misspelled names.
+    """
+    latin_name_index = specimen_info.get_latin_name_index()
+    species_name_list = rand.sample(
+        [_ for _ in latin_name_index if len(_.split()) == 2], species_num)
+
+    xlsx_writer = specimen_info.XlsxStreamWriter()
+    xlsx_writer.append(['header %d' % _ for _ in range(19)])
+    for i, species_name in enumerate(species_name_list):
+        xlsx_writer.append(['%d' % i, '中文名%d' % i, species_name]
+                           + ['%d' % _ for _ in range(3, 19)])
+    xlsx_writer.save('data.xlsx')
+
+    misspelled_name_list = []
+    xlsx_writer = specimen_info.XlsxStreamWriter()
+    for i in range(row_num):
+        species_name = species_name_list[i % species_num]
+        if rand.random() < typo_rate:
+            species_name = misspell(species_name, rand)
+            misspelled_name_list.append(species_name)
+        xlsx_writer.append(['%d' % i, '%d' % i, species_name, '1'])
+    xlsx_writer.save('query.xlsx')
+
+    web_cache = specimen_info.open_web_cache()
+    for species_name in species_name_list + misspelled_name_list:
+        genus, species = species_name.split(' ', 1)
+        web_cache.put(species_name, (genus, species) + ('',) * 9)
+    web_cache.close()
+    return misspelled_name_list
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='row_num', type=int, default=100000,
+                        help="Number of query rows")
+    parser.add_argument('--species', dest='species_num', type=int,
+                        default=1000, help="Number of data file species")
+    parser.add_argument('--typos', dest='typo_rate', type=float,
+                        default=0.1, help="Part of misspelled query rows")
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        misspelled_name_list = make_files(args.row_num, args.species_num,
+                                          args.typo_rate, rand)
+        specimen_info.logging.getLogger('').setLevel(
+            specimen_info.logging.ERROR)
+
+        index = specimen_info.OfflineDataIndex('data.xlsx')
+        time_start = time.time()
+        matcher = specimen_info.LatinNameMatcher(
+            index.keys(), specimen_info.get_latin_name_index())
+        resolved_dict = matcher.resolve_all(misspelled_name_list)
+        seconds = time.time() - time_start
+        index.close()
+        print('resolve_all   names: %6d  resolved: %6d  (%.2f s)'
+              % (len(resolved_dict),
+                 sum(_ is not None for _ in resolved_dict.values()),
+                 seconds))
+
+        for fuzzy_match in (False, True):
+            specimen_info.FUZZY_MATCH = fuzzy_match
+            specimen_info._web_data_cache_dict.clear()
+            specimen_info._xlsx_data_cache_dict = {}
+            time_start = time.time()
+            out_tuple_list = specimen_info.Query(
+                'query.xlsx', 'data.xlsx').do_multi_query()
+            seconds = time.time() - time_start
+            print('do_multi_query (FUZZY_MATCH=%-5s)  rows/sec: %9.1f  '
+                  'rows joined: %6d  (%.2f s)'
+                  % (fuzzy_match, args.row_num / seconds,
+                     sum(bool(_.chinese_name) for _ in out_tuple_list),
+                     seconds))
+    finally:
+        os.chdir('/')
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
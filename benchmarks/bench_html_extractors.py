@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the 'bs4' and 'fast' HTML extractors of WebInfo.
+
+    $ python benchmarks/bench_html_extractors.py saved_pages/
+
+saved_pages/ holds species pages saved as *.html (UTF-8). Without it, a
+synthetic page is used. Peak memory allocated while parsing one page is
+measured with tracemalloc (Python 3.4+).
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import io
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info.specimen_info import WebInfo  # noqa: E402
+
+SYNTHETIC_PAGE = ('<html><head><title>Stellaria media</title></head><body>'
+                  + '<div class="nav"><a href="#">link</a></div>' * 50
+                  + '<p><b>Stellaria</b> <b>media</b> (L.) Cyr.'
+                  '<span>Ess. Pl. 36. 1784.</span></p>'
+                  '<p>一年生或二年生草本，高10-30厘米。茎俯仰或上升。叶片宽卵形'
+                  '。花瓣白色。蒴果卵形。</p>'
+                  + '<table><tr><td>cell</td></tr></table>' * 50
+                  + '</body></html>')
+
+
+def extract(page, html_extractor):
+    web_info = WebInfo('Stellaria media', response=page,
+                       html_extractor=html_extractor)
+    return web_info.all_paragraph_tuple
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('page_dir', nargs='?',
+                        help="Directory of saved species pages (*.html)")
+    parser.add_argument('-n', dest='repeat', type=int, default=200,
+                        help="Times to parse all pages")
+    args = parser.parse_args()
+
+    if args.page_dir:
+        page_list = []
+        for file_name in sorted(os.listdir(args.page_dir)):
+            if file_name.endswith('.html'):
+                with io.open(os.path.join(args.page_dir, file_name),
+                             encoding='utf-8') as f:
+                    page_list.append(f.read())
+    else:
+        page_list = [SYNTHETIC_PAGE]
+
+    for page in page_list:
+        assert extract(page, 'fast') == extract(page, 'bs4')
+
+    for html_extractor in ('bs4', 'fast'):
+        time_start = time.time()
+        for i in range(args.repeat):
+            for page in page_list:
+                extract(page, html_extractor)
+        seconds = time.time() - time_start
+
+        tracemalloc.start()
+        for page in page_list:
+            extract(page, html_extractor)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%-5s  pages/sec: %8.1f  peak allocated per run: %8.1f KB'
+              % (html_extractor, args.repeat * len(page_list) / seconds,
+                 peak / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure write_to_sqlite3() on a new database and when the same job is run
+again (every row is an upsert on an existing barcode).
+
+    $ python benchmarks/bench_sqlite_sink.py -n 1000000
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info import specimen_info  # noqa: E402
+
+
+def iter_out_tuple(row_num):
+    for i in range(row_num):
+        row = ['%s-%d' % (_, i % 1000)
+               for _ in specimen_info.FinalInfo._fields]
+        row[1] = i
+        row[2] = '%08d' % i
+        yield specimen_info.FinalInfo._make(row)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='row_num', type=int, default=1000000,
+                        help="Number of output rows")
+    args = parser.parse_args()
+
+    specimen_info.logging.getLogger('').setLevel(specimen_info.logging.ERROR)
+    work_dir = tempfile.mkdtemp()
+    sqlite3_file = os.path.join(work_dir, 'specimen.sqlite')
+    try:
+        for run in ('new database', 'run again'):
+            time_start = time.time()
+            specimen_info.write_to_sqlite3(iter_out_tuple(args.row_num),
+                                           sqlite3_file)
+            seconds = time.time() - time_start
+            print('%-12s  rows: %8d  rows/sec: %10.1f  (%.2f s)'
+                  % (run, args.row_num, args.row_num / seconds, seconds))
+        conn = sqlite3.connect(sqlite3_file)
+        assert conn.execute('SELECT COUNT(*) FROM specimen'
+                            ).fetchone()[0] == args.row_num
+        conn.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
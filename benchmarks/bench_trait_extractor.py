@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare TraitExtractor with the seven regular expressions it replaced.
+
+    $ python benchmarks/bench_trait_extractor.py [paragraphs.txt]
+
+paragraphs.txt holds one description paragraph per line. Without it, the
+paragraphs used by the tests are used.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import io
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info.specimen_info import WebInfo  # noqa: E402
+from tests.test_specimen_info import (  # noqa: E402
+    DESCRIPTION_PARAGRAPHS, legacy_find_keyword_info)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paragraph_file', nargs='?',
+                        help="Text file, one description paragraph per line")
+    parser.add_argument('-n', dest='repeat', type=int, default=2000,
+                        help="Times to extract all paragraphs")
+    args = parser.parse_args()
+
+    if args.paragraph_file:
+        with io.open(args.paragraph_file, encoding='utf-8') as f:
+            paragraph_list = [_.strip() for _ in f if _.strip()]
+    else:
+        paragraph_list = [_ for _ in DESCRIPTION_PARAGRAPHS if _]
+
+    for paragraph in paragraph_list:
+        assert (WebInfo._find_keyword_info(paragraph) ==
+                legacy_find_keyword_info(paragraph))
+
+    for name, func in (('regex', legacy_find_keyword_info),
+                       ('extractor', WebInfo._find_keyword_info)):
+        seconds = timeit.timeit(
+            lambda: [func(_) for _ in paragraph_list], number=args.repeat)
+        print('%-10s  paragraphs/sec: %10.1f'
+              % (name, args.repeat * len(paragraph_list) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare full and streaming (read only) loading of xlsx files.
+
+    $ python benchmarks/bench_xlsx_loader.py data.xlsx
+
+Each mode runs in its own process so that peak RSS is not shared.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info.specimen_info import XlsxFile  # noqa: E402
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+def run_mode(xlsx_file, read_only, result_queue):
+    time_start = time.time()
+    row_num = 0
+    xlsx = XlsxFile(xlsx_file, read_only=read_only)
+    for row_tuple in xlsx.iter_rows():
+        row_num += 1
+    xlsx.close()
+    seconds = time.time() - time_start
+    result_queue.put((row_num, seconds, peak_rss_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('xlsx_file', help="xlsx file to load")
+    args = parser.parse_args()
+
+    result_queue = multiprocessing.Queue()
+    for mode, read_only in (('full', False), ('streaming', True)):
+        process = multiprocessing.Process(
+            target=run_mode, args=(args.xlsx_file, read_only, result_queue))
+        process.start()
+        row_num, seconds, peak_rss = result_queue.get()
+        process.join()
+        print('%-10s  rows: %8d  rows/sec: %10.1f  peak RSS: %8.1f MB'
+              % (mode, row_num, row_num / seconds, peak_rss))
+
+
+if __name__ == '__main__':
+    main()
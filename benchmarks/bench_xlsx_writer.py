@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the in memory workbook and the streaming writer (XlsxStreamWriter)
+of write_to_xlsx_file().
+
+    $ python benchmarks/bench_xlsx_writer.py -n 100000
+
+Synthetic output rows (38 fields, like FinalInfo) are generated on the fly,
+so memory is only used by the writer. Each mode runs in its own process so
+that peak RSS is not shared.
+"""
+
+from __future__ import (print_function, unicode_literals, with_statement,
+                        absolute_import, division)
+
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from specimen_info import specimen_info  # noqa: E402
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 1024.0 / 1024.0
+    return peak / 1024.0
+
+
+def iter_out_tuple(row_num):
+    for i in range(row_num):
+        row = ['%s-%d' % (_, i % 1000)
+               for _ in specimen_info.FinalInfo._fields]
+        row[1] = i
+        row[2] = '%08d' % i
+        yield specimen_info.FinalInfo._make(row)
+
+
+def run_mode(row_num, streaming, result_queue):
+    work_dir = tempfile.mkdtemp()
+    specimen_info.logging.getLogger('').setLevel(specimen_info.logging.ERROR)
+    time_start = time.time()
+    specimen_info.write_to_xlsx_file(iter_out_tuple(row_num),
+                                     os.path.join(work_dir, 'out.xlsx'),
+                                     streaming=streaming)
+    seconds = time.time() - time_start
+    shutil.rmtree(work_dir)
+    result_queue.put((seconds, peak_rss_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='row_num', type=int, default=100000,
+                        help="Number of output rows")
+    args = parser.parse_args()
+
+    result_queue = multiprocessing.Queue()
+    for mode, streaming in (('workbook', False), ('streaming', True)):
+        process = multiprocessing.Process(
+            target=run_mode, args=(args.row_num, streaming, result_queue))
+        process.start()
+        seconds, peak_rss = result_queue.get()
+        process.join()
+        print('%-10s  rows: %8d  sec/100k rows: %7.2f  peak RSS: %8.1f MB'
+              % (mode, args.row_num, seconds * 100000 / args.row_num,
+                 peak_rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,11 +18,13 @@ setup(
     license='Apache',
     keywords='specimen automated plant format xlsx',
     packages=['specimen_info'],
+    package_data={'specimen_info': ['data/*.txt', 'data/latin_names.idx']},
     install_requires=['requests', 'BeautifulSoup4', 'openpyxl'],
     # $ pip install -e .[dev,test]
     extras_require={
         'dev': ['pytest', 'tox', 'sphinx'],
         'test': ['pytest'],
+        'async': ['aiohttp'],
     },
     long_description=long_description,
     classifiers=[
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous page fetcher used by the 'asyncio' fetch engine.
+
+All pages are fetched over one aiohttp session, so connections to the same
+host are kept alive and reused. URLs go through a bounded queue to a fixed
+number of worker coroutines, which bounds the requests in flight, and
+request starts can be rate limited per host. Fetched pages are handed to
+the callback in a worker thread, so parsing them does not block the event
+loop.
+
+Needs Python 3.5+ and aiohttp. It lives in its own module so that
+specimen_info.py can still be imported on Python 2.
+
+>>> def on_page_fetched(key, text, headers, error):
+...     print(key, len(text) if text else error)
+>>> fetch_pages({'Stellaria media': url}, on_page_fetched, concurrency=10)
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class HostRateLimiter(object):
+    """Allow at most `rate` request starts per second for each host."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next_time_dict = {}
+        self._lock_dict = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        loop = asyncio.get_event_loop()
+        lock = self._lock_dict.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = loop.time()
+            next_time = self._next_time_dict.get(host, now)
+            if next_time > now:
+                await asyncio.sleep(next_time - now)
+                now = next_time
+            self._next_time_dict[host] = now + self.interval
+
+
+async def _fetch_one(session, rate_limiter, key, url):
+    """Fetch one page, return (key, text, headers, error)."""
+    await rate_limiter.wait(urlsplit(url).netloc)
+    try:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return key, await response.text(), response.headers, None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return key, None, None, e
+
+
+async def _fetch_pages(url_dict, callback, concurrency, rate_limit, timeout,
+                       executor):
+    loop = asyncio.get_event_loop()
+    rate_limiter = HostRateLimiter(rate_limit)
+    url_queue = asyncio.Queue(maxsize=concurrency)
+    worker_num = max(1, min(concurrency, len(url_dict)))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def put_urls():
+        for key, url in url_dict.items():
+            await url_queue.put((key, url))
+        for _ in range(worker_num):
+            await url_queue.put(None)
+
+    async def fetch_urls(session):
+        while True:
+            key_url = await url_queue.get()
+            if key_url is None:
+                return
+            result = await _fetch_one(session, rate_limiter, *key_url)
+            # Wait for the callback: fetching slows down with parsing
+            await loop.run_in_executor(executor, callback, *result)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=client_timeout) as session:
+        tasks = [loop.create_task(put_urls())]
+        tasks.extend(loop.create_task(fetch_urls(session))
+                     for _ in range(worker_num))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def fetch_pages(url_dict, callback, concurrency=30, rate_limit=0, timeout=30):
+    """Fetch all pages in url_dict ({key: url}) concurrently.
+
+    callback(key, text, headers, error) is called as soon as each page is
+    done, in one worker thread, so calls never overlap. headers are the
+    response headers, for the page validators (ETag, Last-Modified). text
+    and headers are None if the request failed, and error is the reason.
+    """
+    if not url_dict:
+        return
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(1)
+    try:
+        loop.run_until_complete(_fetch_pages(
+            url_dict, callback, concurrency, rate_limit, timeout, executor))
+    finally:
+        executor.shutdown()
+        loop.close()
@@ -47,14 +47,44 @@ import os
 import bs4
 import sys
 import time
+import io
 import json
+import math
+import mmap
+import zlib
+import pickle
+import struct
+import bisect
+import hashlib
 import logging
 import sqlite3
 import openpyxl
 import requests
+import zipfile
+import numbers
 import argparse
-from collections import namedtuple
+import datetime
+import tempfile
+import threading
+import multiprocessing
+from itertools import islice
+from collections import namedtuple, OrderedDict
+from xml.sax.saxutils import escape as xml_escape
 from multiprocessing.dummy import Pool
+from requests.packages.urllib3.util.retry import Retry
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+try:
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED
+    from concurrent.futures import wait as futures_wait
+except ImportError:
+    ProcessPoolExecutor = None
 
 
 __version__ = "v1.3.0"
@@ -86,8 +116,121 @@ HEADER_TUPLE = (
 # If no content, this is the number of blank tuple
 TOTAL_LINES = 38
 
-# Local JSON cache file name for web search
+# Web site to search species informations from
+WEB_BASE_URL = 'http://frps.eflora.cn/frps/'
+
+# Engine to get info from web:
+#     'threads': POOL_NUM threads, one blocking request per thread
+#     'asyncio': one event loop with a pooled connection (needs Python 3.5+
+#                and aiohttp, falls back to 'threads' if not available)
+#     'pipeline': POOL_NUM threads only fetch pages, pages are parsed by
+#                 PARSE_PROCESS_NUM processes (needs concurrent.futures)
+FETCH_ENGINE = 'threads'
+
+# Settings for HTTP requests of 'threads' and 'pipeline' engine
+HTTP_TIMEOUT = (10, 30)      # Seconds: (connect timeout, read timeout)
+HTTP_RETRIES = 3             # Retries on connection errors and 5xx status
+HTTP_BACKOFF = 0.5           # Backoff factor between retries, in seconds
+
+# Settings for 'pipeline' engine
+PARSE_PROCESS_NUM = 0        # Processes to parse pages, 0: number of CPUs
+PIPELINE_QUEUE_SIZE = 100    # Max fetched pages waiting to be parsed
+
+# Settings for 'asyncio' engine
+ASYNC_CONCURRENCY = 30       # Max requests in flight
+ASYNC_RATE_LIMIT = 0         # Max requests per second per host, 0: no limit
+ASYNC_TIMEOUT = 30           # Seconds before giving up a single request
+
+# With --revalidate, cached species older than this are checked again with
+# conditional requests (ETag / Last-Modified), only changed pages are parsed
+REVALIDATE_AFTER_DAYS = 30
+
+# How to extract paragraphs from species web page:
+#     'fast': pull out <p> paragraphs with a streaming parser, no HTML tree
+#     'bs4':  build a BeautifulSoup tree ('fast' falls back to it on error)
+HTML_EXTRACTOR = 'fast'
+
+# Traits extracted from the description paragraph of species web page:
+#     (name, keywords, scope)
+# scope 'clause':   parts between '，' or '。' holding any of the keywords
+# scope 'sentence': parts between '。' holding any of the keywords
+# Add a 'habitat' trait (for example: ('habitat', ('生于',), 'sentence'))
+# to fill in 生境 column from web.
+TRAIT_KEYWORDS = (
+    ('height', ('高',), 'clause'),          # 体高
+    ('DBH', ('胸径',), 'clause'),           # 胸径
+    ('stem', ('茎',), 'sentence'),          # 茎
+    ('leaf', ('叶',), 'sentence'),          # 叶
+    ('flower', ('花',), 'sentence'),        # 花
+    ('fruit', ('果',), 'sentence'),         # 果实
+    ('host', ('寄主',), 'sentence'),        # 寄主
+)
+
+# Backend of the local cache for web search: 'sqlite' or 'json'
+WEB_CACHE_BACKEND = 'sqlite'
+
+# Local SQLite3 cache file name for web search
+LOCAL_SQLITE_CACHE_FILE = 'web_cache.sqlite'
+
+# Local JSON cache file name for web search. It is used by the 'json'
+# backend, and imported once into the SQLite3 cache by the 'sqlite' backend
 LOCAL_JSON_CACHE_FILE = 'web_cache.json'
+# The 'json' backend saves the file at most every N seconds while fetching
+# ('sqlite' saves every species at once)
+CACHE_CHECKPOINT_SECONDS = 30
+
+# Keep raw fetched pages (zlib compressed) in a local archive, so that the
+# web cache can be rebuilt with --reparse without fetching pages again
+ARCHIVE_WEB_PAGES = True
+LOCAL_PAGE_ARCHIVE_FILE = 'web_pages.sqlite'
+REPARSE_BATCH_SIZE = 500     # Pages parsed per batch by --reparse
+
+# SQLite3 output file, see write_to_sqlite3()
+SQLITE_CHUNK_SIZE = 50000    # Rows committed in one transaction
+SQLITE_PRAGMAS = ('journal_mode=WAL', 'synchronous=NORMAL',
+                  'cache_size=-65536', 'temp_store=MEMORY')
+
+# How Query.do_multi_query() works:
+#     'batch': column by column, each species is formatted only once
+#     'row':   one query row after another, with a log for each row
+QUERY_MODE = 'batch'
+QUERY_BATCH_SIZE = 10000     # Query rows formatted at a time in 'batch' mode
+
+# Sidecar index file of the data file, named after the key column:
+# data.xlsx -> data.xlsx.col2.index
+# The index is rebuilt automatically whenever the data file changes
+USE_OFFLINE_INDEX = True
+OFFLINE_INDEX_SUFFIX = '.index'
+OFFLINE_INDEX_ROW_CACHE_SIZE = 10000  # Rows looked up kept in memory
+
+# Query rows parsed by data validation are kept for the query stage, up to
+# this number of rows (more rows: the query file is read again), 0: never
+VALIDATION_KEEP_QUERY_ROWS = 200000
+# Rows are checked in chunks, by VALIDATION_PROCESS_NUM processes
+# (1: in this process, 0: number of CPUs)
+VALIDATION_PROCESS_NUM = 0
+VALIDATION_CHUNK_ROWS = 20000
+VALIDATION_MAX_EXAMPLES = 10  # Examples and row ranges kept for each rule
+# Check latin names of data and query files against the reference list
+CHECK_LATIN_NAMES = True
+
+# Join query species missing in data file to the closest data file name
+# (misspelling, author suffix), see LatinNameMatcher
+FUZZY_MATCH = True
+FUZZY_MAX_DISTANCE = 2        # Max edit distance of a fuzzy match
+
+# Progress events of long stages are published at most every N seconds
+PROGRESS_INTERVAL = 0.5
+
+# HTTP session shared by threads, see get_http_session()
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Reference latin name index, see get_latin_name_index()
+_latin_name_index = None
+
+# Functions called with each ProgressEvent, see add_progress_listener()
+_progress_listener_list = []
 
 # Dictionaries used for cache
 # Web data cache
@@ -100,25 +243,39 @@ BAR = '\n' + '=' * 73 + '\n'
 THIN_BAR = '\n' + '-' * 73 + '\n'
 THIN_BAR_NO_NEWLINE = '-' * 60
 
-DEFAULT_LATIN_NAME_FILE = os.path.join('.', 'data', 'latin_names.txt')
-DEFAULT_LATIN_NAME_FILE_2 = os.path.join('.', 'data',
+# Reference lists of latin names shipped with the package, compiled to
+# LATIN_NAME_INDEX_FILE by LatinNameIndex.build()
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DEFAULT_LATIN_NAME_FILE = os.path.join(DATA_DIR, 'latin_names.txt')
+DEFAULT_LATIN_NAME_FILE_2 = os.path.join(DATA_DIR,
                                          'latin_names_only_head_and_tail.txt')
+LATIN_NAME_INDEX_FILE = os.path.join(DATA_DIR, 'latin_names.idx')
 
 # logging
 file_handler_format = ('%(message)s')
-logging.basicConfig(level=logging.DEBUG,
-                    format=file_handler_format,
-                    datefmt="%Y-%m-%d %H:%M",
-                    filename="log.txt",
-                    filemode="w")
 
-# logging handler for displaying output to screen
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter("%(message)s")
-console.setFormatter(formatter)
 
-logging.getLogger("").addHandler(console)
+def setup_logging():
+    """Log to log.txt and to screen.
+
+    Called by the main functions only: worker processes started with spawn
+    import this module again, and must not truncate log.txt or add
+    handlers of their own.
+    """
+    logging.basicConfig(level=logging.DEBUG,
+                        format=file_handler_format,
+                        datefmt="%Y-%m-%d %H:%M",
+                        filename="log.txt",
+                        filemode="w")
+
+    # logging handler for displaying output to screen
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(message)s")
+    console.setFormatter(formatter)
+
+    logging.getLogger("").addHandler(console)
+
 
 # Seppress logging info from urllib3 which was called by requests
 requests_log = logging.getLogger("requests")
@@ -130,13 +287,119 @@ def check_unicode(unknown):
     return isinstance(unknown, unicode)
 
 
+# Progress of one stage: items done, total (None if unknown), items per
+# second, seconds left (None if unknown), and whether the stage is over
+ProgressEvent = namedtuple(
+    "ProgressEvent", ["stage", "done", "total", "rate", "eta", "finished"])
+
+
+def add_progress_listener(listener):
+    """Call listener(progress_event) for the progress of every stage:
+    'fetch', 'revalidate', 'index', 'query', 'write xlsx', 'write sqlite'.
+    Listeners may be called from any thread.
+    """
+    _progress_listener_list.append(listener)
+
+
+def remove_progress_listener(listener):
+    if listener in _progress_listener_list:
+        _progress_listener_list.remove(listener)
+
+
+class Progress(object):
+    """Count items done by a stage and publish ProgressEvent to progress
+    listeners, at most every PROGRESS_INTERVAL seconds. Thread safe.
+
+    >>> progress = Progress('fetch', total=len(species_name_list))
+    >>> progress.update()            # One more species done
+    >>> progress.finish()
+    """
+    def __init__(self, stage, total=None):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self._time_start = time.time()
+        self._time_published = 0
+        self._lock = threading.Lock()
+
+    def update(self, item_num=1):
+        with self._lock:
+            self.done += item_num
+            now = time.time()
+            if now - self._time_published < PROGRESS_INTERVAL:
+                return
+            self._time_published = now
+        self._publish(now)
+
+    def finish(self):
+        self._publish(time.time(), finished=True)
+
+    def _publish(self, now, finished=False):
+        if not _progress_listener_list:
+            return
+        seconds = now - self._time_start
+        rate = self.done / seconds if seconds > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(0, self.total - self.done) / rate
+        progress_event = ProgressEvent(self.stage, self.done, self.total,
+                                       rate, eta, finished)
+        for listener in list(_progress_listener_list):
+            listener(progress_event)
+
+
+def format_progress(progress_event):
+    """Return one line for a ProgressEvent:
+
+    [ fetch ]  120/1000  12.0%  35.2/s  ETA 0:00:25
+    """
+    progress_line = '[ %s ]  %d' % (progress_event.stage,
+                                    progress_event.done)
+    if progress_event.total:
+        progress_line += '/%d  %.1f%%' % (
+            progress_event.total,
+            100.0 * progress_event.done / progress_event.total)
+    progress_line += '  %.1f/s' % progress_event.rate
+    if progress_event.finished:
+        progress_line += '  done'
+    elif progress_event.eta is not None:
+        progress_line += '  ETA %s' % datetime.timedelta(
+            seconds=int(progress_event.eta))
+    return progress_line
+
+
+class ProgressStatusLine(object):
+    """Progress listener showing one status line, rewritten in place, on a
+    terminal (sys.stderr by default). A finished stage keeps its line.
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._line_length = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, progress_event):
+        progress_line = format_progress(progress_event)
+        with self._lock:
+            self.stream.write('\r' + progress_line.ljust(self._line_length))
+            if progress_event.finished:
+                self.stream.write('\n')
+                self._line_length = 0
+            else:
+                self._line_length = len(progress_line)
+            self.stream.flush()
+
+
 class XlsxFile(object):
     """
     Handel xlsx files and return a matrix of content.
+
+    With ``read_only=True`` the workbook is opened in openpyxl's streaming
+    mode and no matrix is built. Use ``iter_rows()`` to read rows lazily.
     """
-    def __init__(self, excel_file):
+    def __init__(self, excel_file, read_only=False):
+        self.read_only = read_only
         try:
-            self.wb = openpyxl.load_workbook(excel_file)
+            self.wb = openpyxl.load_workbook(excel_file, read_only=read_only)
         # Invalid xlsx format
         except openpyxl.utils.exceptions.InvalidFileException as e:
             logging.error("Invalid xlsx format.\n%s" % e)
@@ -148,11 +411,15 @@ class XlsxFile(object):
             logging.error(e)
             sys.exit(1)
 
-        self.ws = self.wb.get_active_sheet()
+        if read_only:
+            self.ws = self.wb.active
+        else:
+            self.ws = self.wb.get_active_sheet()
         self.ws_title = self.ws.title
         self.xlsx_matrix = []
         self.species_info_dict = {}
-        self._get_matrix()
+        if not read_only:
+            self._get_matrix()
 
     @property
     def all_sheet_names(self):
@@ -188,6 +455,34 @@ class XlsxFile(object):
             logging.error(error_msg)
             raise ValueError(error_msg)
 
+    def iter_rows(self):
+        """Yield rows of the active sheet as tuples of cell values.
+
+        In read only mode rows are parsed from the file one by one, so the
+        whole sheet is never held in memory.
+        """
+        if self.xlsx_matrix:
+            for row_tuple in self.xlsx_matrix:
+                yield row_tuple
+            return
+        for row in self.ws.iter_rows():
+            yield tuple(cell.value for cell in row)
+
+    def iter_column(self, column_index):
+        """Yield values of one column (0 based) of the active sheet."""
+        if self.xlsx_matrix or not self.read_only:
+            for row_tuple in self.iter_rows():
+                yield row_tuple[column_index]
+            return
+        for row in self.ws.iter_rows(min_col=column_index + 1,
+                                     max_col=column_index + 1):
+            yield row[0].value
+
+    def close(self):
+        """Release the file handle kept open by a read only workbook."""
+        if self.read_only:
+            self.wb.close()
+
     def _get_matrix(self):
         """Get a two dimensional matrix from the xlsx file."""
         self.xlsx_matrix = []
@@ -203,6 +498,12 @@ class XlsxFile(object):
             logging.info("[    Matrix Col Infos ]:  No. of Cols:  %d"
                          % len(self.xlsx_matrix[0]))
 
+    def iter_xlsx_data_items(self, key_column_index=2):
+        """Yield (key, row_tuple) pairs used by get_xlsx_data_dict()."""
+        if not self.xlsx_matrix and not self.read_only:
+            self._get_matrix()
+        return iter_data_items(self.iter_rows(), key_column_index)
+
     def get_xlsx_data_dict(self, key_column_index=2):
         """Return a dictionary with data from xlsx matrix.
 
@@ -217,24 +518,28 @@ class XlsxFile(object):
             'c': ('3', 'c', 'y')
         }
         """
-        xlsx_data_dict = {}
-        if not self.xlsx_matrix:
-            self._get_matrix()
-        for i, row_tuple in enumerate(self.xlsx_matrix):
-            if not row_tuple[key_column_index]:
-                continue
-            elements = [_.strip() if type(_) == str else _
-                        for _ in row_tuple]
-            # Add key=species_name : value=info_list to dictionary
-            # use " ".join(species_name.split()) to avoid search failure by
-            # format error (If there are more than one blanks or tabs)
-            species_name = " ".join(elements[key_column_index].split())
-            xlsx_data_dict[species_name] = tuple(elements)
+        xlsx_data_dict = dict(self.iter_xlsx_data_items(key_column_index))
         if SHOW_GARBAGE_LOG:
             logging.info("[ Generate Dictionary ]:  Successful")
         return xlsx_data_dict
 
 
+def iter_data_items(row_iter, key_column_index=2):
+    """Yield (key, row_tuple) pairs of data rows, key is the cleaned
+    value of column key_column_index. Rows without key are skipped.
+    """
+    for row_tuple in row_iter:
+        if not row_tuple[key_column_index]:
+            continue
+        elements = [_.strip() if type(_) == str else _
+                    for _ in row_tuple]
+        # Add key=species_name : value=info_list to dictionary
+        # use " ".join(species_name.split()) to avoid search failure by
+        # format error (If there are more than one blanks or tabs)
+        species_name = " ".join(elements[key_column_index].split())
+        yield species_name, tuple(elements)
+
+
 class QueryParser(object):
     """Parse query file and return a list of query tuples.
 
@@ -246,11 +551,198 @@ class QueryParser(object):
             error_msg = "No such query file: %s" % query_file
             logging.error(error_msg)
             raise IOError(error_msg)
-        self._query_xlsx_file = XlsxFile(query_file)
+        self._query_xlsx_file = XlsxFile(query_file, read_only=True)
+
+    def iter_query_tuple(self):
+        """Yield query tuples one by one without loading the whole file."""
+        return self._query_xlsx_file.iter_rows()
+
+    def iter_species_names(self):
+        """Yield the species name of each query, reading only the columns
+        up to the species name.
+        """
+        return self._query_xlsx_file.iter_column(2)
 
     @property
     def query_tuple(self):
-        return self._query_xlsx_file.xlsx_matrix
+        return list(self.iter_query_tuple())
+
+
+class ParagraphParser(HTMLParser):
+    """Collect the first text of every <p> tag, without building a tree.
+
+    Gives the same list as [p.find(text=True) for p in soup.select('p')]
+    with BeautifulSoup and "html.parser".
+
+    >>> paragraph_parser = ParagraphParser()
+    >>> paragraph_parser.feed(html_text)
+    >>> paragraph_parser.paragraph_list
+    """
+    # Tags without end tag
+    VOID_TAGS = frozenset([
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+        'keygen', 'link', 'menuitem', 'meta', 'param', 'source', 'track',
+        'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image',
+        'isindex', 'nextid', 'spacer'])
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.paragraph_list = []
+        # Open tags: [(tag, index of paragraph or None)]
+        self._open_tag_list = []
+        # Index of paragraphs which did not get any text yet
+        self._waiting_index_set = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_TAGS:
+            return
+        index = None
+        if tag == 'p':
+            index = len(self.paragraph_list)
+            self.paragraph_list.append(None)
+            self._waiting_index_set.add(index)
+        self._open_tag_list.append((tag, index))
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == 'p':
+            self.paragraph_list.append(None)
+
+    def handle_endtag(self, tag):
+        # Like BeautifulSoup, close all tags up to the matching start tag,
+        # and ignore end tags without start tag
+        if tag not in [_[0] for _ in self._open_tag_list]:
+            return
+        while True:
+            open_tag, index = self._open_tag_list.pop()
+            self._waiting_index_set.discard(index)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self._waiting_index_set:
+            return
+        # BeautifulSoup collapses whitespace only strings
+        if not data.strip(' \n\t\x0c\r'):
+            data = '\n' if '\n' in data else ' '
+        for index in self._waiting_index_set:
+            self.paragraph_list[index] = data
+        self._waiting_index_set.clear()
+
+    handle_comment = handle_data
+
+
+class TraitExtractor(object):
+    """Extract traits from a description paragraph in a single pass.
+
+    trait_keywords is a sequence of (name, keywords, scope), see
+    TRAIT_KEYWORDS. The paragraph is split into sentences (by '。') once,
+    and each sentence is checked against the keywords of all traits.
+    Sentences holding a keyword of a 'clause' trait are also split into
+    clauses (by '，').
+
+    >>> extractor = TraitExtractor(TRAIT_KEYWORDS)
+    >>> trait_dict = extractor.extract(paragraph)
+    >>> trait_dict['height']
+    """
+    SCOPE_SEPARATORS = {
+        'clause': ' | ',
+        'sentence': '。 | ',
+    }
+
+    def __init__(self, trait_keywords):
+        self.trait_names = []
+        self._sentence_traits = []
+        self._clause_traits = []
+        clause_keywords = []
+        for name, keywords, scope in trait_keywords:
+            if scope not in self.SCOPE_SEPARATORS:
+                error_msg = ("Invalid scope of trait %s: %s (choose from: %s)"
+                             % (name, scope,
+                                ', '.join(sorted(self.SCOPE_SEPARATORS))))
+                logging.error(error_msg)
+                raise ValueError(error_msg)
+            index = len(self.trait_names)
+            self.trait_names.append(name)
+            if scope == 'clause':
+                self._clause_traits.append((index, tuple(keywords)))
+                clause_keywords.extend(keywords)
+            else:
+                self._sentence_traits.append((index, tuple(keywords)))
+        self._clause_keywords = tuple(clause_keywords)
+        self._separators = [self.SCOPE_SEPARATORS[_[2]]
+                            for _ in trait_keywords]
+
+    def extract(self, paragraph):
+        """Return a dict: {trait name: matched parts joined together}."""
+        matched_lists = [[] for _ in self.trait_names]
+        for sentence in paragraph.split('。'):
+            for index, keywords in self._sentence_traits:
+                for keyword in keywords:
+                    if keyword in sentence:
+                        matched_lists[index].append(sentence)
+                        break
+            if not any(_ in sentence for _ in self._clause_keywords):
+                continue
+            for clause in sentence.split('，'):
+                for index, keywords in self._clause_traits:
+                    for keyword in keywords:
+                        if keyword in clause:
+                            matched_lists[index].append(clause)
+                            break
+        return dict(
+            (name, separator.join(matched_list))
+            for name, separator, matched_list in
+            zip(self.trait_names, self._separators, matched_lists))
+
+
+_trait_extractor = TraitExtractor(TRAIT_KEYWORDS)
+
+
+def get_http_session():
+    """Return the HTTP session shared by all threads of the 'threads' engine.
+
+    Connections to the web site are kept alive and reused, the pool holds up
+    to POOL_NUM connections. Connection errors and 5xx responses are retried
+    HTTP_RETRIES times with exponential backoff.
+    """
+    global _http_session
+
+    with _http_session_lock:
+        if _http_session is None:
+            retry = Retry(total=HTTP_RETRIES,
+                          backoff_factor=HTTP_BACKOFF,
+                          status_forcelist=(500, 502, 503, 504))
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=max(POOL_NUM, 1),
+                max_retries=retry)
+            _http_session = requests.Session()
+            _http_session.mount('http://', adapter)
+            _http_session.mount('https://', adapter)
+        return _http_session
+
+
+def get_page_validators(response_text, response_headers=None):
+    """Return validators of a fetched page: ETag, Last-Modified and SHA1."""
+    response_headers = response_headers or {}
+    return {
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+        'page_sha1': hashlib.sha1(response_text.encode('utf-8')).hexdigest(),
+    }
+
+
+def get_species_url(species_name):
+    """Return the URL of the species page on the web."""
+    if len(species_name.split()) == 2:
+        genus, species = species_name.split()
+    else:
+        logging.warning("    [ WARNING ]  Is this llegal species name?"
+                        " -->  %s" % species_name)
+        genus, blank, species = [
+            _.strip() for _ in species_name.partition(' ')]
+
+    return WEB_BASE_URL + genus + '%20' + species
 
 
 class WebInfo(object):
@@ -258,33 +750,72 @@ class WebInfo(object):
 
     >>> w = WebInfo("Eupatorium coelestinum")
     >>> web_info_tuple = w.pretty_info_tuple
+
+    If the page was already fetched, pass it as response and no request
+    will be sent:
+
+    >>> w = WebInfo("Eupatorium coelestinum", response=page_text)
+
+    html_extractor: 'fast' or 'bs4' (default: HTML_EXTRACTOR).
     """
-    def __init__(self, species_name):
+    def __init__(self, species_name, response=None, html_extractor=None):
         self.species_name = species_name
-        self.response = None
-        self._cook_soup()
+        self.response = response
+        self.response_headers = None
+        self.html_extractor = html_extractor or HTML_EXTRACTOR
+        self.soup = None
+        self.paragraph_list = None
+        if response is None:
+            self._cook_soup()
+        else:
+            self._make_soup()
 
     def _cook_soup(self):
         """Prepare requests response and BeautifulSoup soup."""
         if SHOW_GARBAGE_LOG:
             logging.info("    [   Web   ]  Searching Internet ...")
         logging.info("    [ Species ]  %s" % self.species_name)
-        if len(self.species_name.split()) == 2:
-            genus, species = self.species_name.split()
-        else:
-            logging.warning("    [ WARNING ]  Is this llegal species name?"
-                            " -->  %s" % self.species_name)
-            genus, blank, species = [
-                _.strip() for _ in self.species_name.partition(' ')]
-
-        requests_url = ('http://frps.eflora.cn/frps/'
-                        + genus
-                        + '%20'
-                        + species)
+        requests_url = get_species_url(self.species_name)
         if SHOW_GARBAGE_LOG:
             logging.info('    [   URL   ]  %s' % requests_url)
+        # Raise instead of sys.exit(1): this runs in a worker thread, and
+        # SystemExit there would leave pool.map() waiting forever
+        try:
+            response = get_http_session().get(
+                requests_url, timeout=HTTP_TIMEOUT)
+            self.response = response.text
+            self.response_headers = response.headers
+        except requests.Timeout as e:
+            logging.error(' *  Request timed out: %s\n    %s'
+                          % (requests_url, e))
+            raise
+        except requests.RequestException as e:
+            logging.error(
+                ' *  Internet Connection Failed.'
+                '    Output will only get data form date file.\n    %s' % e)
+            raise
+        except BaseException as e:
+            logging.error(" *  %s" % e)
+            sys.exit(1)
+        self._make_soup()
+
+    def _make_soup(self):
+        """Prepare BeautifulSoup soup from the response text.
+
+        With HTML_EXTRACTOR = 'fast', only the paragraphs are pulled out by
+        ParagraphParser and no soup is built, unless ParagraphParser fails.
+        """
+        if self.html_extractor == 'fast':
+            try:
+                paragraph_parser = ParagraphParser()
+                paragraph_parser.feed(self.response)
+                paragraph_parser.close()
+                self.paragraph_list = paragraph_parser.paragraph_list
+                return
+            except Exception as e:
+                logging.warning("    [ WARNING ]  Fast HTML extractor failed, "
+                                "use BeautifulSoup instead. (%s)" % e)
         try:
-            self.response = requests.get(requests_url).text
             self.soup = bs4.BeautifulSoup(self.response, "html.parser")
         except bs4.FeatureNotFound as e:
             logging.error(" *  Cannot find parser: html.parser.")
@@ -292,14 +823,11 @@ class WebInfo(object):
             logging.error("        pip install lxml")
             logging.error("        pip install html5lib")
             sys.exit(1)
-        except requests.ConnectionError as e:
-            logging.error(
-                ' *  Internet Connection Failed.'
-                '    Output will only get data form date file.\n    %s' % e)
-            sys.exit(1)
-        except BaseException as e:
-            logging.error(" *  %s" % e)
-            sys.exit(1)
+
+    @property
+    def validators(self):
+        """Validators of the page, saved in web cache for revalidation."""
+        return get_page_validators(self.response, self.response_headers)
 
     @property
     def all_paragraph_tuple(self):
@@ -307,6 +835,8 @@ class WebInfo(object):
         if SHOW_GARBAGE_LOG:
             logging.info('    [   INFO  ]  Start extracting informations '
                          'from web...')
+        if self.paragraph_list is not None:
+            return self.paragraph_list
         paragraphe_tuple_list = [p.find(text=True)
                                  for p in self.soup.select('p')]
         return paragraphe_tuple_list
@@ -314,41 +844,20 @@ class WebInfo(object):
     @staticmethod
     def _find_keyword_info(one_paragraph_content):
         """From <p> taged paragraphes, try to extact informations that has
-        relevant keywords."""
-        re_1 = re.compile('[^，。]*高[^，。]*')
-        height_list = ' | '.join(re_1.findall(one_paragraph_content))  # 体高
-
-        re_2 = re.compile('[^，。]*胸径[^，。]*')
-        DBH_list = ' | '.join(re_2.findall(one_paragraph_content))  # 胸径, DBH
-
-        re_3 = re.compile('[^。]*茎[^。]*')
-        stem_list = '。 | '.join(re_3.findall(one_paragraph_content))    # 茎
-
-        re_4 = re.compile('[^。]*叶[^。]*')
-        leaf_list = '。 | '.join(re_4.findall(one_paragraph_content))    # 叶
-
-        re_5 = re.compile('[^。]*花[^。]*')
-        flower_list = '。 | '.join(re_5.findall(one_paragraph_content))  # 花
-
-        re_6 = re.compile('[^。]*果[^。]*')
-        fruit_list = '。 | '.join(re_6.findall(one_paragraph_content))   # 果实
+        relevant keywords.
 
-        re_7 = re.compile('[^。]*寄主[^。]*')
-        host_list = '。 | '.join(re_7.findall(one_paragraph_content))    # 寄主
-
-        # Return a tuple
-        # 0. 高
-        # 1. 胸径, DBH
-        # 2. 茎
-        # 3. 叶
-        # 4. 花
-        # 5. 果
-        # 6. 寄主
-        return (height_list, DBH_list, stem_list, leaf_list,
-                flower_list, fruit_list, host_list)
+        Return a tuple: (高, 胸径, 茎, 叶, 花, 果, 寄主)
+        """
+        trait_dict = _trait_extractor.extract(one_paragraph_content)
+        return tuple(trait_dict.get(_, '') for _ in
+                     ('height', 'DBH', 'stem', 'leaf', 'flower', 'fruit',
+                      'host'))
 
     def _get_target_info(self):
-        """Search infos with specific keywords."""
+        """Search infos with specific keywords.
+
+        Return a dict of traits in TRAIT_KEYWORDS, see TraitExtractor.
+        """
         paragraphe_tuple_list = self.all_paragraph_tuple
 
         strict_word_tuple = ['高', '茎', '叶', '花', '果']
@@ -368,19 +877,8 @@ class WebInfo(object):
                 break
 
         if not detailed_paragraph:
-            (height_list, DBH_list, stem_list, leaf_list,
-             flower_list, fruit_list, host_list) = \
-                ("" for _ in xrange(7))
-        else:
-            # try:
-            (height_list, DBH_list, stem_list, leaf_list,
-             flower_list, fruit_list, host_list) = \
-                self._find_keyword_info(detailed_paragraph)
-            # except UnicodeEncodeError as e:
-            #     height = DBH = stem = leaf = flower = fruit = host = ''
-
-        return (height_list, DBH_list, stem_list, leaf_list,
-                flower_list, fruit_list, host_list)
+            return {}
+        return _trait_extractor.extract(detailed_paragraph)
 
     @property
     def pretty_info_tuple(self):
@@ -407,20 +905,20 @@ class WebInfo(object):
                           " species name: %s" % self.species_name)
             namer = ""
 
-        # Get habitat (TODO.)
-        habitat = ''
-
-        # Get height, DBH, stem, leaf, flower, fruit, host
+        # Get habitat, height, DBH, stem, leaf, flower, fruit, host
+        # (habitat is blank unless a 'habitat' trait is in TRAIT_KEYWORDS)
         try:
-            (height_list, DBH_list, stem_list, leaf_list,
-             flower_list, fruit_list, host_list) = \
-                self._get_target_info()
+            trait_dict = self._get_target_info()
         except Exception as e:
             logging.error(
                 'Cannot get height, DBH, stem, ... for %s. (%s)' %
                 (self.species_name, e))
-            (height_list, DBH_list, stem_list, leaf_list,
-             flower_list, fruit_list, host_list) = ['' for x in range(7)]
+            trait_dict = {}
+        (habitat, height_list, DBH_list, stem_list, leaf_list,
+         flower_list, fruit_list, host_list) = [
+            trait_dict.get(_, '') for _ in
+            ('habitat', 'height', 'DBH', 'stem', 'leaf', 'flower', 'fruit',
+             'host')]
 
         web_info_tuple = (
             genus, species, namer,
@@ -432,81 +930,1116 @@ class WebInfo(object):
 
 
 class WebInfoCacheMultithreading(object):
-    def __init__(self, query_file):
+    def __init__(self, query_file, fetch_engine=None, revalidate=False,
+                 species_name_list=None, resume=False):
         self.query_file = query_file
-        self.non_repeatitive_species_name_list = \
-            self._get_non_repeatitive_species_name_list()
+        self.fetch_engine = fetch_engine or FETCH_ENGINE
+        self.revalidate = revalidate
+        self.resume = resume
+        self.page_archive = None
+        self.progress = None
+        if species_name_list is None:
+            self.non_repeatitive_species_name_list = \
+                self._get_non_repeatitive_species_name_list()
+        else:
+            # Species names already read from the query file
+            self.non_repeatitive_species_name_list = list(
+                set(species_name_list))
 
     def _get_non_repeatitive_species_name_list(self):
-        query_tuple_list = QueryParser(self.query_file).query_tuple
-        non_repeatitive_species_name_list = list(
-            set([_[2] for _ in query_tuple_list]))
+        species_name_iter = QueryParser(self.query_file).iter_species_names()
+        non_repeatitive_species_name_list = list(set(species_name_iter))
         if SHOW_GARBAGE_LOG:
             logging.info("     None repeatitive species name number:  %d"
                          % len(non_repeatitive_species_name_list))
         return non_repeatitive_species_name_list
 
-    def _single_query(self, one_species_name):
+    def _save_web_info(self, one_species_name, pretty_info_tuple,
+                       validators=None, page=None):
         global _web_data_cache_dict
 
+        _web_data_cache_dict[one_species_name] = pretty_info_tuple
+        self.web_cache.put(one_species_name, pretty_info_tuple, validators)
+        if page is not None and self.page_archive is not None:
+            self.page_archive.put(one_species_name, page, validators)
+
+    def _update_progress(self):
+        if self.progress is not None:
+            self.progress.update()
+
+    def _single_query(self, one_species_name):
         try:
-            pretty_info_tuple = WebInfo(one_species_name).pretty_info_tuple
-            _web_data_cache_dict[one_species_name] = pretty_info_tuple
+            web_info = WebInfo(one_species_name)
+            self._save_web_info(one_species_name, web_info.pretty_info_tuple,
+                                web_info.validators, web_info.response)
         except Exception as e:
             logging.error('Cannot get info from web: %s (%s)' %
                           (one_species_name, e))
+        finally:
+            self._update_progress()
 
-    def get_web_dict_multithreading(self):
+    def _revalidate_query(self, one_species_name):
+        """Send a conditional request for a cached species.
+
+        Return True if the page changed and was parsed again.
+        """
+        validators = self.web_cache.get_validators(one_species_name) or {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            response = get_http_session().get(
+                get_species_url(one_species_name),
+                headers=headers, timeout=HTTP_TIMEOUT)
+            if response.status_code == 304:
+                self.web_cache.touch(one_species_name)
+                return False
+            response.raise_for_status()
+            new_validators = get_page_validators(response.text,
+                                                 response.headers)
+            # Server without validators: compare the page itself
+            if new_validators['page_sha1'] == validators.get('page_sha1'):
+                self.web_cache.touch(one_species_name)
+                return False
+            pretty_info_tuple = WebInfo(
+                one_species_name, response=response.text).pretty_info_tuple
+            self._save_web_info(one_species_name, pretty_info_tuple,
+                                new_validators, response.text)
+            return True
+        except Exception as e:
+            logging.error('Cannot revalidate info from web: %s (%s)' %
+                          (one_species_name, e))
+            return False
+        finally:
+            self._update_progress()
+
+    def _revalidate_stale_species(self, species_name_list):
+        """Refresh cached species older than REVALIDATE_AFTER_DAYS."""
+        stale_species_name_list = self.web_cache.get_stale_species_names(
+            species_name_list, REVALIDATE_AFTER_DAYS * 24 * 3600)
+        if not stale_species_name_list:
+            return
+        logging.info('[ CACHE ] Revalidating %d species fetched more than '
+                     '%d days ago ...' % (len(stale_species_name_list),
+                                          REVALIDATE_AFTER_DAYS))
+        self.progress = Progress('revalidate', len(stale_species_name_list))
+        pool = Pool(POOL_NUM if 1 < POOL_NUM < 50 else None)
+        changed_list = pool.map(self._revalidate_query,
+                                stale_species_name_list)
+        pool.close()
+        pool.join()
+        self.progress.finish()
+        self.progress = None
+        logging.info('[ CACHE ] Changed: %d, not changed: %d'
+                     % (changed_list.count(True),
+                        changed_list.count(False)))
+
+    def _fetch_with_threads(self, species_name_list):
         if POOL_NUM > 1 and POOL_NUM < 50:
             pool = Pool(POOL_NUM)
             logging.info("You are using multiple threads to get info from web:"
                          "  [ %d ]\n" % POOL_NUM)
         else:
             pool = Pool()
-        if os.path.isfile(LOCAL_JSON_CACHE_FILE):
-            with open(LOCAL_JSON_CACHE_FILE, 'rb') as f:
-                local_web_cache_dict = json.loads(f.read())
-            species_in_local_json_cache = local_web_cache_dict.keys()
-            logging.info(
-                '[ CACHE ] Get cache from local JSON file:\n  |- %s' %
-                '\n  |- '.join(species_in_local_json_cache))
-        else:
-            species_in_local_json_cache = []
-            local_web_cache_dict = {}
-        species_not_in_cache = list(
-            set(self.non_repeatitive_species_name_list)
-            .difference(set(species_in_local_json_cache)))
-        pool.map(self._single_query, species_not_in_cache)
-        _web_data_cache_dict.update(local_web_cache_dict)
-        with open(LOCAL_JSON_CACHE_FILE, 'wb') as f:
-            json.dump(_web_data_cache_dict, f,
-                      indent=4, separators=(',', ': '))
-            logging.info(
-                '[ CACHE ] Write all cache to local JSON file:\n  |- %s' %
-                '\n  |- '.join(_web_data_cache_dict.keys()))
+        pool.map(self._single_query, species_name_list)
         pool.close()
         pool.join()
 
+    def _fetch_with_asyncio(self, async_fetch, species_name_list):
+        logging.info("You are using asyncio to get info from web:"
+                     "  [ %d ] requests at most\n" % ASYNC_CONCURRENCY)
+
+        def on_page_fetched(one_species_name, response, response_headers,
+                            error):
+            try:
+                if error is not None:
+                    logging.error('Cannot get info from web: %s (%s)' %
+                                  (one_species_name, error))
+                    return
+                pretty_info_tuple = WebInfo(
+                    one_species_name, response=response).pretty_info_tuple
+                self._save_web_info(
+                    one_species_name, pretty_info_tuple,
+                    get_page_validators(response, response_headers), response)
+            except Exception as e:
+                logging.error('Cannot get info from web: %s (%s)' %
+                              (one_species_name, e))
+            finally:
+                self._update_progress()
+
+        url_dict = {}
+        for one_species_name in species_name_list:
+            try:
+                url_dict[one_species_name] = get_species_url(one_species_name)
+            except Exception as e:
+                logging.error('Cannot get info from web: %s (%s)' %
+                              (one_species_name, e))
+                self._update_progress()
+        async_fetch.fetch_pages(url_dict, on_page_fetched,
+                                concurrency=ASYNC_CONCURRENCY,
+                                rate_limit=ASYNC_RATE_LIMIT,
+                                timeout=ASYNC_TIMEOUT)
+
+    def _fetch_with_pipeline(self, species_name_list):
+        """Fetch pages with threads and parse them in a process pool.
+
+        Fetched pages wait in a bounded queue, so fetching threads block
+        when parsing falls behind. If interrupted, the fetching threads stop
+        after their current page and the parsing processes are shut down
+        without waiting for pages not parsed yet.
+        """
+        thread_num = max(1, min(POOL_NUM, len(species_name_list)))
+        process_num = PARSE_PROCESS_NUM or None
+        logging.info("You are using %d threads to get pages from web, and "
+                     "%s processes to parse them\n"
+                     % (thread_num, process_num or 'all CPU'))
+        species_queue = Queue.Queue()
+        for one_species_name in species_name_list:
+            species_queue.put(one_species_name)
+        page_queue = Queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop_event = threading.Event()
+
+        def put_page(page):
+            # Nobody takes pages any more once the parsing stage stopped
+            while not stop_event.is_set():
+                try:
+                    page_queue.put(page, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def fetch_pages():
+            while not stop_event.is_set():
+                try:
+                    one_species_name = species_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                logging.info("    [ Species ]  %s" % one_species_name)
+                try:
+                    response = get_http_session().get(
+                        get_species_url(one_species_name),
+                        timeout=HTTP_TIMEOUT)
+                    put_page((one_species_name, response.text,
+                              response.headers))
+                except Exception as e:
+                    logging.error('Cannot get info from web: %s (%s)' %
+                                  (one_species_name, e))
+                    self._update_progress()
+            # Tell the parsing stage this thread is done
+            put_page(None)
+
+        def save_parsed_pages(future_list):
+            for future in future_list:
+                one_species_name, validators, page = parsing_dict.pop(future)
+                try:
+                    self._save_web_info(one_species_name, future.result(),
+                                        validators, page)
+                except Exception as e:
+                    logging.error('Cannot get info from web: %s (%s)' %
+                                  (one_species_name, e))
+                finally:
+                    self._update_progress()
+
+        thread_list = [threading.Thread(target=fetch_pages,
+                                        name='pipeline-fetch-%d' % _)
+                       for _ in range(thread_num)]
+        for thread in thread_list:
+            thread.daemon = True
+            thread.start()
+
+        executor = ProcessPoolExecutor(process_num)
+        parsing_dict = {}
+        finished_thread_num = 0
+        try:
+            while finished_thread_num < thread_num:
+                page = page_queue.get()
+                if page is None:
+                    finished_thread_num += 1
+                    continue
+                one_species_name, response_text, response_headers = page
+                future = executor.submit(_parse_web_page, one_species_name,
+                                         response_text)
+                parsing_dict[future] = (
+                    one_species_name,
+                    get_page_validators(response_text, response_headers),
+                    response_text)
+                if len(parsing_dict) >= PIPELINE_QUEUE_SIZE:
+                    done_set, not_done_set = futures_wait(
+                        list(parsing_dict), return_when=FIRST_COMPLETED)
+                    save_parsed_pages(done_set)
+            save_parsed_pages(list(parsing_dict))
+        finally:
+            stop_event.set()
+            # Pages not parsed yet when interrupted
+            for future in parsing_dict:
+                future.cancel()
+            executor.shutdown(wait=False)
+        for thread in thread_list:
+            thread.join()
+
+    def _fetch(self, species_name_list):
+        """Get info from web for species, with the chosen fetch engine."""
+        if self.fetch_engine == 'pipeline':
+            if ProcessPoolExecutor is not None:
+                self._fetch_with_pipeline(species_name_list)
+                return
+            logging.warning("[ WARNING ]  pipeline engine needs "
+                            "concurrent.futures (pip install futures), "
+                            "use threads instead.")
+        if self.fetch_engine == 'asyncio':
+            async_fetch = _load_async_fetch()
+            if async_fetch is not None:
+                self._fetch_with_asyncio(async_fetch, species_name_list)
+                return
+            logging.warning("[ WARNING ]  asyncio engine is not available, "
+                            "use threads instead.")
+        self._fetch_with_threads(species_name_list)
+
+    def _get_species_to_fetch(self):
+        """Return the species of the query missing in the web cache, or
+        with resume, the species left by the interrupted fetch."""
+        species_left_list = [
+            _ for _ in self.web_cache.get_fetch_job_species_names()
+            if _ not in self.web_cache]
+        if self.resume and species_left_list:
+            logging.info('[ CACHE ] Resume interrupted fetch: %d species '
+                         'still missing' % len(species_left_list))
+            return species_left_list
+        if self.resume:
+            logging.info('[ CACHE ] No interrupted fetch to resume.')
+        elif species_left_list:
+            logging.warning('[ CACHE ] Last fetch left %d species missing. '
+                            'Species fetched before are kept in cache.'
+                            % len(species_left_list))
+        species_not_in_cache = [
+            _ for _ in self.non_repeatitive_species_name_list
+            if _ not in self.web_cache]
+        logging.info(
+            '[ CACHE ] Species in local cache: %d, species to search: %d'
+            % (len(self.non_repeatitive_species_name_list)
+               - len(species_not_in_cache), len(species_not_in_cache)))
+        return species_not_in_cache
+
+    def get_web_dict_multithreading(self):
+        """Fetch species missing in the local web cache, then load all
+        species of the query to _web_data_cache_dict.
+
+        Every species is saved to the cache as soon as it is fetched (the
+        JSON backend saves at checkpoints), and the cache is closed even if
+        the fetch is interrupted, so no fetched species is lost. Running
+        again only fetches the species still missing. With resume, the
+        species left by the interrupted fetch are fetched, even if they are
+        not in this query.
+        """
+        self.web_cache = open_web_cache()
+        self.page_archive = WebPageArchive() if ARCHIVE_WEB_PAGES else None
+        try:
+            species_not_in_cache = self._get_species_to_fetch()
+            if self.revalidate:
+                self._revalidate_stale_species([
+                    _ for _ in self.non_repeatitive_species_name_list
+                    if _ in self.web_cache])
+            if species_not_in_cache:
+                self.web_cache.start_fetch_job(species_not_in_cache)
+                self.progress = Progress('fetch', len(species_not_in_cache))
+                self._fetch(species_not_in_cache)
+                self.progress.finish()
+            for species_name in self.non_repeatitive_species_name_list:
+                web_info_tuple = self.web_cache.get(species_name)
+                if web_info_tuple is not None:
+                    _web_data_cache_dict[species_name] = web_info_tuple
+        except KeyboardInterrupt:
+            logging.error('[ CACHE ] Interrupted. Species fetched so far are '
+                          'saved, run again with --resume to fetch the '
+                          'rest.')
+            raise
+        finally:
+            self.web_cache.close()
+            if self.page_archive is not None:
+                self.page_archive.close()
+
+
+def _parse_web_page(species_name, response_text):
+    """Parse a fetched page to web info tuple, run by 'pipeline' processes.
+    """
+    return WebInfo(species_name, response=response_text).pretty_info_tuple
+
+
+def _load_async_fetch():
+    """Import the optional asyncio fetcher, return None if not available.
+
+    async_fetch needs Python 3.5+ and aiohttp, it is imported here instead
+    of at the top so that this file still runs on Python 2.
+    """
+    try:
+        if __package__:
+            from . import async_fetch
+        else:
+            import async_fetch
+    except (ImportError, SyntaxError) as e:
+        logging.error(" *  Cannot import async_fetch: %s" % e)
+        logging.error(" *  asyncio engine needs Python 3.5+ and aiohttp:")
+        logging.error("        pip install aiohttp")
+        return None
+    return async_fetch
+
+
+class JSONWebCache(object):
+    """Web cache backend keeping all species in one JSON file.
+
+    The whole file is loaded when opened and rewritten on close(), and at
+    most every CACHE_CHECKPOINT_SECONDS while species are put. The species
+    of the last fetch not put yet are written next to it, in
+    <cache_file>.fetch_job.
+
+    >>> web_cache = JSONWebCache("web_cache.json")
+    >>> web_cache.put("Stellaria media", web_info_tuple)
+    >>> web_cache.close()
+    """
+    def __init__(self, cache_file=LOCAL_JSON_CACHE_FILE):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self.fetch_job_file = cache_file + '.fetch_job'
+        self._web_cache_dict = {}
+        self._fetch_job_set = set()
+        self._checkpoint_time = time.time()
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                self._web_cache_dict = json.loads(f.read().decode('utf-8'))
+        if os.path.isfile(self.fetch_job_file):
+            with open(self.fetch_job_file, 'rb') as f:
+                self._fetch_job_set = set(json.loads(
+                    f.read().decode('utf-8')))
+
+    def get(self, species_name, default=None):
+        return self._web_cache_dict.get(species_name, default)
+
+    def put(self, species_name, web_info_tuple, validators=None):
+        # The JSON format has no room for validators, they are dropped
+        with self._lock:
+            self._web_cache_dict[species_name] = list(web_info_tuple)
+            self._fetch_job_set.discard(species_name)
+            checkpoint = (time.time() - self._checkpoint_time
+                          >= CACHE_CHECKPOINT_SECONDS)
+            if checkpoint:
+                self._checkpoint_time = time.time()
+        if checkpoint:
+            self.compact()
+            logging.info('[ CACHE ] Checkpoint: %d species saved to %s'
+                         % (len(self), self.cache_file))
+
+    def start_fetch_job(self, species_name_list):
+        """Record the species about to be fetched."""
+        with self._lock:
+            self._fetch_job_set = set(species_name_list)
+            self._write_fetch_job()
+
+    def get_fetch_job_species_names(self):
+        """Species of the last fetch not fetched yet."""
+        with self._lock:
+            return list(self._fetch_job_set)
+
+    def get_validators(self, species_name):
+        return None
+
+    def touch(self, species_name):
+        pass
+
+    def get_stale_species_names(self, species_name_list, max_age):
+        logging.warning('[ CACHE ] JSON web cache cannot be revalidated, '
+                        'use the sqlite backend instead.')
+        return []
+
+    def keys(self):
+        return list(self._web_cache_dict.keys())
+
+    def __contains__(self, species_name):
+        return species_name in self._web_cache_dict
+
+    def __len__(self):
+        return len(self._web_cache_dict)
+
+    @staticmethod
+    def _write_json_file(file_name, obj):
+        """Write obj to a JSON file atomically."""
+        content = json.dumps(obj, indent=4, separators=(',', ': '))
+        tmp_file = file_name + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        if hasattr(os, 'replace'):
+            os.replace(tmp_file, file_name)
+            return
+        # Python 2: rename over the old file, except on Windows
+        try:
+            os.rename(tmp_file, file_name)
+        except OSError:
+            os.remove(file_name)
+            os.rename(tmp_file, file_name)
+
+    def _write_fetch_job(self):
+        if self._fetch_job_set:
+            self._write_json_file(self.fetch_job_file,
+                                  sorted(self._fetch_job_set))
+        elif os.path.isfile(self.fetch_job_file):
+            os.remove(self.fetch_job_file)
+
+    def compact(self):
+        """Rewrite the whole JSON file (atomically), and the species of the
+        fetch not put yet."""
+        with self._lock:
+            self._write_json_file(self.cache_file, self._web_cache_dict)
+            self._write_fetch_job()
+
+    def close(self):
+        self.compact()
+        logging.info('[ CACHE ] Write %d species to local JSON file: %s'
+                     % (len(self), self.cache_file))
+
+
+class SQLiteWebCache(object):
+    """Web cache backend storing one row per species in a SQLite3 file.
+
+    Every put() is committed at once, so species fetched before a crash are
+    not lost. Lookups go through the primary key index. An existing JSON
+    cache file is imported the first time the SQLite3 file is opened.
+
+    Besides the web info tuple, the HTTP validators of the page (ETag,
+    Last-Modified, SHA1 of the page) and the fetch time are stored, so that
+    stale entries can be revalidated with conditional requests.
+
+    The species of the last fetch are kept in the fetch_job table until
+    they are put, so an interrupted or failed fetch can tell what is left.
+
+    >>> web_cache = SQLiteWebCache("web_cache.sqlite")
+    >>> web_cache.put("Stellaria media", web_info_tuple)
+    >>> web_info_tuple = web_cache.get("Stellaria media")
+    """
+    # Columns added after the first version of the table
+    EXTRA_COLUMNS = (('etag', 'TEXT'),
+                     ('last_modified', 'TEXT'),
+                     ('page_sha1', 'TEXT'),
+                     ('fetched_at', 'REAL'))
+
+    def __init__(self, cache_file=LOCAL_SQLITE_CACHE_FILE,
+                 json_cache_file=LOCAL_JSON_CACHE_FILE):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                              '(name TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS web_cache '
+                              '(species_name TEXT PRIMARY KEY, '
+                              'web_info TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS fetch_job '
+                              '(species_name TEXT PRIMARY KEY)')
+            column_names = [_[1] for _ in self.conn.execute(
+                'PRAGMA table_info(web_cache)')]
+            for column_name, column_type in self.EXTRA_COLUMNS:
+                if column_name not in column_names:
+                    self.conn.execute('ALTER TABLE web_cache ADD COLUMN %s %s'
+                                      % (column_name, column_type))
+        migrated = self.conn.execute(
+            "SELECT value FROM meta WHERE name = 'json_migrated'").fetchone()
+        if not migrated and json_cache_file and \
+                os.path.isfile(json_cache_file):
+            self.migrate_from_json(json_cache_file)
+
+    def migrate_from_json(self, json_cache_file):
+        """Import all species from a JSON cache file (only done once)."""
+        json_web_cache = JSONWebCache(json_cache_file)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO web_cache (species_name, web_info) '
+                'VALUES (?, ?)',
+                ((species_name, json.dumps(json_web_cache.get(species_name)))
+                 for species_name in json_web_cache.keys()))
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                              ('json_migrated', json_cache_file))
+        logging.info('[ CACHE ] Import %d species from %s to %s'
+                     % (len(json_web_cache), json_cache_file,
+                        self.cache_file))
+
+    def get(self, species_name, default=None):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT web_info FROM web_cache WHERE species_name = ?',
+                (species_name,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, species_name, web_info_tuple, validators=None):
+        """Save web info of one species.
+
+        validators: dict with 'etag', 'last_modified' and 'page_sha1' of
+                    the fetched page, see get_page_validators().
+        """
+        validators = validators or {}
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO web_cache (species_name, web_info, '
+                'etag, last_modified, page_sha1, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (species_name, json.dumps(list(web_info_tuple)),
+                 validators.get('etag'), validators.get('last_modified'),
+                 validators.get('page_sha1'), time.time()))
+            self.conn.execute('DELETE FROM fetch_job WHERE species_name = ?',
+                              (species_name,))
+
+    def start_fetch_job(self, species_name_list):
+        """Record the species about to be fetched."""
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM fetch_job')
+            self.conn.executemany('INSERT OR IGNORE INTO fetch_job VALUES (?)',
+                                  ((_,) for _ in species_name_list))
+
+    def get_fetch_job_species_names(self):
+        """Species of the last fetch not fetched yet."""
+        with self._lock:
+            return [_[0] for _ in self.conn.execute(
+                'SELECT species_name FROM fetch_job')]
+
+    def get_validators(self, species_name):
+        """Return validators dict saved by put(), or None."""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT etag, last_modified, page_sha1 FROM web_cache '
+                'WHERE species_name = ?', (species_name,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('etag', 'last_modified', 'page_sha1'), row))
+
+    def touch(self, species_name):
+        """Mark the entry as fresh (page did not change)."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE web_cache SET fetched_at = ? WHERE species_name = ?',
+                (time.time(), species_name))
+
+    def get_stale_species_names(self, species_name_list, max_age):
+        """Return species in cache fetched more than max_age seconds ago."""
+        oldest_fetched_at = time.time() - max_age
+        stale_species_name_list = []
+        with self._lock:
+            for species_name in species_name_list:
+                row = self.conn.execute(
+                    'SELECT fetched_at FROM web_cache '
+                    'WHERE species_name = ?', (species_name,)).fetchone()
+                if row is not None and \
+                        (row[0] is None or row[0] < oldest_fetched_at):
+                    stale_species_name_list.append(species_name)
+        return stale_species_name_list
+
+    def keys(self):
+        with self._lock:
+            return [_[0] for _ in self.conn.execute(
+                'SELECT species_name FROM web_cache')]
+
+    def __contains__(self, species_name):
+        return self.get(species_name) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM web_cache').fetchone()[0]
+
+    def compact(self):
+        """Reclaim space left by replaced entries."""
+        with self._lock:
+            self.conn.execute('VACUUM')
+
+    def close(self):
+        self.conn.close()
+
+
+class WebPageArchive(object):
+    """Archive of raw fetched pages, one zlib compressed row per species.
+
+    Only the parsed web info tuple is kept in the web cache. With the raw
+    pages archived, an improved parser can be run again on all pages
+    without any request, see reparse_web_cache().
+
+    >>> page_archive = WebPageArchive("web_pages.sqlite")
+    >>> page_archive.put("Stellaria media", page_text, validators)
+    >>> page_text = page_archive.get("Stellaria media")
+    """
+    def __init__(self, archive_file=LOCAL_PAGE_ARCHIVE_FILE):
+        self.archive_file = archive_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(archive_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # Pages can be fetched again, no need to sync on every commit
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS web_page '
+                              '(species_name TEXT PRIMARY KEY, '
+                              'page BLOB NOT NULL, '
+                              'validators TEXT, '
+                              'fetched_at REAL)')
+
+    def put(self, species_name, page, validators=None):
+        """Save the raw page of one species, replacing the older one."""
+        compressed_page = zlib.compress(page.encode('utf-8'))
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO web_page VALUES (?, ?, ?, ?)',
+                (species_name, sqlite3.Binary(compressed_page),
+                 json.dumps(validators or {}), time.time()))
+
+    def get(self, species_name, default=None):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT page FROM web_page WHERE species_name = ?',
+                (species_name,)).fetchone()
+        if row is None:
+            return default
+        return zlib.decompress(bytes(row[0])).decode('utf-8')
+
+    def iter_pages(self, batch_size=REPARSE_BATCH_SIZE):
+        """Yield lists of (species_name, page, validators), batch_size
+        pages per list, so that the whole archive is never in memory.
+        """
+        with self._lock:
+            species_name_list = [_[0] for _ in self.conn.execute(
+                'SELECT species_name FROM web_page ORDER BY species_name')]
+        for i in range(0, len(species_name_list), batch_size):
+            batch_name_list = species_name_list[i:i + batch_size]
+            with self._lock:
+                rows = self.conn.execute(
+                    'SELECT species_name, page, validators FROM web_page '
+                    'WHERE species_name IN (%s)'
+                    % ', '.join('?' * len(batch_name_list)),
+                    batch_name_list).fetchall()
+            yield [(species_name,
+                    zlib.decompress(bytes(page)).decode('utf-8'),
+                    json.loads(validators or '{}'))
+                   for species_name, page, validators in rows]
+
+    def keys(self):
+        with self._lock:
+            return [_[0] for _ in self.conn.execute(
+                'SELECT species_name FROM web_page')]
+
+    def __contains__(self, species_name):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT 1 FROM web_page WHERE species_name = ?',
+                (species_name,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM web_page').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def _parse_archived_page(archived_page):
+    """Parse one (species_name, page, validators) from WebPageArchive."""
+    species_name, page, validators = archived_page
+    try:
+        return species_name, _parse_web_page(species_name, page), None
+    except Exception as e:
+        return species_name, None, '%s' % e
+
+
+def reparse_web_cache(archive_file=LOCAL_PAGE_ARCHIVE_FILE,
+                      process_num=None):
+    """Rebuild the web cache from archived pages, without any request.
+
+    Pages are parsed in parallel by process_num processes (default:
+    PARSE_PROCESS_NUM). Return the number of species parsed again.
+    """
+    if not os.path.isfile(archive_file):
+        logging.error(' *  Page archive does not exist: %s' % archive_file)
+        return 0
+    page_archive = WebPageArchive(archive_file)
+    web_cache = open_web_cache()
+    logging.info('[ CACHE ] Reparsing %d archived pages from %s ...'
+                 % (len(page_archive), archive_file))
+    process_num = process_num or PARSE_PROCESS_NUM or None
+    if ProcessPoolExecutor is not None:
+        executor = ProcessPoolExecutor(process_num)
+        parse_map = executor.map
+    else:
+        executor = None
+        parse_map = map
+    parsed_num = failed_num = 0
+    try:
+        for archived_page_list in page_archive.iter_pages():
+            validators_dict = dict((_[0], _[2]) for _ in archived_page_list)
+            for species_name, pretty_info_tuple, error in parse_map(
+                    _parse_archived_page, archived_page_list):
+                if error is not None:
+                    failed_num += 1
+                    logging.error('Cannot parse archived page: %s (%s)'
+                                  % (species_name, error))
+                    continue
+                web_cache.put(species_name, pretty_info_tuple,
+                              validators_dict[species_name])
+                parsed_num += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        page_archive.close()
+        web_cache.close()
+    logging.info('[ CACHE ] Reparsed: %d, failed: %d'
+                 % (parsed_num, failed_num))
+    return parsed_num
+
+
+WEB_CACHE_BACKENDS = {
+    'json': JSONWebCache,
+    'sqlite': SQLiteWebCache,
+}
+
+
+def open_web_cache(backend=None):
+    """Open the local web cache with the backend named in WEB_CACHE_BACKEND.
+    """
+    backend = backend or WEB_CACHE_BACKEND
+    if backend not in WEB_CACHE_BACKENDS:
+        error_msg = ("Unknown web cache backend: %s (choose from: %s)"
+                     % (backend, ', '.join(sorted(WEB_CACHE_BACKENDS))))
+        logging.error(error_msg)
+        raise ValueError(error_msg)
+    return WEB_CACHE_BACKENDS[backend]()
+
+
+def get_offline_index_file(offline_data_file, key_column_index=2):
+    """Index file of the data file, one for each key column."""
+    return '%s.col%d%s' % (offline_data_file, key_column_index,
+                           OFFLINE_INDEX_SUFFIX)
+
+
+class OfflineDataIndex(object):
+    """Persistent index of the offline data file, keyed by latin name.
+
+    The index is a SQLite3 file next to the data file, one for each key
+    column. It is built once and only rebuilt when the data file changed
+    (mtime and size are checked first, then the SHA1 of the content). The
+    last OFFLINE_INDEX_ROW_CACHE_SIZE rows looked up are kept in memory.
+    Lookups work like a dictionary, from any thread:
+
+    >>> index = OfflineDataIndex("data.xlsx")
+    >>> "Stellaria media" in index
+    >>> offline_info_tuple = index["Stellaria media"]
+
+    data_row_list: Rows of the data file if already parsed, used instead of
+                   reading the data file if the index has to be rebuilt.
+                   Dropped after the rebuild.
+    build:         Rebuild the index if out of date. If False, only check
+                   it, the result is in up_to_date.
+    """
+    def __init__(self, offline_data_file, key_column_index=2,
+                 data_row_list=None, build=True):
+        self.offline_data_file = offline_data_file
+        self.key_column_index = key_column_index
+        self.data_row_list = data_row_list
+        self.index_file = get_offline_index_file(offline_data_file,
+                                                 key_column_index)
+        # Checked before the index file is created
+        if not os.path.isfile(offline_data_file):
+            logging.error("No such xlsx file: %s" % offline_data_file)
+            sys.exit(1)
+        if not os.access(offline_data_file, os.R_OK):
+            logging.error("Cannot read xlsx file: %s" % offline_data_file)
+            sys.exit(1)
+        self._row_cache = OrderedDict()
+        self._length = None
+        # The connection is shared by the query threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.index_file, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                          '(name TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS offline_data '
+                          '(key TEXT PRIMARY KEY, row BLOB)')
+        self.up_to_date = self._is_up_to_date()
+        if not self.up_to_date:
+            if build:
+                self.rebuild()
+        elif SHOW_GARBAGE_LOG:
+            logging.info("[ Offline Index ]  Use index file: %s"
+                         % self.index_file)
+
+    def _get_meta(self):
+        return dict(self.conn.execute('SELECT name, value FROM meta'))
+
+    def _file_sha1(self):
+        sha1 = hashlib.sha1()
+        with open(self.offline_data_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _is_up_to_date(self):
+        """Check whether the index was built from the current data file."""
+        meta = self._get_meta()
+        if meta.get('key_column_index') != str(self.key_column_index):
+            return False
+        stat = os.stat(self.offline_data_file)
+        if meta.get('mtime') == repr(stat.st_mtime) and \
+                meta.get('size') == str(stat.st_size):
+            return True
+        # mtime changed (copied or touched file), compare content hash
+        if meta.get('sha1') != self._file_sha1():
+            return False
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                              ('mtime', repr(stat.st_mtime)))
+        return True
+
+    def rebuild(self):
+        """Parse the data file and write all rows to the index file."""
+        logging.info("[ Offline Index ]  Building index file: %s"
+                     % self.index_file)
+        stat = os.stat(self.offline_data_file)
+        sha1 = self._file_sha1()
+        xlsx_file = None
+        if self.data_row_list is None:
+            xlsx_file = XlsxFile(self.offline_data_file, read_only=True)
+            row_iter = xlsx_file.iter_rows()
+        else:
+            row_iter = iter(self.data_row_list)
+        progress = Progress('index', None if self.data_row_list is None
+                            else len(self.data_row_list))
+
+        def iter_index_items():
+            for key, row_tuple in iter_data_items(row_iter,
+                                                  self.key_column_index):
+                progress.update()
+                yield key, sqlite3.Binary(pickle.dumps(row_tuple, 2))
+
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM meta')
+            self.conn.execute('DELETE FROM offline_data')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO offline_data VALUES (?, ?)',
+                iter_index_items())
+            self.conn.executemany(
+                'INSERT INTO meta VALUES (?, ?)',
+                (('mtime', repr(stat.st_mtime)),
+                 ('size', str(stat.st_size)),
+                 ('sha1', sha1),
+                 ('key_column_index', str(self.key_column_index))))
+            self._row_cache = OrderedDict()
+            self._length = None
+        if xlsx_file is not None:
+            xlsx_file.close()
+        progress.finish()
+        self.up_to_date = True
+        self.data_row_list = None
+
+    def get(self, key, default=None):
+        with self._lock:
+            row_tuple = self._row_cache.pop(key, None)
+            if row_tuple is None:
+                row = self.conn.execute(
+                    'SELECT row FROM offline_data WHERE key = ?',
+                    (key,)).fetchone()
+                if row is None:
+                    return default
+                row_tuple = pickle.loads(bytes(row[0]))
+                # Drop the least recently used row
+                if self._row_cache and \
+                        len(self._row_cache) >= OFFLINE_INDEX_ROW_CACHE_SIZE:
+                    self._row_cache.popitem(last=False)
+            self._row_cache[key] = row_tuple
+        return row_tuple
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        row_tuple = self.get(key)
+        if row_tuple is None:
+            raise KeyError(key)
+        return row_tuple
+
+    def __len__(self):
+        with self._lock:
+            if self._length is None:
+                self._length = self.conn.execute(
+                    'SELECT COUNT(*) FROM offline_data').fetchone()[0]
+        return self._length
+
+    def keys(self):
+        with self._lock:
+            return [_[0] for _ in self.conn.execute(
+                'SELECT key FROM offline_data')]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
 
 class OfflineDataCache(object):
-    def __init__(self, offline_data_file):
+    def __init__(self, offline_data_file, data_row_list=None):
         self.offline_data_file = offline_data_file
+        self.data_row_list = data_row_list
 
     def get_xlsx_data_dict(self):
         global _xlsx_data_cache_dict
-        _xlsx_data_cache_dict = \
-            XlsxFile(self.offline_data_file).get_xlsx_data_dict()
-
-
-def get_cache(query_file, offline_data_file):
-    """Generate cache dictionary for web info and offline info."""
+        if USE_OFFLINE_INDEX:
+            _xlsx_data_cache_dict = OfflineDataIndex(
+                self.offline_data_file, data_row_list=self.data_row_list)
+            return
+        if self.data_row_list is not None:
+            _xlsx_data_cache_dict = dict(iter_data_items(self.data_row_list))
+            return
+        xlsx_file = XlsxFile(self.offline_data_file, read_only=True)
+        _xlsx_data_cache_dict = xlsx_file.get_xlsx_data_dict()
+        xlsx_file.close()
+
+
+def get_cache(query_file, offline_data_file, fetch_engine=None,
+              revalidate=False, species_name_list=None, resume=False,
+              data_row_list=None):
+    """Generate cache dictionary for web info and offline info.
+
+    fetch_engine:      'threads', 'asyncio' or 'pipeline'
+                       (default: FETCH_ENGINE).
+    revalidate:        Refresh cached species fetched more than
+                       REVALIDATE_AFTER_DAYS days ago, using conditional
+                       requests.
+    species_name_list: Species names of the query file (any iterable), if
+                       already at hand. Otherwise read from the query file.
+    resume:            Fetch the species left by the interrupted fetch,
+                       instead of the species of the query missing in the
+                       web cache.
+    data_row_list:     Rows of the data file, if already parsed.
+    """
     # Web Cache
     if not _web_data_cache_dict:
-        WebInfoCacheMultithreading(query_file).get_web_dict_multithreading()
+        WebInfoCacheMultithreading(
+            query_file, fetch_engine, revalidate,
+            species_name_list, resume).get_web_dict_multithreading()
 
     # Offline Cache
     if not _xlsx_data_cache_dict:
-        OfflineDataCache(offline_data_file).get_xlsx_data_dict()
+        OfflineDataCache(offline_data_file,
+                         data_row_list).get_xlsx_data_dict()
+
+
+# One output row, fields in the same order as HEADER_TUPLE
+FinalInfo = namedtuple(
+    "FinalInfo",
+    [
+        "library_code",             # 0.  馆代码
+        "serial_number",            # 1.  流水号
+        "barcode",                  # 2.  条形码
+        "pattern_type",             # 3.  模式类型
+        "inventory",                # 4.  库存
+        "specimen_condition",       # 5.  标本状态
+        "collectors",               # 6.  采集人
+        "collection_id",            # 7.  采集号
+        "collection_date",          # 8.  采集日期
+        "collection_country",       # 9.  国家
+        "province_and_city",        # 10. 省市
+        "county",                   # 11. 区县
+        "altitude",                 # 12. 海拔
+        "negative_altitude",        # 13. 负海拔
+        "family",                   # 14. 科
+        "genus",                    # 15. 属
+        "species",                  # 16. 种
+        "namer",                    # 17. 定名人
+        "level",                    # 18. 种下等级
+        "chinese_name",             # 19. 中文名
+        "identifier",               # 20. 鉴定人
+        "identify_date",            # 21. 鉴定日期
+        "remarks",                  # 22. 备注
+        "place_name",               # 23. 地名
+        "habitat",                  # 24. 生境
+        "longitude",                # 25. 经度
+        "latitude",                 # 26. 纬度
+        "remarks_2",                # 27. 备注2
+        "inputer",                  # 28. 录入员
+        "input_date",               # 29. 录入日期
+        "habit",                    # 30. 习性
+        "body_height",              # 31. 体高
+        "DBH",                      # 32. 胸径
+        "stem",                     # 33. 茎
+        "leaf",                     # 34. 叶
+        "flower",                   # 35. 花
+        "fruit",                    # 36. 果实
+        "host"                      # 37. 寄主
+    ])
+
+# =======================================================
+# Offline info tuple
+#
+# 0.  物种编号
+# 1.  种名
+# 2.  种名（拉丁）
+# 3.  科名
+# 4.  科名（拉丁）
+# 5.  省
+# 6.  市
+# 7.  具体小地名
+# 8.  纬度
+# 9.  东经
+# 10. 海拔
+# 11. 采集日期
+# 12. 份数
+# 13. 草灌
+# 14. 采集人
+# 15. 鉴定人
+# 16. 鉴定日期
+# 17. 录入员
+# 18. 录入日期
+#
+# (index in FinalInfo, index in offline info tuple)
+OFFLINE_INFO_INDEX_MAP = (
+    (6, 14),    # collectors
+    (8, 11),    # collection_date
+    (12, 10),   # altitude
+    (14, 4),    # family
+    (19, 1),    # chinese_name
+    (20, 15),   # identifier
+    (21, 16),   # identify_date
+    (23, 7),    # place_name
+    (25, 9),    # longitude
+    (26, 8),    # latitude
+    (28, 17),   # inputer
+    (29, 18),   # input_date
+    (30, 13),   # habit
+)
+_BLANK_OFFLINE_INFO_TUPLE = tuple('' for _ in range(TOTAL_LINES))
+
+# =======================================================
+# Web info tuple
+#
+# 0.  genus
+# 1.  species
+# 2.  namer
+# 3.  habitat   # 生境
+# 4.  height
+# 5.  DBH       # 胸径
+# 6.  stem
+# 7.  leaf
+# 8.  flower
+# 9.  fruit
+# 10. host
+#
+# (index in FinalInfo, index in web info tuple)
+WEB_INFO_INDEX_MAP = (
+    (15, 0),    # genus
+    (16, 1),    # species
+    (17, 2),    # namer
+    (24, 3),    # habitat
+    (31, 4),    # body_height
+    (32, 5),    # DBH
+    (33, 6),    # stem
+    (34, 7),    # leaf
+    (35, 8),    # flower
+    (36, 9),    # fruit
+    (37, 10),   # host
+)
 
 
 class Query(object):
@@ -517,10 +2050,57 @@ class Query(object):
     ...    xlsx_data_dict)
     >>> out_tuple = q._formatted_single_output()
     """
-    def __init__(self, query_file, offline_data_file):
+    def __init__(self, query_file, offline_data_file, query_manifest=None,
+                 validator=None):
+        """query_manifest: QueryManifest of an incremental run, only query
+                        rows not done in an earlier run are queried.
+        validator:      DataValidator of the same files, its parsed rows and
+                        species names are used instead of reading the files
+                        again.
+        """
         self.query_file = query_file
         self.offline_data_file = offline_data_file
-        self.query_tuple_list = QueryParser(query_file).query_tuple
+        self.query_manifest = query_manifest
+        self.validator = validator
+        self._new_query_tuple_list = None
+        self._latin_name_matcher = None
+        if validator is not None and validator.query_row_list is not None:
+            self._query_parser = None
+        else:
+            self._query_parser = QueryParser(query_file)
+
+    def _iter_all_query_tuple(self):
+        if self._query_parser is None:
+            return iter(self.validator.query_row_list)
+        return self._query_parser.iter_query_tuple()
+
+    def _iter_query_tuple(self):
+        query_tuple_iter = self._iter_all_query_tuple()
+        if self.query_manifest is None:
+            return query_tuple_iter
+        # Only a few rows are expected to be new: keep them, so that the
+        # query file is read once
+        if self._new_query_tuple_list is None:
+            self._new_query_tuple_list = list(
+                self.query_manifest.iter_new_query_tuples(query_tuple_iter))
+        return iter(self._new_query_tuple_list)
+
+    @property
+    def query_tuple_list(self):
+        """All query tuples (the whole query file is loaded)."""
+        return list(self._iter_all_query_tuple())
+
+    def _get_query_row_num(self):
+        """Number of rows _iter_query_tuple() yields, None if it is not
+        known without reading the query file again.
+        """
+        if self.query_manifest is not None:
+            if self._new_query_tuple_list is not None:
+                return len(self._new_query_tuple_list)
+            return None
+        if self._query_parser is None:
+            return len(self.validator.query_row_list)
+        return None
 
     def _do_single_raw_query(self, one_query_tuple):
         """Do query for one species and get raw results."""
@@ -557,241 +2137,402 @@ class Query(object):
             offline_info_tuple = _xlsx_data_cache_dict[species_name]
             if SHOW_GARBAGE_LOG:
                 logging.info("    [ File Info ]  Use Cache")
+        elif FUZZY_MATCH:
+            # Misspelled name or name with author: closest data file name
+            matched_name = self._get_latin_name_matcher().resolve(
+                species_name)
+            offline_info_tuple = (None if matched_name is None
+                                  else _xlsx_data_cache_dict[matched_name])
         else:
             offline_info_tuple = None
 
         return (web_info_tuple, offline_info_tuple)
 
+    def _get_latin_name_matcher(self):
+        if self._latin_name_matcher is None:
+            # Names were already resolved by data validation
+            if self.validator is not None and \
+                    self.validator.latin_name_matcher is not None:
+                self._latin_name_matcher = self.validator.latin_name_matcher
+            else:
+                self._latin_name_matcher = LatinNameMatcher(
+                    _xlsx_data_cache_dict.keys(), get_latin_name_index())
+        return self._latin_name_matcher
+
     def _formatted_single_output(self, one_query_tuple):
         """Format raw results for single query."""
-        web_info_tuple, offline_info_tuple = \
-            self._do_single_raw_query(one_query_tuple)
-        FinalInfo = namedtuple(
-            "FinalInfo",
-            [
-                "library_code",             # 0.  馆代码
-                "serial_number",            # 1.  流水号
-                "barcode",                  # 2.  条形码
-                "pattern_type",                     # 3.  模式类型
-                "inventory",                # 4.  库存
-                "specimen_condition",       # 5.  标本状态
-                "collectors",               # 6.  采集人
-                "collection_id",            # 7.  采集号
-                "collection_date",          # 8.  采集日期
-                "collection_country",       # 9.  国家
-                "province_and_city",        # 10. 省市
-                "county",                   # 11. 区县
-                "altitude",                 # 12. 海拔
-                "negative_altitude",        # 13. 负海拔
-                "family",                   # 14. 科
-                "genus",                    # 15. 属
-                "species",                  # 16. 种
-                "namer",                    # 17. 定名人
-                "level",                    # 18. 种下等级
-                "chinese_name",             # 19. 中文名
-                "identifier",               # 20. 鉴定人
-                "identify_date",            # 21. 鉴定日期
-                "remarks",                  # 22. 备注
-                "place_name",               # 23. 地名
-                "habitat",                  # 24. 生境
-                "longitude",                # 25. 经度
-                "latitude",                 # 26. 纬度
-                "remarks_2",                # 27. 备注2
-                "inputer",                  # 28. 录入员
-                "input_date",               # 29. 录入日期
-                "habit",                    # 30. 习性
-                "body_height",              # 31. 体高
-                "DBH",                      # 32. 胸径
-                "stem",                     # 33. 茎
-                "leaf",                     # 34. 叶
-                "flower",                   # 35. 花
-                "fruit",                    # 36. 果实
-                "host"                      # 37. 寄主
-            ])
-
-        # =======================================================
-        # Offline info tuple
-        #
-        # 0.  物种编号
-        # 1.  种名
-        # 2.  种名（拉丁）
-        # 3.  科名
-        # 4.  科名（拉丁）
-        # 5.  省
-        # 6.  市
-        # 7.  具体小地名
-        # 8.  纬度
-        # 9.  东经
-        # 10. 海拔
-        # 11. 采集日期
-        # 12. 份数
-        # 13. 草灌
-        # 14. 采集人
-        # 15. 鉴定人
-        # 16. 鉴定日期
-        # 17. 录入员
-        # 18. 录入日期
-        #
-        if not offline_info_tuple:
-            offline_info_tuple = tuple(['' for _ in range(TOTAL_LINES)])
-        # =======================================================
-
-        # =======================================================
-        # Web info tuple
-        #
-        # 0.  genus
-        # 1.  species
-        # 2.  namer
-        # 3.  habitat   # 生境
-        # 4.  height
-        # 5.  DBH       # 胸径
-        # 6.  stem
-        # 7.  leaf
-        # 8.  flower
-        # 9.  fruit
-        # 10. host
-        #
-        # if not web_info_tuple:
-        #     web_info_tuple = tuple(['' for _ in xrange(TOTAL_LINES)])
-        # =======================================================
-
-        # Get values for each entry
-        library_code = LIBRARY_CODE
-        pattern_type = ''
-        inventory = ''
-        specimen_condition = ''
-        collection_country = COLLECTION_COUNTRY
-        county = ''
-        negative_altitude = ''
-        level = ''
-        remarks = ''
-        remarks_2 = ''
+        row = self._get_species_row(one_query_tuple[2])
 
         # Infos from qeury file
         try:
-            serial_number = one_query_tuple[0]
-            barcode = str(one_query_tuple[1]).zfill(8)
+            row[1] = one_query_tuple[0]
+            row[2] = str(one_query_tuple[1]).zfill(8)
+            row[7] = "%s-%s" % (row[7], one_query_tuple[3])
         except IndexError as e:
             error_msg = "Illegal query file format.\n%s" % e
             logging.error(error_msg)
             raise IndexError(error_msg)
 
+        return FinalInfo._make(row)
+
+    def _get_species_row(self, species_name):
+        """Format the part of the output row shared by all queries of one
+        species.
+
+        Serial number and barcode are left blank, and collection id holds
+        only the species number from the offline data (without the copy
+        number).
+        """
+        one_query_tuple = ('', '', species_name, '')
+        web_info_tuple, offline_info_tuple = \
+            self._do_single_raw_query(one_query_tuple)
+
+        # Offline info tuple and web info tuple: see the index maps above
+        if not offline_info_tuple:
+            offline_info_tuple = _BLANK_OFFLINE_INFO_TUPLE
+
+        # Constant values, and blank for entries we do not know
+        row = [''] * TOTAL_LINES
+        row[0] = LIBRARY_CODE
+        row[9] = COLLECTION_COUNTRY
+
         # Infos from offline data file
         try:
-            collection_id = "%s-%s" % (
-                offline_info_tuple[0], one_query_tuple[3])
-            chinese_name = offline_info_tuple[1]
-            family = offline_info_tuple[4]
-            province_and_city = "%s,%s" % offline_info_tuple[5:7]
-            place_name = offline_info_tuple[7]
-            longitude = offline_info_tuple[9]
-            latitude = offline_info_tuple[8]
-            altitude = offline_info_tuple[10]
-            collection_date = offline_info_tuple[11]
-            habit = offline_info_tuple[13]
-            collectors = offline_info_tuple[14]
-            identifier = offline_info_tuple[15]
-            identify_date = offline_info_tuple[16]
-            inputer = offline_info_tuple[17]
-            input_date = offline_info_tuple[18]
+            for field_index, offline_index in OFFLINE_INFO_INDEX_MAP:
+                row[field_index] = offline_info_tuple[offline_index]
+            row[7] = offline_info_tuple[0]
+            row[10] = "%s,%s" % offline_info_tuple[5:7]
         except IndexError as e:
             error_msg = "Illegal offline data format.\n%s" % e
             logging.error(error_msg)
             raise IndexError(error_msg)
 
         try:
-            genus = web_info_tuple[0] if web_info_tuple[0] \
-                else one_query_tuple[2].split()[0]
-            species = web_info_tuple[1] if web_info_tuple[1] \
-                else ' '.join(one_query_tuple[2].split()[1:])
-            namer = web_info_tuple[2]
-            habitat = web_info_tuple[3]
-            body_height = web_info_tuple[4]
-            DBH = web_info_tuple[5]
-            stem = web_info_tuple[6]
-            leaf = web_info_tuple[7]
-            flower = web_info_tuple[8]
-            fruit = web_info_tuple[9]
-            host = web_info_tuple[10]
+            for field_index, web_index in WEB_INFO_INDEX_MAP:
+                row[field_index] = web_info_tuple[web_index]
+            if not row[15]:
+                row[15] = one_query_tuple[2].split()[0]
+            if not row[16]:
+                row[16] = ' '.join(one_query_tuple[2].split()[1:])
         except Exception as e:
             logging.warning("Skip... Cannot get info from web for:  %s. %s" %
                             (one_query_tuple[2], e))
-            genus = one_query_tuple[2].split()[0]
-            species, namer, habitat, body_height, DBH, stem, leaf, \
-                flower, fruit, host = ['' for x in range(10)]
-
-        f = FinalInfo(
-            library_code=library_code,
-            serial_number=serial_number,
-            barcode=barcode,
-            pattern_type=pattern_type,
-            inventory=inventory,
-            specimen_condition=specimen_condition,
-            collectors=collectors,
-            collection_id=collection_id,
-            collection_date=collection_date,
-            collection_country=collection_country,
-            province_and_city=province_and_city,
-            county=county,
-            altitude=altitude,
-            negative_altitude=negative_altitude,
-            family=family,
-            genus=genus,
-            species=species,
-            namer=namer,
-            level=level,
-            chinese_name=chinese_name,
-            identifier=identifier,
-            identify_date=identify_date,
-            remarks=remarks,
-            place_name=place_name,
-            habitat=habitat,
-            longitude=longitude,
-            latitude=latitude,
-            remarks_2=remarks_2,
-            inputer=inputer,
-            input_date=input_date,
-            habit=habit,
-            body_height=body_height,
-            DBH=DBH,
-            stem=stem,
-            leaf=leaf,
-            flower=flower,
-            fruit=fruit,
-            host=host
-            )
-
-        return f
+            for field_index, web_index in WEB_INFO_INDEX_MAP:
+                row[field_index] = ''
+            row[15] = one_query_tuple[2].split()[0]
+
+        return row
+
+    def _format_query_batch(self, query_tuple_list, species_row_dict):
+        """Format a batch of query rows column by column.
+
+        Species names are looked up in the caches once per distinct name (a
+        hash join, species_row_dict is kept between batches), barcodes are
+        padded in one pass, and each output row only copies the row of its
+        species and fills in the three per query columns.
+        """
+        try:
+            serial_number_column = [_[0] for _ in query_tuple_list]
+            barcode_column = [str(_[1]).zfill(8) for _ in query_tuple_list]
+            species_name_column = [_[2] for _ in query_tuple_list]
+            copy_number_column = [_[3] for _ in query_tuple_list]
+        except IndexError as e:
+            error_msg = "Illegal query file format.\n%s" % e
+            logging.error(error_msg)
+            raise IndexError(error_msg)
+
+        for species_name in species_name_column:
+            if species_name not in species_row_dict:
+                species_row_dict[species_name] = self._get_species_row(
+                    species_name)
 
-    def do_multi_query(self):
-        """Do multiple query."""
         out_tuple_list = []
+        make_final_info = FinalInfo._make
+        for serial_number, barcode, species_name, copy_number in zip(
+                serial_number_column, barcode_column, species_name_column,
+                copy_number_column):
+            row = species_row_dict[species_name][:]
+            row[1] = serial_number
+            row[2] = barcode
+            row[7] = "%s-%s" % (row[7], copy_number)
+            out_tuple_list.append(make_final_info(row))
+        return out_tuple_list
 
+    def _prepare_cache(self):
         logging.info("%sThe program will search Internet first. "
                      "This may take some time%s" % (THIN_BAR, THIN_BAR))
 
         # Generate global cache dict for web and offline data
-        get_cache(self.query_file, self.offline_data_file)
+        data_row_list = None
+        if self.validator is not None:
+            data_row_list = self.validator.data_row_list
+        if self.query_manifest is not None:
+            species_name_iter = (_[2] for _ in self._iter_query_tuple())
+        elif self.validator is not None:
+            species_name_iter = self.validator.query_species_name_set
+        else:
+            species_name_iter = self._query_parser.iter_species_names()
+        get_cache(self.query_file, self.offline_data_file,
+                  species_name_list=species_name_iter,
+                  data_row_list=data_row_list)
+        if self.validator is not None:
+            # Not needed any more, the offline cache was built
+            self.validator.data_row_list = None
 
         logging.info("\n%sStart job for each species...%s"
                      % (THIN_BAR, THIN_BAR))
 
+    def iter_batch_query(self):
+        """Yield output rows, formatted QUERY_BATCH_SIZE query rows at a
+        time by _format_query_batch(). Give the same rows as
+        iter_row_query().
+        """
+        self._prepare_cache()
+        species_row_dict = {}
+        query_tuple_iter = self._iter_query_tuple()
+        progress = Progress('query', self._get_query_row_num())
+        while True:
+            query_tuple_list = list(islice(query_tuple_iter,
+                                           QUERY_BATCH_SIZE))
+            if not query_tuple_list:
+                break
+            for out_tuple in self._format_query_batch(query_tuple_list,
+                                                      species_row_dict):
+                yield out_tuple
+            progress.update(len(query_tuple_list))
+        progress.finish()
+
+    def iter_row_query(self):
+        """Yield output rows one by one. Each query is logged only with
+        SHOW_GARBAGE_LOG, progress is published instead.
+        """
+        self._prepare_cache()
+        query_tuple_iter = self._iter_query_tuple()
+        progress = Progress('query', self._get_query_row_num())
+
         # Do query for each entry
-        for i, each_query_tuple in enumerate(self.query_tuple_list):
-            logging.info("[ %d ]   %s\n" % (i+1, each_query_tuple[2]))
-            logging.info("         Copy Number:  %s" % each_query_tuple[3])
-            logging.info("       Serial Number:  %s" % each_query_tuple[0])
-            logging.info("             Barcode:  %s\n"
-                         % str(each_query_tuple[1]).zfill(8))
-            out_tuple = self._formatted_single_output(each_query_tuple)
-            out_tuple_list.append(out_tuple)
+        for i, each_query_tuple in enumerate(query_tuple_iter):
+            if SHOW_GARBAGE_LOG:
+                logging.info("[ %d ]   %s\n" % (i+1, each_query_tuple[2]))
+                logging.info("         Copy Number:  %s"
+                             % each_query_tuple[3])
+                logging.info("       Serial Number:  %s"
+                             % each_query_tuple[0])
+                logging.info("             Barcode:  %s\n"
+                             % str(each_query_tuple[1]).zfill(8))
+            yield self._formatted_single_output(each_query_tuple)
+            progress.update()
+        progress.finish()
+
+    def iter_multi_query(self):
+        """Yield output rows as query rows are read, in QUERY_MODE ('batch'
+        or 'row'). Memory used does not grow with the query file.
+
+        >>> write_to_xlsx_file(q.iter_multi_query(), "out.xlsx")
+        """
+        if QUERY_MODE == 'batch':
+            return self.iter_batch_query()
+        return self.iter_row_query()
 
-        return out_tuple_list
+    def do_multi_query(self):
+        """Do multiple query, return a list of all output rows."""
+        return list(self.iter_multi_query())
+
+    def do_batch_query(self):
+        return list(self.iter_batch_query())
+
+    def do_row_query(self):
+        return list(self.iter_row_query())
+
+
+class XlsxStreamWriter(object):
+    """Lightweight xlsx writer with one sheet, rows go to disk at once.
+
+    Each appended row is written as XML to a temporary file, with strings
+    inline (no shared string table), and save() copies that file into the
+    xlsx zip archive. Memory used does not depend on the number of rows.
+    Values can be str, numbers, bool, date, datetime or None, anything else
+    (and nan or inf, which xlsx cannot store as numbers) is written as text.
 
+    If save() fails because the file cannot be opened, nothing is lost and
+    save() can be called again with another file name. close() removes the
+    temporary file if the rows are not saved, use the writer in a with
+    statement:
 
-def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx"):
+    >>> with XlsxStreamWriter("Specimen") as xlsx_writer:
+    ...     xlsx_writer.append(('a', 1, datetime.date(2016, 1, 1)))
+    ...     xlsx_writer.save("out.xlsx")
+    """
+    CONTENT_TYPES_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>')
+    ROOT_RELS_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>')
+    WORKBOOK_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/'
+        'spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.'
+        'org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>')
+    WORKBOOK_RELS_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>')
+    # Cell styles: 0 general, 1 date (numFmtId 14), 2 datetime (22)
+    STYLES_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/'
+        'spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font>'
+        '</fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/>'
+        '<diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+        'borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" '
+        'applyNumberFormat="1"/>'
+        '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" '
+        'applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" '
+        'builtinId="0"/></cellStyles>'
+        '</styleSheet>')
+    SHEET_HEAD_XML = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/'
+        'spreadsheetml/2006/main"><sheetData>')
+    SHEET_TAIL_XML = '</sheetData></worksheet>'
+    # Characters not allowed in XML 1.0
+    ILLEGAL_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+    EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+    def __init__(self, sheet_title='Sheet1'):
+        self.sheet_title = sheet_title
+        self.row_num = 0
+        self._column_letter_list = []
+        fd, self._sheet_file = tempfile.mkstemp(suffix='.xml',
+                                                prefix='specimen_info.')
+        self._sheet_f = io.open(fd, 'w', encoding='utf-8')
+        self._sheet_f.write(self.SHEET_HEAD_XML)
+
+    def _column_letter(self, column_index):
+        while len(self._column_letter_list) <= column_index:
+            self._column_letter_list.append(
+                openpyxl.utils.get_column_letter(
+                    len(self._column_letter_list) + 1))
+        return self._column_letter_list[column_index]
+
+    def _cell_xml(self, reference, value):
+        if isinstance(value, bool):
+            return '<c r="%s" t="b"><v>%d</v></c>' % (reference, value)
+        if isinstance(value, numbers.Integral):
+            return '<c r="%s"><v>%d</v></c>' % (reference, value)
+        if isinstance(value, numbers.Real) and \
+                not math.isinf(value) and not math.isnan(value):
+            return '<c r="%s"><v>%r</v></c>' % (reference, float(value))
+        if isinstance(value, datetime.datetime):
+            days = (value.replace(tzinfo=None) - self.EXCEL_EPOCH)
+            return '<c r="%s" s="2"><v>%r</v></c>' % (
+                reference, days.days + days.seconds / 86400.0)
+        if isinstance(value, datetime.date):
+            days = (value - self.EXCEL_EPOCH.date()).days
+            return '<c r="%s" s="1"><v>%d</v></c>' % (reference, days)
+        text = xml_escape(self.ILLEGAL_XML_CHARS_RE.sub('', '%s' % value))
+        return ('<c r="%s" t="inlineStr"><is><t xml:space="preserve">%s'
+                '</t></is></c>' % (reference, text))
+
+    def append(self, row):
+        self.row_num += 1
+        cell_xml_list = ['<row r="%d">' % self.row_num]
+        for i, value in enumerate(row):
+            if value is None:
+                continue
+            cell_xml_list.append(self._cell_xml(
+                '%s%d' % (self._column_letter(i), self.row_num), value))
+        cell_xml_list.append('</row>')
+        self._sheet_f.write(''.join(cell_xml_list))
+
+    def save(self, filename):
+        """Write the xlsx file, then remove the temporary sheet file."""
+        if not self._sheet_f.closed:
+            self._sheet_f.write(self.SHEET_TAIL_XML)
+            self._sheet_f.close()
+        archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED,
+                                  allowZip64=True)
+        try:
+            archive.writestr('[Content_Types].xml', self.CONTENT_TYPES_XML)
+            archive.writestr('_rels/.rels', self.ROOT_RELS_XML)
+            archive.writestr('xl/workbook.xml', self.WORKBOOK_XML
+                             % xml_escape(self.sheet_title, {'"': '&quot;'}))
+            archive.writestr('xl/_rels/workbook.xml.rels',
+                             self.WORKBOOK_RELS_XML)
+            archive.writestr('xl/styles.xml', self.STYLES_XML)
+            archive.write(self._sheet_file, 'xl/worksheets/sheet1.xml')
+        finally:
+            archive.close()
+        os.remove(self._sheet_file)
+
+    def close(self):
+        """Remove the temporary sheet file, if not removed by save()."""
+        if not self._sheet_f.closed:
+            self._sheet_f.close()
+        if os.path.isfile(self._sheet_file):
+            os.remove(self._sheet_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _get_row_num(row_iterable):
+    """len() of a list of rows, None for an iterator."""
+    try:
+        return len(row_iterable)
+    except TypeError:
+        return None
+
+
+def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx",
+                       streaming=True):
     """Write tuple list to xlsx file.
 
+    out_tuple_list can be any iterable of rows, for example
+    Query.iter_multi_query().
+
+    streaming: Write rows to disk as they arrive with XlsxStreamWriter.
+               Set to False to build an openpyxl workbook in memory.
+
     >>> write_to_xlsx_file([('a', 'b', 'c'), ('e', 'f', 'g')])
 
     +-----+-----+-----+
@@ -800,40 +2541,65 @@ def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx"):
     |  e  |  f  |  g  |
     +-----+-----+-----+
     """
-    out_wb = openpyxl.Workbook()
-
-    ws1 = out_wb.active
-    ws1.title = "Specimen"
+    if streaming:
+        out_wb = ws1 = XlsxStreamWriter("Specimen")
+    else:
+        out_wb = openpyxl.Workbook()
+        ws1 = out_wb.active
+        ws1.title = "Specimen"
 
     # Header
     ws1.append(HEADER_TUPLE)
 
-    # Content
-    for i, tuple_row in enumerate(out_tuple_list):
-        ws1.append(tuple_row)
     try:
-        out_wb.save(filename=xlsx_outfile_name)
-        logging.info("%s[ xlsx File ]  Save results to %s%s"
-                     % (THIN_BAR, xlsx_outfile_name, THIN_BAR))
-        logging.warning("The result was saved to xlsx file: %s"
-                        % xlsx_outfile_name)
-    except IOError as e:
-        basename, dot, ext = xlsx_outfile_name.rpartition(".")
-        alt_xlsx_outfile = "%s.alt.%s" % (basename, ext)
-        logging.info("\n%s[ xlsx File ]  Save results to %s%s"
-                     % (THIN_BAR, alt_xlsx_outfile, THIN_BAR))
-        logging.error(" *  [PERMISSION DENIED] Is file"
-                      " [ %s ] open?\n    ( %s )"
-                      % (xlsx_outfile_name, e))
-        out_wb.save(filename=alt_xlsx_outfile)
-        logging.warning(" @  Don't worry, you won't lose anything.\n")
-        logging.warning("The result was saved to another file: %s"
-                        % alt_xlsx_outfile)
+        # Content
+        progress = Progress('write xlsx', _get_row_num(out_tuple_list))
+        for tuple_row in out_tuple_list:
+            ws1.append(tuple_row)
+            progress.update()
+        progress.finish()
+        try:
+            out_wb.save(filename=xlsx_outfile_name)
+            logging.info("%s[ xlsx File ]  Save results to %s%s"
+                         % (THIN_BAR, xlsx_outfile_name, THIN_BAR))
+            logging.warning("The result was saved to xlsx file: %s"
+                            % xlsx_outfile_name)
+        except IOError as e:
+            basename, dot, ext = xlsx_outfile_name.rpartition(".")
+            alt_xlsx_outfile = "%s.alt.%s" % (basename, ext)
+            logging.info("\n%s[ xlsx File ]  Save results to %s%s"
+                         % (THIN_BAR, alt_xlsx_outfile, THIN_BAR))
+            logging.error(" *  [PERMISSION DENIED] Is file"
+                          " [ %s ] open?\n    ( %s )"
+                          % (xlsx_outfile_name, e))
+            # The output file could not be opened, nothing is lost yet
+            out_wb.save(filename=alt_xlsx_outfile)
+            logging.warning(" @  Don't worry, you won't lose anything.\n")
+            logging.warning("The result was saved to another file: %s"
+                            % alt_xlsx_outfile)
+    finally:
+        if streaming:
+            # Temporary file of the rows, if they could not be saved
+            out_wb.close()
 
 
 def write_to_sqlite3(out_tuple_list, sqlite3_file="specimen.sqlite"):
-    """Write tuple list to sqlite3 file."""
-    create_sql = """create Table specimen (
+    """Write tuple list (or any iterable of rows) to sqlite3 file.
+
+    Rows are upserted on barcode: running the same job again replaces the
+    rows written before instead of adding duplicates. Return the number of
+    rows written.
+
+    The file is opened in WAL mode and rows are committed every
+    SQLITE_CHUNK_SIZE rows. Into a new table rows are bulk inserted without
+    index, then duplicate barcodes are removed (the last row wins) and the
+    indexes are built. Tables written by older versions, without the
+    unique barcode index, are cleaned up the same way.
+
+    sqlite3.IntegrityError and sqlite3.ProgrammingError are logged and
+    raised again, chunks committed before the error are kept.
+    """
+    create_sql = """CREATE TABLE IF NOT EXISTS specimen (
             id INTEGER PRIMARY KEY,
             library_code NVARCHAR(10),
             serial_number INTEGER NOT NULL,
@@ -875,247 +2641,820 @@ def write_to_sqlite3(out_tuple_list, sqlite3_file="specimen.sqlite"):
             host NVARCHAR(100)
         )
     """
+    column_names = FinalInfo._fields
+    insert_sql = 'INSERT INTO specimen ({0}) VALUES ({1})'.format(
+        ','.join(column_names), ','.join('?' * len(column_names)))
+    if sqlite3.sqlite_version_info >= (3, 24, 0):
+        upsert_sql = '{0} ON CONFLICT(barcode) DO UPDATE SET {1}'.format(
+            insert_sql, ','.join('%s=excluded.%s' % (_, _)
+                                 for _ in column_names if _ != 'barcode'))
+    else:
+        upsert_sql = insert_sql.replace('INSERT', 'INSERT OR REPLACE', 1)
+
     logging.info("%s[ SQLite3 File ]  Saving result to SQLite3 "
                  "database file:  %s%s"
                  % (THIN_BAR, sqlite3_file, THIN_BAR))
     conn = sqlite3.connect(sqlite3_file)
-    try:
-        conn.execute(create_sql)
-        logging.info("Create SQLite3 database file:  %s" % sqlite3_file)
-    except sqlite3.OperationalError as e:
-        logging.warning("SQLite3 file already exists: %s. (%s)"
-                        % (sqlite3_file, e))
-        logging.warning(" *  There may already be information in SQLite3 "
-                        "db file.")
-        logging.warning(" *  Make sure you do not insert duplicate values.\n")
-
-    tuple_of_final_info = (
-                "library_code",             # 0.  馆代码
-                "serial_number",            # 1.  流水号
-                "barcode",                  # 2.  条形码
-                "pattern_type",                     # 3.  模式类型
-                "inventory",                # 4.  库存
-                "specimen_condition",       # 5.  标本状态
-                "collectors",               # 6.  采集人
-                "collection_id",            # 7.  采集号
-                "collection_date",          # 8.  采集日期
-                "collection_country",       # 9.  国家
-                "province_and_city",        # 10. 省市
-                "county",                   # 11. 区县
-                "altitude",                 # 12. 海拔
-                "negative_altitude",        # 13. 负海拔
-                "family",                   # 14. 科
-                "genus",                    # 15. 属
-                "species",                  # 16. 种
-                "namer",                    # 17. 定名人
-                "level",                    # 18. 种下等级
-                "chinese_name",             # 19. 中文名
-                "identifier",               # 20. 鉴定人
-                "identify_date",            # 21. 鉴定日期
-                "remarks",                  # 22. 备注
-                "place_name",               # 23. 地名
-                "habitat",                  # 24. 生境
-                "longitude",                # 25. 经度
-                "latitude",                 # 26. 纬度
-                "remarks_2",                # 27. 备注2
-                "inputer",                  # 28. 录入员
-                "input_date",               # 29. 录入日期
-                "habit",                    # 30. 习性
-                "body_height",              # 31. 体高
-                "DBH",                      # 32. 胸径
-                "stem",                     # 33. 茎
-                "leaf",                     # 34. 叶
-                "flower",                   # 35. 花
-                "fruit",                    # 36. 果实
-                "host"                      # 37. 寄主
-            )
-
-    insert_query = '''INSERT INTO specimen ({0}) VALUES ({1})'''.format(
-               (','.join(tuple_of_final_info)),
-               ','.join('?'*len(tuple_of_final_info)))
-
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute('PRAGMA %s' % pragma)
+    row_num = 0
     try:
         with conn:
-            logging.info("    -> Start value insertion ...")
-            conn.executemany(insert_query, out_tuple_list)
-            logging.info("    -> Finished insertion.")
+            conn.execute(create_sql)
+        has_barcode_index = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = "
+            "'specimen_barcode_index'").fetchone() is not None
+        logging.info("    -> Start value %s ..."
+                     % ("upsert" if has_barcode_index else "insertion"))
+        progress = Progress('write sqlite', _get_row_num(out_tuple_list))
+        out_tuple_iter = iter(out_tuple_list)
+        while True:
+            out_tuple_chunk = list(islice(out_tuple_iter, SQLITE_CHUNK_SIZE))
+            if not out_tuple_chunk:
+                break
+            with conn:
+                conn.executemany(
+                    upsert_sql if has_barcode_index else insert_sql,
+                    out_tuple_chunk)
+            row_num += len(out_tuple_chunk)
+            progress.update(len(out_tuple_chunk))
+        progress.finish()
+        if not has_barcode_index:
+            logging.info("    -> Remove duplicate barcodes and build "
+                         "indexes ...")
+            with conn:
+                conn.execute('DELETE FROM specimen WHERE id NOT IN '
+                             '(SELECT MAX(id) FROM specimen GROUP BY barcode)')
+                conn.execute('CREATE UNIQUE INDEX specimen_barcode_index '
+                             'ON specimen (barcode)')
+                conn.execute('CREATE INDEX IF NOT EXISTS '
+                             'specimen_serial_number_index '
+                             'ON specimen (serial_number)')
+        logging.info("    -> Finished. %d rows written." % row_num)
     except sqlite3.IntegrityError as e:
         logging.error(e)
+        raise
     except sqlite3.ProgrammingError as e:
         logging.error("Number not correct. (%s)" % e)
+        raise
     finally:
         conn.close()
+    return row_num
 
 
-def data_validation(data_file, query_file):
-    """Validate data and query files before program run.
+class QueryManifest(object):
+    """Fingerprints of query rows already written to the SQLite3 output,
+    for incremental runs.
 
-    This will save time. If there is error in data file, program may crush
-    after long time run. So it's better to validate data file before running.
+    A fingerprint is made of serial number, barcode, species name and copy
+    number. It is kept by barcode in the query_manifest table of the output
+    file, next to the specimen table.
+
+    >>> query_manifest = QueryManifest("specimen.sqlite")
+    >>> q = Query(query_file, offline_data_file, query_manifest)
+    >>> out_tuple_list = q.do_multi_query()   # Only new or changed rows
+    >>> write_to_sqlite3(out_tuple_list, "specimen.sqlite")
+    >>> query_manifest.save()                 # After the rows are written
     """
-    # Get file tuple list
-    data_file_tuple_list = XlsxFile(data_file).xlsx_matrix
-    query_file_tuple_list = XlsxFile(query_file).xlsx_matrix
+    def __init__(self, sqlite3_file):
+        self.sqlite3_file = sqlite3_file
+        # {barcode: fingerprint} of rows yielded, saved by save()
+        self._new_fingerprint_dict = {}
+        self.conn = sqlite3.connect(sqlite3_file)
+        for pragma in SQLITE_PRAGMAS:
+            self.conn.execute('PRAGMA %s' % pragma)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS query_manifest '
+                              '(barcode TEXT PRIMARY KEY, '
+                              'fingerprint TEXT NOT NULL)')
 
-    logging.info(BAR)
-    logging.info(" == DATA VALIDATION ==")
+    @staticmethod
+    def get_fingerprint(one_query_tuple):
+        serial_number, barcode, species_name, same_species_num = \
+            one_query_tuple[:4]
+        species_name = " ".join(('%s' % species_name).split())
+        return hashlib.sha1('\t'.join(
+            '%s' % _ for _ in (serial_number, str(barcode).zfill(8),
+                               species_name, same_species_num)
+        ).encode('utf-8')).hexdigest()
+
+    def iter_new_query_tuples(self, query_tuple_iter, batch_size=500):
+        """Yield query tuples not written before, or changed since."""
+        query_tuple_iter = iter(query_tuple_iter)
+        while True:
+            query_tuple_list = list(islice(query_tuple_iter, batch_size))
+            if not query_tuple_list:
+                break
+            barcode_list = [str(_[1]).zfill(8) for _ in query_tuple_list]
+            old_fingerprint_dict = dict(self.conn.execute(
+                'SELECT barcode, fingerprint FROM query_manifest '
+                'WHERE barcode IN (%s)' % ','.join('?' * len(barcode_list)),
+                barcode_list))
+            for one_query_tuple, barcode in zip(query_tuple_list,
+                                                barcode_list):
+                fingerprint = self.get_fingerprint(one_query_tuple)
+                if old_fingerprint_dict.get(barcode) != fingerprint:
+                    self._new_fingerprint_dict[barcode] = fingerprint
+                    yield one_query_tuple
 
-    critical_error = False
+    @property
+    def new_row_num(self):
+        return len(self._new_fingerprint_dict)
 
-    # Check if latin name is missing in data file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Checking if latin name is missing in '
-                 'data file...')
-    latin_names_in_data_file = []
-    for i, each_tuple in enumerate(data_file_tuple_list[1:]):
-        # If line is blank line, skip
+    def save(self):
+        """Record the rows yielded, call after they are written."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO query_manifest VALUES (?, ?)',
+                self._new_fingerprint_dict.items())
+        self._new_fingerprint_dict = {}
+
+    def close(self):
+        self.conn.close()
+
+
+class LatinNameIndex(object):
+    """Sorted reference list of latin names in a memory mapped file.
+
+    The index file is compiled once from the text lists by build() and
+    shipped with the package. Opening it only maps the file, names are
+    found by binary search without being loaded:
+
+    >>> latin_name_index = LatinNameIndex()
+    >>> "Stellaria media" in latin_name_index
+    True
+    >>> latin_name_index.has_genus("Stellaria")
+    True
+
+    File format (integers are unsigned 32 bits, little endian):
+
+        MAGIC | number of names n | n + 1 offsets | names (UTF-8)
+
+    Names are sorted by their UTF-8 bytes, offsets are from the start of
+    the names.
+    """
+    MAGIC = b'LATNIDX1'
+
+    def __init__(self, index_file=LATIN_NAME_INDEX_FILE):
+        self.index_file = index_file
+        self._file = open(index_file, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError('Not a latin name index file: %s' % index_file)
+        self._length = struct.unpack_from('<I', self._mm,
+                                          len(self.MAGIC))[0]
+        self._offset_start = len(self.MAGIC) + 4
+        self._name_start = self._offset_start + 4 * (self._length + 1)
+
+    @staticmethod
+    def normalize(latin_name):
+        return " ".join(latin_name.split())
+
+    @classmethod
+    def build(cls, name_file_list=None, index_file=LATIN_NAME_INDEX_FILE):
+        """Compile text files (one latin name by line) to index_file.
+        Return the number of names.
+        """
+        if name_file_list is None:
+            name_file_list = [DEFAULT_LATIN_NAME_FILE,
+                              DEFAULT_LATIN_NAME_FILE_2]
+        name_set = set()
+        for name_file in name_file_list:
+            with io.open(name_file, encoding='utf-8') as f:
+                for line in f:
+                    latin_name = cls.normalize(line)
+                    if latin_name:
+                        name_set.add(latin_name.encode('utf-8'))
+        name_list = sorted(name_set)
+        offset_list = [0]
+        for name in name_list:
+            offset_list.append(offset_list[-1] + len(name))
+        with open(index_file, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<I', len(name_list)))
+            f.write(struct.pack('<%dI' % len(offset_list), *offset_list))
+            f.write(b''.join(name_list))
+        return len(name_list)
+
+    def _name_at(self, i):
+        start, end = struct.unpack_from('<II', self._mm,
+                                        self._offset_start + 4 * i)
+        return self._mm[self._name_start + start:self._name_start + end]
+
+    def _bisect_left(self, key):
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __contains__(self, latin_name):
+        key = self.normalize(latin_name).encode('utf-8')
+        i = self._bisect_left(key)
+        return i < self._length and self._name_at(i) == key
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self._name_at(i).decode('utf-8')
+
+    def genus_names(self, genus):
+        """Yield names of the genus (the genus itself first if listed)."""
+        key = self.normalize(genus).encode('utf-8')
+        prefix = key + b' '
+        i = self._bisect_left(key)
+        # "Genus" < "Genus species" < "Genusxxx", names of the genus follow
+        if i < self._length and self._name_at(i) == key:
+            yield key.decode('utf-8')
+            i += 1
+        while i < self._length:
+            name = self._name_at(i)
+            if not name.startswith(prefix):
+                break
+            yield name.decode('utf-8')
+            i += 1
+
+    def has_genus(self, genus):
+        return next(self.genus_names(genus), None) is not None
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def get_latin_name_index():
+    """Return the LatinNameIndex shared by the program, None if the index
+    file is missing.
+    """
+    global _latin_name_index
+    if _latin_name_index is None:
         try:
-            if not each_tuple[0] and not each_tuple[2]:
+            _latin_name_index = LatinNameIndex()
+        except (IOError, OSError, ValueError) as e:
+            logging.warning('Pass latin name check because no built-in '
+                            'latin name index was found: %s. (%s)'
+                            % (LATIN_NAME_INDEX_FILE, e))
+            return None
+    return _latin_name_index
+
+
+def bounded_edit_distance(a, b, max_distance):
+    """Levenshtein distance of a and b, or max_distance + 1 as soon as it
+    is known to be larger than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_row = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current_row = [i]
+        for j, char_b in enumerate(b, 1):
+            current_row.append(min(previous_row[j] + 1,
+                                   current_row[j - 1] + 1,
+                                   previous_row[j - 1] + (char_a != char_b)))
+        if min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+    return min(previous_row[-1], max_distance + 1)
+
+
+class LatinNameMatcher(object):
+    """Find data file names close to a latin name: misspellings and names
+    with author suffix.
+
+    Data file names are found through a trigram index, then checked by
+    edit distance. Names of the reference list (LatinNameIndex) are
+    searched in the genus (or close genera) of the name only. Results are
+    cached by name.
+
+    >>> matcher = LatinNameMatcher(data_name_list, get_latin_name_index())
+    >>> matcher.resolve("Stelaria media (L.) Cyr.")
+    'Stellaria media'
+    >>> matcher.suggest("Stelaria medai")
+    [('Stellaria media', 0.8667), ...]
+    """
+    INFRASPECIFIC_RANKS = frozenset(['var.', 'subsp.', 'ssp.', 'f.'])
+
+    def __init__(self, data_name_iter, latin_name_index=None,
+                 max_distance=None):
+        self.max_distance = (FUZZY_MAX_DISTANCE if max_distance is None
+                             else max_distance)
+        self.latin_name_index = latin_name_index
+        self.data_name_list = sorted(set(
+            LatinNameIndex.normalize(_) for _ in data_name_iter if _))
+        self.data_name_set = set(self.data_name_list)
+        self._data_gram_index = self._build_gram_index(self.data_name_list)
+        self._genus_list = None
+        self._genus_gram_index = None
+        self._resolve_cache = {}
+        self._suggest_cache = {}
+
+    @staticmethod
+    def _iter_grams(name):
+        padded_name = ' %s ' % name
+        for i in range(len(padded_name) - 2):
+            yield padded_name[i:i + 3]
+
+    def _build_gram_index(self, name_list):
+        """Return {trigram: [index of names having it]}."""
+        gram_index = {}
+        for i, name in enumerate(name_list):
+            for gram in set(self._iter_grams(name)):
+                gram_index.setdefault(gram, []).append(i)
+        return gram_index
+
+    def _search(self, name, name_list, gram_index, max_distance):
+        """Return [(distance, name)] of names within max_distance."""
+        gram_set = set(self._iter_grams(name))
+        # One edit changes at most 3 trigrams
+        min_shared = max(1, len(gram_set) - 3 * max_distance)
+        shared_count_dict = {}
+        for gram in gram_set:
+            for i in gram_index.get(gram, ()):
+                shared_count_dict[i] = shared_count_dict.get(i, 0) + 1
+        result_list = []
+        for i, shared_count in shared_count_dict.items():
+            if shared_count < min_shared:
                 continue
-        except Exception as e:
-            logging.error('Line %s: %s' % (i+1, e))
-        if each_tuple[2]:
-            latin_name = each_tuple[2]
-            if len(latin_name.split()) < 2:
-                logging.error(
-                    '[ ERROR ] Latin name at least two words: genus+'
-                    'species. Line %s: %s' %
-                    (i+1, latin_name))
-                critical_error = True
-            latin_names_in_data_file.append(each_tuple[2].strip())
+            distance = bounded_edit_distance(name, name_list[i],
+                                             max_distance)
+            if distance <= max_distance:
+                result_list.append((distance, name_list[i]))
+        return sorted(result_list)
+
+    def strip_author(self, latin_name):
+        """Keep genus, species and infraspecific name, drop authors."""
+        word_list = LatinNameIndex.normalize(latin_name).split()
+        stripped_word_list = word_list[:2]
+        if len(word_list) >= 4 and \
+                word_list[2] in self.INFRASPECIFIC_RANKS:
+            stripped_word_list.extend(word_list[2:4])
+        return ' '.join(stripped_word_list)
+
+    def _score(self, name, matched_name):
+        distance = bounded_edit_distance(name, matched_name,
+                                         max(len(name), len(matched_name)))
+        return round(1 - distance / max(len(name), len(matched_name), 1), 4)
+
+    def resolve(self, latin_name):
+        """Return the data file name to use for latin_name, or None.
+
+        A name of the reference list missing in data file is another
+        species: it is not joined to a close data file name.
+        """
+        if latin_name in self._resolve_cache:
+            return self._resolve_cache[latin_name]
+        name = LatinNameIndex.normalize(latin_name)
+        stripped_name = self.strip_author(name)
+        matched_name = None
+        if name in self.data_name_set:
+            matched_name = name
+        elif stripped_name in self.data_name_set:
+            matched_name = stripped_name
+        elif self.latin_name_index is None or \
+                stripped_name not in self.latin_name_index:
+            result_list = self._search(stripped_name, self.data_name_list,
+                                       self._data_gram_index,
+                                       self.max_distance)
+            # Only a single closest name is a match
+            if len(result_list) == 1 or (
+                    len(result_list) > 1 and
+                    result_list[0][0] < result_list[1][0]):
+                matched_name = result_list[0][1]
+        if matched_name is not None and matched_name != name:
+            logging.info('[ Fuzzy Match ]  %s  ->  %s'
+                         % (latin_name, matched_name))
+        self._resolve_cache[latin_name] = matched_name
+        return matched_name
+
+    def resolve_all(self, latin_name_iter):
+        """Resolve names in bulk, return {name: data file name or None}."""
+        return dict((_, self.resolve(_)) for _ in set(latin_name_iter))
+
+    def _get_genus_gram_index(self):
+        if self._genus_gram_index is None:
+            self._genus_list = sorted(set(
+                _.split(' ', 1)[0] for _ in self.latin_name_index))
+            self._genus_gram_index = self._build_gram_index(
+                self._genus_list)
+        return self._genus_gram_index
+
+    def _reference_candidates(self, stripped_name):
+        """Return [(distance, name)] of the reference list."""
+        genus = stripped_name.split(' ', 1)[0]
+        if self.latin_name_index.has_genus(genus):
+            genus_list = [genus]
         else:
-            logging.error(
-                '[ ERROR ] No latin name:  %s (Row: %s)' %
-                (data_file, i+1))
-            critical_error = True
-
-    # Check if latin name is missing in query file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Checking if latin name is missing in '
-                 'query file...')
-    latin_names_in_query_file = []
-    for i, each_tuple in enumerate(query_file_tuple_list):
+            genus_gram_index = self._get_genus_gram_index()
+            genus_list = [_[1] for _ in self._search(
+                genus, self._genus_list, genus_gram_index,
+                self.max_distance)]
+        result_list = []
+        for candidate_genus in genus_list:
+            for name in self.latin_name_index.genus_names(candidate_genus):
+                distance = bounded_edit_distance(stripped_name, name,
+                                                 self.max_distance)
+                if distance <= self.max_distance:
+                    result_list.append((distance, name))
+        return result_list
+
+    def suggest(self, latin_name, limit=3):
+        """Return up to limit (name, score) of data file and reference
+        names close to latin_name, best first. Score is 1 for the same name.
+        """
+        if latin_name in self._suggest_cache:
+            return self._suggest_cache[latin_name][:limit]
+        stripped_name = self.strip_author(latin_name)
+        result_list = self._search(stripped_name, self.data_name_list,
+                                   self._data_gram_index, self.max_distance)
+        if self.latin_name_index is not None and stripped_name:
+            result_list.extend(self._reference_candidates(stripped_name))
+        suggestion_list = []
+        for distance, name in sorted(set(result_list)):
+            if name not in [_[0] for _ in suggestion_list]:
+                suggestion_list.append((name, self._score(stripped_name,
+                                                          name)))
+        self._suggest_cache[latin_name] = suggestion_list
+        return suggestion_list[:limit]
+
+
+class ValidationReport(object):
+    """Result of data validation: for each file and rule, the number of
+    problems, the first examples and the ranges of rows concerned.
+
+    Only VALIDATION_MAX_EXAMPLES examples and row ranges are kept for each
+    rule, so the report stays small whatever the size of the files. Reports
+    of row chunks are merged in row order.
+
+    >>> report = ValidationReport()
+    >>> report.add("query.xlsx", "blank_cell", 12, "Column 3")
+    >>> report.log()
+    >>> report.to_json()
+    """
+    # rule: (level, message)
+    RULES = {
+        'column_num': ('error', 'Wrong number of columns'),
+        'no_latin_name': ('error', 'No latin name'),
+        'latin_name_one_word': ('error', 'Latin name at least two words: '
+                                         'genus+species'),
+        'short_row': ('warning', 'Row too short'),
+        'blank_cell': ('warning', 'Blank cell'),
+        'not_in_data_file': ('warning', 'Latin name not in data file'),
+        'unknown_latin_name': ('warning', 'Latin name not in reference '
+                                          'list'),
+        'unknown_genus': ('warning', 'Genus not in reference list'),
+        'fuzzy_matched': ('warning', 'Latin name joined to a close data '
+                                     'file name'),
+    }
+
+    def __init__(self, max_examples=None):
+        self.max_examples = (VALIDATION_MAX_EXAMPLES if max_examples is None
+                             else max_examples)
+        # (file_name, rule): {'count': 0, 'examples': [], 'row_ranges': []}
+        self.result_dict = {}
+
+    def _get_result(self, file_name, rule):
+        key = (file_name, rule)
+        if key not in self.result_dict:
+            if rule not in self.RULES:
+                raise ValueError('Unknown validation rule: %s' % rule)
+            self.result_dict[key] = {'count': 0, 'examples': [],
+                                     'row_ranges': [], 'more_rows': False}
+        return self.result_dict[key]
+
+    def _add_row_range(self, result, start_row, end_row):
+        row_ranges = result['row_ranges']
+        if row_ranges and row_ranges[-1][1] + 1 >= start_row:
+            row_ranges[-1][1] = max(row_ranges[-1][1], end_row)
+        elif len(row_ranges) < self.max_examples:
+            row_ranges.append([start_row, end_row])
+        else:
+            result['more_rows'] = True
+
+    def add(self, file_name, rule, row_num, value=None):
+        """Record one problem found at row row_num (1 based)."""
+        result = self._get_result(file_name, rule)
+        result['count'] += 1
+        if len(result['examples']) < self.max_examples:
+            result['examples'].append((row_num, value))
+        self._add_row_range(result, row_num, row_num)
+
+    def merge(self, other):
+        """Add results of the report of the following rows."""
+        for (file_name, rule), other_result in sorted(
+                other.result_dict.items()):
+            result = self._get_result(file_name, rule)
+            result['count'] += other_result['count']
+            result['examples'].extend(other_result['examples'][
+                :self.max_examples - len(result['examples'])])
+            for start_row, end_row in other_result['row_ranges']:
+                self._add_row_range(result, start_row, end_row)
+            result['more_rows'] |= other_result['more_rows']
+
+    def is_full(self, file_name, rule):
+        """Whether no more example of the rule is kept."""
+        result = self.result_dict.get((file_name, rule))
+        return (result is not None and
+                len(result['examples']) >= self.max_examples)
+
+    def count(self, rule, file_name=None):
+        return sum(result['count'] for (_file_name, _rule), result
+                   in self.result_dict.items()
+                   if _rule == rule and file_name in (None, _file_name))
+
+    @property
+    def has_errors(self):
+        return any(self.RULES[rule][0] == 'error'
+                   for _, rule in self.result_dict)
+
+    def to_dict(self):
+        """Return the report as a list of dicts, errors first."""
+        level_order = {'error': 0, 'warning': 1}
+        return [dict(file=file_name, rule=rule,
+                     level=self.RULES[rule][0],
+                     message=self.RULES[rule][1],
+                     **self.result_dict[(file_name, rule)])
+                for file_name, rule in sorted(
+                    self.result_dict,
+                    key=lambda _: (level_order[self.RULES[_[1]][0]], _))]
+
+    def to_json(self, json_file=None):
+        """Return the report as JSON, also written to json_file if given."""
+        report_json = json.dumps(self.to_dict(), ensure_ascii=False,
+                                 indent=2)
+        if json_file is not None:
+            with io.open(json_file, 'w', encoding='utf-8') as f:
+                f.write(report_json)
+        return report_json
+
+    def format_lines(self):
+        """Return report as text lines (one line by rule, then examples)."""
+        lines = []
+        for result in self.to_dict():
+            row_ranges = ', '.join(
+                ('%d' % start_row if start_row == end_row
+                 else '%d-%d' % (start_row, end_row))
+                for start_row, end_row in result['row_ranges'])
+            if result['more_rows']:
+                row_ranges += ', ...'
+            lines.append('[ %s ] %s: %s (%d, rows: %s)'
+                         % (result['level'].upper(), result['file'],
+                            result['message'], result['count'], row_ranges))
+            for row_num, value in result['examples']:
+                if value is None:
+                    lines.append('      Row %s' % row_num)
+                else:
+                    lines.append('      Row %s: %s' % (row_num, value))
+            if result['count'] > len(result['examples']):
+                lines.append('      ... %d more'
+                             % (result['count'] - len(result['examples'])))
+        return lines
+
+    def log(self):
+        """Log report, one call for all lines."""
+        lines = self.format_lines()
+        if not lines:
+            logging.info('[ OK ] No problem found in data and query files.')
+        elif self.has_errors:
+            logging.error('\n'.join(lines))
+        else:
+            logging.warning('\n'.join(lines))
+
+
+def _check_rows(file_name, first_row_num, row_list, skip_header=False):
+    """Check a chunk of rows, run by validation processes.
+
+    Return the ValidationReport of the rows and a dict of stripped latin
+    names: row number where the name is first found.
+    """
+    report = ValidationReport()
+    latin_name_dict = {}
+    for i, row_tuple in enumerate(row_list):
+        row_num = first_row_num + i
+        for j, cell in enumerate(row_tuple):
+            if not cell:
+                report.add(file_name, 'blank_cell', row_num,
+                           'Column %d' % (j+1))
+        # First row of data file is header
+        if skip_header and row_num == 1:
+            continue
+        if len(row_tuple) < 3:
+            report.add(file_name, 'short_row', row_num, len(row_tuple))
+            continue
         # If line is blank line, skip
+        if not row_tuple[0] and not row_tuple[2]:
+            continue
+        latin_name = row_tuple[2]
+        if not latin_name:
+            report.add(file_name, 'no_latin_name', row_num)
+            continue
+        if len(latin_name.split()) < 2:
+            report.add(file_name, 'latin_name_one_word', row_num, latin_name)
+        latin_name = latin_name.strip()
+        if latin_name not in latin_name_dict:
+            latin_name_dict[latin_name] = row_num
+    return report, latin_name_dict
+
+
+class DataValidator(object):
+    """Validate data and query files, reading each file once.
+
+    Rows are checked in chunks of VALIDATION_CHUNK_ROWS, by a pool of
+    VALIDATION_PROCESS_NUM processes while the file is still being read.
+    Problems are collected in a ValidationReport instead of being logged
+    one by one. The parsed rows and species names are kept for the query
+    stage, so the files are not parsed again:
+
+    >>> validator = data_validation("data.xlsx", "query.xlsx")
+    >>> q = Query("query.xlsx", "data.xlsx", validator=validator)
+
+    report:                 ValidationReport of both files.
+    data_row_list:          All rows of data file, only kept if the
+                            offline cache has to parse it (no offline index
+                            or index out of date), else None.
+    query_row_list:         All rows of query file, None if there are more
+                            than VALIDATION_KEEP_QUERY_ROWS rows.
+    query_species_name_set: Species names of query file.
+    """
+    def __init__(self, data_file, query_file, process_num=None):
+        self.data_file = data_file
+        self.query_file = query_file
+        if process_num is None:
+            process_num = VALIDATION_PROCESS_NUM
+        self.process_num = process_num or multiprocessing.cpu_count()
+        self.report = ValidationReport()
+        self.data_row_list = [] if self._keep_data_rows() else None
+        self.query_row_list = []
+        self.query_species_name_set = set()
+        self.latin_name_matcher = None
+
+    def _check_file(self, file_name, row_iter, column_num, executor=None,
+                    skip_header=False):
+        """Check rows of one file, return latin name dict of the file."""
+        latin_name_dict = {}
+        future_list = []
+
+        def add_result(result):
+            report, chunk_latin_name_dict = result
+            self.report.merge(report)
+            for latin_name, row_num in chunk_latin_name_dict.items():
+                latin_name_dict.setdefault(latin_name, row_num)
+
+        first_row_num = 1
+        while True:
+            row_list = list(islice(row_iter, VALIDATION_CHUNK_ROWS))
+            if not row_list:
+                break
+            if first_row_num == 1 and len(row_list[0]) != column_num:
+                self.report.add(file_name, 'column_num', 1,
+                                '%d (should be: %d)'
+                                % (len(row_list[0]), column_num))
+            args = (file_name, first_row_num, row_list, skip_header)
+            first_row_num += len(row_list)
+            if executor is None:
+                add_result(_check_rows(*args))
+                continue
+            future_list.append(executor.submit(_check_rows, *args))
+            # Bounded number of chunks waiting, results merged in order
+            while len(future_list) > self.process_num:
+                add_result(future_list.pop(0).result())
+        for future in future_list:
+            add_result(future.result())
+        if first_row_num == 1:
+            self.report.add(file_name, 'column_num', 1,
+                            '0 (should be: %d)' % column_num)
+        return latin_name_dict
+
+    def _keep_data_rows(self):
+        """Whether the query stage will parse the data file."""
+        if not USE_OFFLINE_INDEX:
+            return True
+        # Opening a missing index would create an empty one
+        if not os.path.isfile(self.data_file) or \
+                not os.path.isfile(get_offline_index_file(self.data_file)):
+            return True
+        try:
+            index = OfflineDataIndex(self.data_file, build=False)
+        except (OSError, IOError, sqlite3.Error):
+            return True
         try:
-            if not each_tuple[0] and not each_tuple[2]:
+            return not index.up_to_date
+        finally:
+            index.close()
+
+    def _iter_data_rows(self):
+        xlsx_file = XlsxFile(self.data_file, read_only=True)
+        for row_tuple in xlsx_file.iter_rows():
+            if self.data_row_list is not None:
+                self.data_row_list.append(row_tuple)
+            yield row_tuple
+        xlsx_file.close()
+
+    def _iter_query_rows(self):
+        xlsx_file = XlsxFile(self.query_file, read_only=True)
+        for row_tuple in xlsx_file.iter_rows():
+            if self.query_row_list is not None:
+                self.query_row_list.append(row_tuple)
+                if len(self.query_row_list) > VALIDATION_KEEP_QUERY_ROWS:
+                    self.query_row_list = None
+            if len(row_tuple) > 2:
+                self.query_species_name_set.add(row_tuple[2])
+            yield row_tuple
+        xlsx_file.close()
+
+    def _check_files(self, executor=None):
+        data_latin_name_dict = self._check_file(
+            self.data_file, self._iter_data_rows(), DATA_FILE_COLUMN_NUM,
+            executor, skip_header=True)
+        query_latin_name_dict = self._check_file(
+            self.query_file, self._iter_query_rows(), QUERY_FILE_COLUMN_NUM,
+            executor)
+        latin_name_index = (get_latin_name_index() if CHECK_LATIN_NAMES
+                            else None)
+        self.latin_name_matcher = LatinNameMatcher(data_latin_name_dict,
+                                                   latin_name_index)
+        # Check if latin names in query file in data file
+        for latin_name, row_num in sorted(query_latin_name_dict.items(),
+                                          key=lambda _: _[1]):
+            if latin_name in data_latin_name_dict:
                 continue
-        except Exception as e:
-            logging.error('Line %s: %s' % (i+1, e))
-        if each_tuple[2]:
-            latin_name = each_tuple[2]
-            if len(latin_name.split()) < 2:
-                logging.error(
-                    '[ ERROR ] Latin name at least two words: genus+'
-                    'species. Line %s: %s' %
-                    (i+1, latin_name))
-                critical_error = True
-            latin_names_in_query_file.append(each_tuple[2].strip())
+            matched_name = (self.latin_name_matcher.resolve(latin_name)
+                            if FUZZY_MATCH else None)
+            if matched_name is not None:
+                self.report.add(self.query_file, 'fuzzy_matched', row_num,
+                                '%s -> %s' % (latin_name, matched_name))
+            else:
+                self._add_name_problem(self.query_file, 'not_in_data_file',
+                                       row_num, latin_name)
+        if latin_name_index is not None:
+            self._check_reference_names(self.data_file, data_latin_name_dict,
+                                        latin_name_index)
+            self._check_reference_names(self.query_file,
+                                        query_latin_name_dict,
+                                        latin_name_index)
+
+    def _add_name_problem(self, file_name, rule, row_num, latin_name):
+        """Add a latin name problem, with close names as suggestions."""
+        # Suggestions are only searched for the examples kept
+        if not self.report.is_full(file_name, rule):
+            suggestion_list = self.latin_name_matcher.suggest(latin_name)
+            if suggestion_list:
+                latin_name = '%s (did you mean: %s?)' % (
+                    latin_name, ', '.join(_[0] for _ in suggestion_list))
+        self.report.add(file_name, rule, row_num, latin_name)
+
+    def _check_reference_names(self, file_name, latin_name_dict,
+                               latin_name_index):
+        """Check each distinct latin name of a file against the built-in
+        reference list.
+        """
+        for latin_name, row_num in sorted(latin_name_dict.items(),
+                                          key=lambda _: _[1]):
+            if latin_name in latin_name_index:
+                continue
+            if latin_name_index.has_genus(latin_name.split()[0]):
+                self._add_name_problem(file_name, 'unknown_latin_name',
+                                       row_num, latin_name)
+            else:
+                self._add_name_problem(file_name, 'unknown_genus', row_num,
+                                       latin_name)
+
+    def validate(self, report_file=None):
+        """Run all checks and log the report, also written as JSON to
+        report_file if given. Raise ValueError if files cannot be queried.
+        """
+        logging.info(BAR)
+        logging.info(" == DATA VALIDATION ==")
+        if self.process_num > 1 and ProcessPoolExecutor is not None:
+            with ProcessPoolExecutor(self.process_num) as executor:
+                self._check_files(executor)
         else:
-            logging.error(
-                '[ ERROR ] No latin name:  %s (Row: %s)' %
-                (query_file, i+1))
-            critical_error = True
-
-    if critical_error:
-        logging.error(
-            '[ ERROR ] Please make sure latin names are not missing '
-            'in either data or query files.')
-        raise ValueError()
-
-    # Check if number of lines of data file is correct
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Validating if number of lines in data file is '
-                 'correct...')
-    if len(data_file_tuple_list[0]) != DATA_FILE_COLUMN_NUM:
-        logging.error(
-            '[ ERROR ] Number of columns in data file '
-            'should be: %s (now: %s)' %
-            (DATA_FILE_COLUMN_NUM, len(data_file_tuple_list[0])))
-        raise ValueError('Please check data file.')
-
-    # Check if number of lines of query file is correct
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Validating if number of lines in query file is '
-                 'correct...')
-    if len(query_file_tuple_list[0]) != QUERY_FILE_COLUMN_NUM:
-        logging.error(
-            '[ ERROR ] Number of columns in query file '
-            'should be: %s (now: %s)' %
-            (QUERY_FILE_COLUMN_NUM, len(query_file_tuple_list[0])))
-        raise ValueError('Please check query file')
-
-    # Check if is there any missing cell in data file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Checking if any missing cell in data file...')
-    for i, row in enumerate(data_file_tuple_list):
-        for j, cell in enumerate(row):
-            if not cell:
-                logging.warning(
-                    '[ WARNING ] Blank cell: [%s:  Row: %s, Column: %s]' %
-                    (data_file, i+1, j+1))
-
-    # Check if is there any missing cell in query file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Checking if any missing cell in query file...')
-    for i, row in enumerate(query_file_tuple_list):
-        for j, cell in enumerate(row):
-            if not cell:
-                logging.warning(
-                    '[ WARNING ] Blank cell: [%s:  Row: %s, Column: %s]' %
-                    (query_file, i+1, j+1))
-
-    # Check if latin names in query file in data file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    logging.info('[ Start ] Validating if latin names (in query file) in '
-                 'data file...')
-    tmp_latin_name_set = set([])
-    latin_names_set_from_data_file = set(latin_names_in_data_file)
-    for i, latin_name in enumerate(latin_names_in_query_file):
-        if latin_name not in latin_names_set_from_data_file:
-            if latin_name not in tmp_latin_name_set:
-                tmp_latin_name_set.add(latin_name)
-                logging.warning(
-                    '[ WARNING ] [%s:  Line %s]  %s  ' %
-                    (query_file, i+1, latin_name))
-    logging.info(THIN_BAR_NO_NEWLINE)
-
-    # # Check if Latin names in built-in Latin name list
-    # try:
-    #     with open(DEFAULT_LATIN_NAME_FILE, 'r') as f:
-    #         default_latin_names_list_1 = [x.strip() for x in f.readlines()
-    #                                       if x.strip()]
-    #     with open(DEFAULT_LATIN_NAME_FILE_2, 'r') as f:
-    #         default_latin_names_list_2 = [x.strip() for x in f.readlines()
-    #                                       if x.strip()]
-    #     default_latin_names = set(default_latin_names_list_1
-    #                               + default_latin_names_list_2)
-    # except IOError as e:
-    #     logging.warning(
-    #         'Pass latin name check because no built-in latin name file '
-    #         'was found: %s. (%s)' % (DEFAULT_LATIN_NAME_FILE, e))
-    # else:
-    #     logging.info('[ Start ] Validating if latin names from data file in '
-    #                  'built-in latin name list...')
-    #     tmp_warning_set = set([])
-    #     for i, latin_name in enumerate(latin_names_in_data_file):
-    #         if latin_name not in default_latin_names:
-    #             if latin_name not in tmp_warning_set:
-    #                 tmp_warning_set.add(latin_name)
-    #                 logging.warning(
-    #                     '[ WARNING ] [%s:  Line %s]  %s  ' %
-    #                     (data_file, i+1, latin_name))
-    #     logging.info(THIN_BAR_NO_NEWLINE)
-    #     logging.info('[ Start ] Validating if latin names from query file in'
-    #                  ' built-in latin name list...')
-    #     tmp_warning_set = set([])
-    #     for i, latin_name in enumerate(latin_names_in_query_file):
-    #         if latin_name not in default_latin_names:
-    #             if latin_name not in tmp_warning_set:
-    #                 tmp_warning_set.add(latin_name)
-    #                 logging.warning(
-    #                     '[ WARNING ] [%s:  Line %s]  %s  ' %
-    #                     (query_file, i+1, latin_name))
-    logging.info(BAR)
+            self._check_files()
+        self.report.log()
+        if report_file is not None:
+            self.report.to_json(report_file)
+        logging.info(BAR)
+        if self.report.has_errors:
+            raise ValueError('Please check data and query files.')
+
+
+def data_validation(data_file, query_file, report_file=None):
+    """Validate data and query files before program run.
+
+    This will save time. If there is error in data file, program may crush
+    after long time run. So it's better to validate data file before running.
+
+    Return the DataValidator, whose parsed rows can be given to Query.
+    report_file: JSON file to write the validation report to.
+    """
+    validator = DataValidator(data_file, query_file)
+    validator.validate(report_file)
+    return validator
 
 
 def arg_parse():
@@ -1128,6 +3467,28 @@ def arg_parse():
                         help="Data file, xlsx format")
     parser.add_argument('-o', '--output', dest='output_file',
                         default='output.xlsx', help="Output file, xlsx format")
+    parser.add_argument('--revalidate', action='store_true',
+                        help=("Check again species in web cache fetched more "
+                              "than %d days ago" % REVALIDATE_AFTER_DAYS))
+    parser.add_argument('--reparse', action='store_true',
+                        help=("Rebuild web cache from archived pages in %s "
+                              "without network, then exit"
+                              % LOCAL_PAGE_ARCHIVE_FILE))
+    parser.add_argument('--resume', action='store_true',
+                        help=("Resume an interrupted run: skip data "
+                              "validation and fetch the species left by the "
+                              "interrupted fetch"))
+    parser.add_argument('--validation-report', dest='validation_report',
+                        help="Also write data validation report to this "
+                             "JSON file")
+    parser.add_argument('-s', '--sqlite', dest='sqlite_file',
+                        default='specimen.sqlite',
+                        help="SQLite3 output file, used by --incremental")
+    parser.add_argument('--incremental', action='store_true',
+                        help=("Only query rows not in the SQLite3 output "
+                              "yet, or changed since. New rows are added to "
+                              "it, the xlsx output file only holds the new "
+                              "rows"))
 
     args = parser.parse_args()
     logging.info("Plant Speciem Info Input Program:%s" % BAR)
@@ -1161,23 +3522,77 @@ def arg_parse():
     return args
 
 
+def incremental_query(query_file, offline_data_file, output_file,
+                      sqlite3_file, validator=None):
+    """Query only rows not written to sqlite3_file yet, or changed since,
+    and return their number.
+
+    The new rows are upserted into sqlite3_file, and the xlsx output file
+    only holds these new rows. They are kept in memory, an incremental run
+    is expected to add a few rows to a large output. The query manifest is
+    saved only after all rows were written: if write_to_sqlite3() raises,
+    the rows are queried again by the next run.
+    """
+    query_manifest = QueryManifest(sqlite3_file)
+    try:
+        q = Query(query_file, offline_data_file, query_manifest, validator)
+        out_tuple_list = q.do_multi_query()
+        logging.info('[ Incremental ]  New or changed query rows: %d'
+                     % query_manifest.new_row_num)
+        if out_tuple_list:
+            write_to_sqlite3(out_tuple_list, sqlite3_file=sqlite3_file)
+            query_manifest.save()
+            write_to_xlsx_file(out_tuple_list, xlsx_outfile_name=output_file)
+    finally:
+        query_manifest.close()
+    return len(out_tuple_list)
+
+
 def main():
     """Main function."""
+    # Before arg_parse(): logging before a handler is set up would add the
+    # default one, and basicConfig() would do nothing
+    setup_logging()
     args = arg_parse()
+    if args.reparse:
+        reparse_web_cache()
+        return
+    # Live status line, not written when stderr is redirected to a file
+    if sys.stderr.isatty():
+        add_progress_listener(ProgressStatusLine())
     query_file, offline_data_file, output_file = (
         args.query_file,
         args.data_file,
         args.output_file)
     time_start = time.time()
-    try:
-        data_validation(offline_data_file, query_file)
-    except Exception as e:
-        logging.error('Cannot do data validation. Skip validation... %s' % e)
-
-    q = Query(query_file, offline_data_file)
-    out_tuple_list = q.do_multi_query()
-    write_to_xlsx_file(out_tuple_list, xlsx_outfile_name=output_file)
-    # write_to_sqlite3(out_tuple_list)
+    validator = None
+    # Files were validated by the interrupted run
+    if not args.resume:
+        try:
+            validator = data_validation(offline_data_file, query_file,
+                                        args.validation_report)
+        except Exception as e:
+            logging.error('Cannot do data validation. Skip validation... %s'
+                          % e)
+
+    if args.revalidate or args.resume:
+        get_cache(query_file, offline_data_file, revalidate=args.revalidate,
+                  resume=args.resume,
+                  species_name_list=(validator.query_species_name_set
+                                     if validator else None),
+                  data_row_list=validator.data_row_list if validator else None)
+        if validator is not None:
+            validator.data_row_list = None
+
+    if args.incremental:
+        incremental_query(query_file, offline_data_file, output_file,
+                          args.sqlite_file, validator)
+    else:
+        q = Query(query_file, offline_data_file, validator=validator)
+        # Output rows are written as they are produced
+        write_to_xlsx_file(q.iter_multi_query(),
+                           xlsx_outfile_name=output_file)
+        # write_to_sqlite3(q.iter_multi_query())
     time_end = time.time()
     logging.info('Time used: %.4f' % (time_end - time_start))
 
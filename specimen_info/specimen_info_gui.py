@@ -41,6 +41,7 @@ Usage
             -o outfile.xslx
 """
 
+import io
 import re
 import os
 try:
@@ -50,6 +51,10 @@ except ImportError:
 import sys
 import time
 import json
+import datetime
+import pickle
+import sqlite3
+import hashlib
 import logging
 try:
     import openpyxl
@@ -60,8 +65,9 @@ try:
 except ImportError:
     requests = None
 import argparse
+import itertools
 import threading
-from collections import namedtuple
+from collections import namedtuple, deque, OrderedDict
 from multiprocessing.dummy import Pool
 
 if sys.version[0] == '2':
@@ -85,7 +91,14 @@ __all__ = ['Query', 'write_to_xlsx_file', 'gui_main']
 # You can change settings here if needed
 # ==================================================
 POOL_NUM = 30
-MAX_ERROR_NUM = 50
+GUI_LOG_FLUSH_MS = 100           # 日志区域刷新间隔（毫秒）
+GUI_LOG_MAX_LINES = 5000         # 日志区域最多保留的行数，更早的行被删除
+GUI_LOG_MAX_LINES_PER_FLUSH = 500  # 每次刷新最多写入的行数
+GUI_PROGRESS_POLL_MS = 100       # 进度条刷新间隔（毫秒）
+PROGRESS_INTERVAL = 0.5          # 每个阶段最多每隔多少秒发送一次进度
+JOB_WORKER_NUM = 1  # 同时运行的任务数，排队的任务依次运行并复用已有缓存
+PREVIEW_PAGE_ROWS = 50  # 预览每次读取的行数，滚动到底部时读取下一页
+MAX_EXAMPLE_NUM = 10  # 数据校验报告中每类问题显示的示例数（及行范围数）
 
 LIBRARY_CODE = "FUS"
 COLLECTION_COUNTRY = "中国"
@@ -141,11 +154,20 @@ TOTAL_LINES = 38
 # Local JSON cache file name for web search
 LOCAL_JSON_CACHE_FILE = 'cache.json'
 
-# Dictionaries used for cache
-# Web data cache
-_web_data_cache_dict = {}
-# xlsx data cache
-_xlsx_data_cache_dict = {}
+# Sidecar index file of the data file, named after the key column:
+# data.xlsx -> data.xlsx.col0.index
+# The index is rebuilt automatically whenever the data file changes
+USE_OFFLINE_INDEX = True
+OFFLINE_INDEX_SUFFIX = '.index'
+OFFLINE_INDEX_ROW_CACHE_SIZE = 10000  # Rows looked up kept in memory
+
+# 写 LOCAL_JSON_CACHE_FILE 时加锁，多个任务可能同时写入
+_local_json_cache_lock = threading.Lock()
+# 进度监听函数列表，见 add_progress_listener()
+_progress_listener_list = []
+# 当前线程运行的任务编号（job_id），该线程中创建的 Progress 发出的事件带有
+# 这个编号
+_job_local = threading.local()
 
 # For fancy display
 BAR = '\n' + '=' * 60 + '\n'
@@ -196,19 +218,29 @@ DEFAULT_LATIN_NAME_FILE_2 = os.path.join('.', 'data',
 
 # logging
 file_handler_format = ('%(message)s')
-logging.basicConfig(level=logging.DEBUG,
-                    format=file_handler_format,
-                    datefmt="%Y-%m-%d %H:%M",
-                    filename="log.txt",
-                    filemode="w")
 
-# logging handler for displaying output to screen
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter("%(message)s")
-console.setFormatter(formatter)
 
-logging.getLogger("").addHandler(console)
+def setup_logging():
+    """Log to log.txt and to screen.
+
+    Called by the main functions only: worker processes started with spawn
+    import this module again, and must not truncate log.txt or add
+    handlers of their own.
+    """
+    logging.basicConfig(level=logging.DEBUG,
+                        format=file_handler_format,
+                        datefmt="%Y-%m-%d %H:%M",
+                        filename="log.txt",
+                        filemode="w")
+
+    # logging handler for displaying output to screen
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(message)s")
+    console.setFormatter(formatter)
+
+    logging.getLogger("").addHandler(console)
+
 
 # Seppress logging info from urllib3 which was called by requests
 logging.getLogger("requests").setLevel(logging.WARNING)
@@ -220,14 +252,96 @@ def check_unicode(unknown):
     return isinstance(unknown, unicode)
 
 
+# 一个阶段的进度：已完成数、总数（未知时为 None）、每秒完成数、预计剩余秒数
+# （未知时为 None）、该阶段是否结束、所属任务编号（不在任务中时为 None）
+ProgressEvent = namedtuple(
+    "ProgressEvent",
+    ["stage", "done", "total", "rate", "eta", "finished", "job_id"])
+
+
+def add_progress_listener(listener):
+    """每个阶段（'fetch'、'index'、'query'、'write xlsx'）的进度都会调用
+    listener(progress_event)，可能在任意线程中调用。
+    """
+    _progress_listener_list.append(listener)
+
+
+def remove_progress_listener(listener):
+    if listener in _progress_listener_list:
+        _progress_listener_list.remove(listener)
+
+
+class Progress(object):
+    """统计一个阶段的完成数，最多每隔 PROGRESS_INTERVAL 秒向进度监听函数发送
+    一次 ProgressEvent。线程安全。
+    """
+    def __init__(self, stage, total=None):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.job_id = getattr(_job_local, 'job_id', None)
+        self._time_start = time.time()
+        self._time_published = 0
+        self._lock = threading.Lock()
+
+    def update(self, item_num=1):
+        with self._lock:
+            self.done += item_num
+            now = time.time()
+            if now - self._time_published < PROGRESS_INTERVAL:
+                return
+            self._time_published = now
+        self._publish(now)
+
+    def finish(self):
+        self._publish(time.time(), finished=True)
+
+    def _publish(self, now, finished=False):
+        if not _progress_listener_list:
+            return
+        seconds = now - self._time_start
+        rate = self.done / seconds if seconds > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(0, self.total - self.done) / rate
+        progress_event = ProgressEvent(self.stage, self.done, self.total,
+                                       rate, eta, finished, self.job_id)
+        for listener in list(_progress_listener_list):
+            listener(progress_event)
+
+
+def format_progress(progress_event):
+    """进度的一行文字，例如：
+
+    [ fetch ]  120/1000  12.0%  35.2/s  ETA 0:00:25
+    """
+    progress_line = '[ %s ]  %d' % (progress_event.stage,
+                                    progress_event.done)
+    if progress_event.total:
+        progress_line += '/%d  %.1f%%' % (
+            progress_event.total,
+            100.0 * progress_event.done / progress_event.total)
+    progress_line += '  %.1f/s' % progress_event.rate
+    if progress_event.finished:
+        progress_line += '  done'
+    elif progress_event.eta is not None:
+        progress_line += '  ETA %s' % datetime.timedelta(
+            seconds=int(progress_event.eta))
+    return progress_line
+
+
 class XlsxFile(object):
     """
     Handel xlsx files and return a matrix of content.
+
+    With ``read_only=True`` the workbook is opened in openpyxl's streaming
+    mode and no matrix is built. Use ``iter_rows()`` to read rows lazily.
     """
 
-    def __init__(self, excel_file):
+    def __init__(self, excel_file, read_only=False):
+        self.read_only = read_only
         try:
-            self.wb = openpyxl.load_workbook(excel_file)
+            self.wb = openpyxl.load_workbook(excel_file, read_only=read_only)
         # Invalid xlsx format
         except openpyxl.utils.exceptions.InvalidFileException as e:
             logging.error("[ ERROR ] Invalid xlsx format.\n%s" % e)
@@ -246,7 +360,8 @@ class XlsxFile(object):
         self.ws_title = self.ws.title
         self.xlsx_matrix = []
         self.species_info_dict = {}
-        self._get_matrix()
+        if not read_only:
+            self._get_matrix()
 
     @property
     def all_sheet_names(self):
@@ -281,6 +396,23 @@ class XlsxFile(object):
             logging.error(error_msg)
             raise ValueError(error_msg)
 
+    def iter_rows(self):
+        """Yield rows of the active sheet as tuples of cell values.
+
+        In read only mode rows are parsed from the file one by one.
+        """
+        if self.xlsx_matrix:
+            for row_tuple in self.xlsx_matrix:
+                yield row_tuple
+            return
+        for row in self.ws.iter_rows():
+            yield tuple(cell.value for cell in row)
+
+    def close(self):
+        """Release the file handle kept open by a read only workbook."""
+        if self.read_only:
+            self.wb.close()
+
     def _get_matrix(self):
         """Get a two dimensional matrix from the xlsx file."""
         self.xlsx_matrix = []
@@ -290,6 +422,12 @@ class XlsxFile(object):
                 row_container.append(cell.value)
             self.xlsx_matrix.append(tuple(row_container))
 
+    def iter_xlsx_data_items(self, key_column_index):
+        """Yield (key, row_tuple) pairs used by get_xlsx_data_dict()."""
+        if not self.xlsx_matrix:
+            self._get_matrix()
+        return iter_data_items(self.xlsx_matrix, key_column_index)
+
     def get_xlsx_data_dict(self, key_column_index):
         """Return a dictionary with data from xlsx matrix.
 
@@ -304,21 +442,121 @@ class XlsxFile(object):
             'c': ('3', 'c', 'y')
         }
         """
-        xlsx_data_dict = {}
-        if not self.xlsx_matrix:
-            self._get_matrix()
-        for i, row_tuple in enumerate(self.xlsx_matrix):
-            if not row_tuple[key_column_index]:
-                continue
-            elements = [_.strip() if type(_) == str else _
-                        for _ in row_tuple]
-            # Add key=species_name : value=info_list to dictionary
-            # use " ".join(species_name.split()) to avoid search failure by
-            # format error (If there are more than one blanks or tabs)
-            species_name = " ".join(elements[key_column_index].split())
-            xlsx_data_dict[species_name] = tuple(elements)
+        return dict(self.iter_xlsx_data_items(key_column_index))
+
+
+def iter_data_items(row_list, key_column_index):
+    """Yield (key, row_tuple) pairs of data file rows, skipping rows without
+    key."""
+    for row_tuple in row_list:
+        if not row_tuple[key_column_index]:
+            continue
+        elements = [_.strip() if type(_) == str else _
+                    for _ in row_tuple]
+        # Add key=species_name : value=info_list to dictionary
+        # use " ".join(species_name.split()) to avoid search failure by
+        # format error (If there are more than one blanks or tabs)
+        species_name = " ".join(elements[key_column_index].split())
+        yield species_name, tuple(elements)
+
+
+def get_file_stat(file_name):
+    """(mtime, size) of a file, to tell whether it was changed."""
+    stat = os.stat(file_name)
+    return stat.st_mtime, stat.st_size
+
+
+class XlsxPreview(object):
+    """Read an xlsx file page by page (PREVIEW_PAGE_ROWS rows) with the
+    streaming reader, for preview. Thread safe.
+
+    Only the rows shown are parsed and kept. When the file is then queried,
+    read_all() goes on from the last row read, so the file is opened and
+    parsed once. The rows after the pages shown are not kept: more pages
+    are read again from the file.
+
+    >>> preview = XlsxPreview("data.xlsx")
+    >>> first_page = preview.read_page()
+    >>> next_page = preview.read_page()
+    >>> row_list = preview.read_all()
+    """
+    def __init__(self, excel_file, page_rows=None):
+        self.excel_file = excel_file
+        self.page_rows = page_rows or PREVIEW_PAGE_ROWS
+        # Rows of the pages read so far
+        self.row_list = []
+        self.exhausted = False
+        self._closed = False
+        self._file_stat = get_file_stat(excel_file)
+        self._xlsx_file = None
+        self._row_iter = None
+        self._lock = threading.Lock()
+
+    def _iter_rest(self):
+        """Rows after the pages read, the file is opened if needed."""
+        if self._row_iter is None:
+            self._xlsx_file = XlsxFile(self.excel_file, read_only=True)
+            self._row_iter = itertools.islice(self._xlsx_file.iter_rows(),
+                                              len(self.row_list), None)
+        return self._row_iter
+
+    def _close_file(self):
+        if self._xlsx_file is not None:
+            self._xlsx_file.close()
+        self._xlsx_file = None
+        self._row_iter = None
+
+    def read_page(self):
+        """Read the next page, return its rows ([] at the end of file)."""
+        with self._lock:
+            if self.exhausted:
+                return []
+            new_row_list = list(itertools.islice(self._iter_rest(),
+                                                 self.page_rows))
+            self.row_list.extend(new_row_list)
+            if len(new_row_list) < self.page_rows:
+                self.exhausted = True
+                self._close_file()
+            return new_row_list
+
+    def read_all(self):
+        """Return all rows of the file."""
+        with self._lock:
+            if self.exhausted:
+                return list(self.row_list)
+            row_list = self.row_list + list(self._iter_rest())
+            self._close_file()
+            return row_list
+
+    def is_up_to_date(self):
+        """Whether the file was not changed since the reader was opened."""
+        if self._closed:
+            return False
+        try:
+            return get_file_stat(self.excel_file) == self._file_stat
+        except OSError:
+            return False
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+            self._closed = True
+            self.exhausted = True
 
-        return xlsx_data_dict
+
+def read_xlsx_rows(excel_file, xlsx_preview_list=None):
+    """All rows of excel_file. Read by its XlsxPreview in xlsx_preview_list
+    if there is one and the file was not changed since.
+    """
+    for xlsx_preview in xlsx_preview_list or []:
+        if xlsx_preview is not None and \
+                xlsx_preview.excel_file == excel_file and \
+                xlsx_preview.is_up_to_date():
+            return xlsx_preview.read_all()
+    xlsx_file = XlsxFile(excel_file, read_only=True)
+    row_list = list(xlsx_file.iter_rows())
+    xlsx_file.close()
+    return row_list
 
 
 class QueryParser(object):
@@ -326,18 +564,23 @@ class QueryParser(object):
 
     >>> query = QueryParser(query_file)
     >>> query_tuple = query.query_tuple
+
+    row_list: Rows of the query file already read, the file is not parsed
+              again.
     """
 
-    def __init__(self, query_file):
+    def __init__(self, query_file, row_list=None):
         if not query_file:
             error_msg = "No such query file: %s" % query_file
             logging.error(error_msg)
             raise IOError(error_msg)
-        self._query_xlsx_file = XlsxFile(query_file)
+        if row_list is None:
+            row_list = XlsxFile(query_file).xlsx_matrix
+        self._row_list = row_list
 
     @property
     def query_tuple(self):
-        return self._query_xlsx_file.xlsx_matrix
+        return self._row_list
 
 
 class WebInfo(object):
@@ -512,27 +755,36 @@ class WebInfo(object):
 
 
 class WebInfoCacheMultithreading(object):
-    def __init__(self, query_file):
+    def __init__(self, query_file, cache=None, job=None,
+                 query_tuple_list=None):
         self.query_file = query_file
+        self.cache = cache if cache is not None else _default_query_cache
+        self.job = job
+        self.progress = None
         self.non_repeatitive_species_name_list = \
-            self._get_non_repeatitive_species_name_list()
+            self._get_non_repeatitive_species_name_list(query_tuple_list)
 
-    def _get_non_repeatitive_species_name_list(self):
-        query_tuple_list = QueryParser(self.query_file).query_tuple
+    def _get_non_repeatitive_species_name_list(self, query_tuple_list=None):
+        if query_tuple_list is None:
+            query_tuple_list = QueryParser(self.query_file).query_tuple
         non_repeatitive_species_name_list = list(
             set([_[3] for _ in query_tuple_list]))
 
         return non_repeatitive_species_name_list
 
     def _single_query(self, one_species_name):
-        global _web_data_cache_dict
-
+        if self.job is not None:
+            self.job.checkpoint()
         try:
             pretty_info_tuple = WebInfo(one_species_name).pretty_info_tuple
-            _web_data_cache_dict[one_species_name] = pretty_info_tuple
+            self.cache.web_data_cache_dict[one_species_name] = \
+                pretty_info_tuple
         except Exception as e:
             logging.error('Cannot get info from web: %s (%s)' %
                           (one_species_name, e))
+        finally:
+            if self.progress is not None:
+                self.progress.update()
 
     def get_web_dict_multithreading(self):
         if POOL_NUM > 1 and POOL_NUM < 50:
@@ -541,50 +793,288 @@ class WebInfoCacheMultithreading(object):
                          "  [ %d ]\n" % POOL_NUM)
         else:
             pool = Pool()
-        if os.path.isfile(LOCAL_JSON_CACHE_FILE):
-            with open(LOCAL_JSON_CACHE_FILE, 'rb') as f:
-                local_web_cache_dict = json.loads(f.read())
-            species_in_local_json_cache = local_web_cache_dict.keys()
+        web_data_cache_dict = self.cache.web_data_cache_dict
+        with _local_json_cache_lock:
+            local_web_cache_dict = self._read_local_json_cache()
+        if local_web_cache_dict:
             logging.info(
                 '[ CACHE ] Get cache from local JSON file:\n  |- %s' %
-                '\n  |- '.join(species_in_local_json_cache))
-        else:
-            species_in_local_json_cache = []
-            local_web_cache_dict = {}
+                '\n  |- '.join(local_web_cache_dict.keys()))
+        # Species in the cache of a previous job are not fetched again
         species_not_in_cache = list(
             set(self.non_repeatitive_species_name_list).difference(
-                set(species_in_local_json_cache)))
-        pool.map(self._single_query, species_not_in_cache)
-        _web_data_cache_dict.update(local_web_cache_dict)
-        with open(LOCAL_JSON_CACHE_FILE, 'wb') as f:
-            json.dump(_web_data_cache_dict, f,
-                      indent=4, separators=(',', ': '))
+                set(local_web_cache_dict), set(web_data_cache_dict)))
+        self.progress = Progress('fetch', len(species_not_in_cache))
+        try:
+            pool.map(self._single_query, species_not_in_cache)
+        finally:
+            pool.close()
+            pool.join()
+            self.progress.finish()
+            for species_name, info_tuple in local_web_cache_dict.items():
+                web_data_cache_dict.setdefault(species_name, info_tuple)
+            # Species fetched before the job was cancelled are kept too
+            with _local_json_cache_lock:
+                local_web_cache_dict = self._read_local_json_cache()
+                local_web_cache_dict.update(web_data_cache_dict)
+                with io.open(LOCAL_JSON_CACHE_FILE, 'w',
+                             encoding='utf-8') as f:
+                    # unicode_literals: text on Python 2 as well
+                    f.write('%s' % json.dumps(
+                        local_web_cache_dict,
+                        indent=4, separators=(',', ': ')))
             logging.info(
                 '[ CACHE ] Write all cache to local JSON file:\n  |- %s' %
-                '\n  |- '.join(_web_data_cache_dict.keys()))
-        pool.close()
-        pool.join()
+                '\n  |- '.join(local_web_cache_dict.keys()))
+
+    @staticmethod
+    def _read_local_json_cache():
+        if not os.path.isfile(LOCAL_JSON_CACHE_FILE):
+            return {}
+        with open(LOCAL_JSON_CACHE_FILE, 'rb') as f:
+            return json.loads(f.read())
+
+
+class OfflineDataIndex(object):
+    """Persistent index of the data file, keyed by 物种编号.
+
+    The index is a SQLite3 file next to the data file, one for each key
+    column. It is built once and only rebuilt when the data file changed
+    (mtime and size are checked first, then the SHA1 of the content). The
+    last OFFLINE_INDEX_ROW_CACHE_SIZE rows looked up are kept in memory.
+    Lookups work like a dictionary, from any thread:
+
+    >>> index = OfflineDataIndex("data.xlsx")
+    >>> "S001" in index
+    >>> offline_info_tuple = index["S001"]
+    """
+
+    def __init__(self, offline_data_file, key_column_index=0,
+                 data_row_list=None):
+        self.offline_data_file = offline_data_file
+        self.key_column_index = key_column_index
+        # Rows of the data file already read, used if the index is rebuilt
+        self.data_row_list = data_row_list
+        self.index_file = '%s.col%d%s' % (offline_data_file, key_column_index,
+                                          OFFLINE_INDEX_SUFFIX)
+        # Checked before the index file is created
+        if not os.path.isfile(offline_data_file):
+            logging.error("[ ERROR ] No such xlsx file: %s"
+                          % offline_data_file)
+            raise ValueError('[ ERROR ] No such xlsx file: {}'.format(
+                offline_data_file))
+        if not os.access(offline_data_file, os.R_OK):
+            logging.error("[ ERROR ] Cannot read xlsx file: %s"
+                          % offline_data_file)
+            raise ValueError('[ ERROR ] Cannot read xlsx file: {}'.format(
+                offline_data_file))
+        self._row_cache = OrderedDict()
+        self._length = None
+        # The connection is shared by the query threads
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.index_file, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                          '(name TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS offline_data '
+                          '(key TEXT PRIMARY KEY, row BLOB)')
+        if not self._is_up_to_date():
+            self.rebuild()
+
+    def _get_meta(self):
+        return dict(self.conn.execute('SELECT name, value FROM meta'))
+
+    def _file_sha1(self):
+        sha1 = hashlib.sha1()
+        with open(self.offline_data_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _is_up_to_date(self):
+        """Check whether the index was built from the current data file."""
+        meta = self._get_meta()
+        if meta.get('key_column_index') != str(self.key_column_index):
+            return False
+        stat = os.stat(self.offline_data_file)
+        if meta.get('mtime') == repr(stat.st_mtime) and \
+                meta.get('size') == str(stat.st_size):
+            return True
+        # mtime changed (copied or touched file), compare content hash
+        if meta.get('sha1') != self._file_sha1():
+            return False
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                              ('mtime', repr(stat.st_mtime)))
+        return True
+
+    def rebuild(self):
+        """Parse the data file and write all rows to the index file."""
+        logging.info('[ Offline Index ]  正在生成 data 文件索引：{}'.format(
+            self.index_file))
+        stat = os.stat(self.offline_data_file)
+        sha1 = self._file_sha1()
+        xlsx_file = None
+        if self.data_row_list is None:
+            xlsx_file = XlsxFile(self.offline_data_file, read_only=True)
+            row_iter = xlsx_file.iter_rows()
+        else:
+            row_iter = iter(self.data_row_list)
+        progress = Progress('index', None if self.data_row_list is None
+                            else len(self.data_row_list))
+
+        def iter_index_items():
+            for key, row_tuple in iter_data_items(row_iter,
+                                                  self.key_column_index):
+                progress.update()
+                yield key, sqlite3.Binary(pickle.dumps(row_tuple, 2))
+
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM meta')
+            self.conn.execute('DELETE FROM offline_data')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO offline_data VALUES (?, ?)',
+                iter_index_items())
+            self.conn.executemany(
+                'INSERT INTO meta VALUES (?, ?)',
+                (('mtime', repr(stat.st_mtime)),
+                 ('size', str(stat.st_size)),
+                 ('sha1', sha1),
+                 ('key_column_index', str(self.key_column_index))))
+            self._row_cache = OrderedDict()
+            self._length = None
+        if xlsx_file is not None:
+            xlsx_file.close()
+        progress.finish()
+        # Not needed any more, rows are looked up in the index
+        self.data_row_list = None
+
+    def get(self, key, default=None):
+        with self._lock:
+            row_tuple = self._row_cache.pop(key, None)
+            if row_tuple is None:
+                row = self.conn.execute(
+                    'SELECT row FROM offline_data WHERE key = ?',
+                    (key,)).fetchone()
+                if row is None:
+                    return default
+                row_tuple = pickle.loads(bytes(row[0]))
+                # Drop the least recently used row
+                if self._row_cache and \
+                        len(self._row_cache) >= OFFLINE_INDEX_ROW_CACHE_SIZE:
+                    self._row_cache.popitem(last=False)
+            self._row_cache[key] = row_tuple
+        return row_tuple
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        row_tuple = self.get(key)
+        if row_tuple is None:
+            raise KeyError(key)
+        return row_tuple
+
+    def __len__(self):
+        with self._lock:
+            if self._length is None:
+                self._length = self.conn.execute(
+                    'SELECT COUNT(*) FROM offline_data').fetchone()[0]
+        return self._length
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
 
 
 class OfflineDataCache(object):
-    def __init__(self, offline_data_file):
+    def __init__(self, offline_data_file, cache=None, data_row_list=None):
         self.offline_data_file = offline_data_file
+        self.cache = cache if cache is not None else _default_query_cache
+        self.data_row_list = data_row_list
 
     def get_xlsx_data_dict(self):
-        global _xlsx_data_cache_dict
-        _xlsx_data_cache_dict = XlsxFile(
-            self.offline_data_file).get_xlsx_data_dict(key_column_index=0)
+        if USE_OFFLINE_INDEX:
+            xlsx_data_cache_dict = OfflineDataIndex(
+                self.offline_data_file, key_column_index=0,
+                data_row_list=self.data_row_list)
+        elif self.data_row_list is not None:
+            xlsx_data_cache_dict = dict(iter_data_items(
+                self.data_row_list, key_column_index=0))
+        else:
+            xlsx_data_cache_dict = XlsxFile(
+                self.offline_data_file).get_xlsx_data_dict(
+                    key_column_index=0)
+        self.cache.set_xlsx_data_cache(self.offline_data_file,
+                                       xlsx_data_cache_dict)
+
+
+class QueryCache(object):
+    """一个任务使用的缓存：web 信息（物种名 -> 信息）和 data 文件内容。
+
+    每个任务有自己的 QueryCache，同时运行的任务互不影响。JobManager 把已完成
+    任务的缓存复制给之后的任务：已查询的物种不再联网，data 文件未改变时也不再
+    重新读取。
+    """
+    def __init__(self, web_data_cache_dict=None):
+        self.web_data_cache_dict = dict(web_data_cache_dict or {})
+        self.xlsx_data_cache_dict = None
+        self.offline_data_file = None
+        self._offline_data_file_stat = None
 
+    def set_xlsx_data_cache(self, offline_data_file, xlsx_data_cache_dict):
+        self.offline_data_file = offline_data_file
+        self._offline_data_file_stat = get_file_stat(offline_data_file)
+        self.xlsx_data_cache_dict = xlsx_data_cache_dict
+
+    def has_xlsx_data_cache(self, offline_data_file):
+        """data 文件的缓存是否可用（同一个文件且之后未被修改）。"""
+        if (self.xlsx_data_cache_dict is None or
+                self.offline_data_file != offline_data_file):
+            return False
+        try:
+            return (get_file_stat(offline_data_file) ==
+                    self._offline_data_file_stat)
+        except OSError:
+            return False
+
+    def copy(self):
+        """复制 web 信息缓存；data 文件缓存只读，可共享。"""
+        query_cache = QueryCache()
+        query_cache.update(self)
+        return query_cache
+
+    def update(self, other):
+        """并入另一个 QueryCache 的 web 信息，并使用它的 data 文件缓存。"""
+        self.web_data_cache_dict.update(other.web_data_cache_dict)
+        if other.xlsx_data_cache_dict is not None:
+            self.xlsx_data_cache_dict = other.xlsx_data_cache_dict
+            self.offline_data_file = other.offline_data_file
+            self._offline_data_file_stat = other._offline_data_file_stat
+
+
+# 不指定 cache 时使用（命令行运行）
+_default_query_cache = QueryCache()
 
-def get_cache(query_file, offline_data_file):
-    """Generate cache dictionary for web info and offline info."""
-    # Web Cache
-    if not _web_data_cache_dict:
-        WebInfoCacheMultithreading(query_file).get_web_dict_multithreading()
+
+def get_cache(query_file, offline_data_file, cache=None, job=None,
+              query_tuple_list=None, data_row_list=None):
+    """Generate cache dictionary for web info and offline info.
+
+    query_tuple_list, data_row_list: Rows of the query and data files
+    already read, the files are not parsed again.
+    """
+    if cache is None:
+        cache = _default_query_cache
+
+    # Web Cache, only species not in cache are fetched
+    WebInfoCacheMultithreading(
+        query_file, cache, job,
+        query_tuple_list=query_tuple_list).get_web_dict_multithreading()
 
     # Offline Cache
-    if not _xlsx_data_cache_dict:
-        OfflineDataCache(offline_data_file).get_xlsx_data_dict()
+    if not cache.has_xlsx_data_cache(offline_data_file):
+        OfflineDataCache(offline_data_file, cache,
+                         data_row_list=data_row_list).get_xlsx_data_dict()
 
 
 class Query(object):
@@ -596,15 +1086,20 @@ class Query(object):
     >>> out_tuple = q._formatted_single_output()
     """
 
-    def __init__(self, query_file, offline_data_file):
+    def __init__(self, query_file, offline_data_file, cache=None, job=None,
+                 query_row_list=None, data_row_list=None):
         self.query_file = query_file
         self.offline_data_file = offline_data_file
-        self.query_tuple_list = QueryParser(query_file).query_tuple
+        self.cache = cache if cache is not None else _default_query_cache
+        self.job = job
+        self.data_row_list = data_row_list
+        self.query_tuple_list = QueryParser(query_file,
+                                            query_row_list).query_tuple
 
     def _do_single_raw_query(self, one_query_tuple):
         """Do query for one species and get raw results."""
-        global _web_data_cache_dict
-        global _xlsx_data_cache_dict
+        web_data_cache_dict = self.cache.web_data_cache_dict
+        xlsx_data_cache_dict = self.cache.xlsx_data_cache_dict
 
         collection_id_prefix, serial_number, barcode, species_name, same_species_num = one_query_tuple
         if not species_name:
@@ -614,8 +1109,8 @@ class Query(object):
         # ===============================================================
         # Web Crawler Cache
         # ===============================================================
-        if species_name in _web_data_cache_dict:
-            web_info_tuple = _web_data_cache_dict[species_name]
+        if species_name in web_data_cache_dict:
+            web_info_tuple = web_data_cache_dict[species_name]
         else:
             if len(one_query_tuple[3].split()) >= 2:
                 web_info_tuple = tuple([
@@ -629,8 +1124,8 @@ class Query(object):
         # ===============================================================
         # Offline Data Cache
         # ===============================================================
-        if collection_id_prefix in _xlsx_data_cache_dict:
-            offline_info_tuple = _xlsx_data_cache_dict[collection_id_prefix]
+        if collection_id_prefix in xlsx_data_cache_dict:
+            offline_info_tuple = xlsx_data_cache_dict[collection_id_prefix]
         else:
             offline_info_tuple = None
 
@@ -845,32 +1340,35 @@ class Query(object):
 
         logging.info("{}程序需要先从互联网查询所有物种的详细信息，这可能需要一些时间，请耐心等待...{}".format(THIN_BAR, THIN_BAR))
 
-        # Generate global cache dict for web and offline data
-        get_cache(self.query_file, self.offline_data_file)
+        # Generate cache dict for web and offline data
+        get_cache(self.query_file, self.offline_data_file, self.cache,
+                  self.job, query_tuple_list=self.query_tuple_list,
+                  data_row_list=self.data_row_list)
 
         logging.info("\n{}开始处理每一个物种 ...{}".format(THIN_BAR, THIN_BAR))
 
-        # Do query for each entry
-        log_info = list()
-        for i, each_query_tuple in enumerate(self.query_tuple_list):
-            if (i + 1) % 10 == 0:
-                logging.info('  {} - {} Done!'.format(i - 9, i + 1))
-            log_info.append(
-                "[ {} ] {}\n\n".format(i + 1, each_query_tuple[2]) +
-                "       采集号（{}）\n".format(each_query_tuple[0]) +
-                "       流水号（{}）\n".format(each_query_tuple[1]) +
-                "       条形码（{}）\n".format(str(each_query_tuple[2]).zfill(8)) +
-                "       物种名（{}）\n\n".format(each_query_tuple[3])
-            )
+        # Do query for each entry, progress is shown instead of a log per row
+        progress = Progress('query', len(self.query_tuple_list))
+        for each_query_tuple in self.query_tuple_list:
+            if self.job is not None:
+                self.job.checkpoint()
             out_tuple = self._formatted_single_output(each_query_tuple)
             out_tuple_list.append(out_tuple)
+            progress.update()
+        progress.finish()
 
-        return out_tuple_list, '\n'.join(log_info)
+        log_info = '共处理 {} 条 query 记录，{} 个物种。'.format(
+            len(out_tuple_list),
+            len(set(_[3] for _ in self.query_tuple_list)))
+        return out_tuple_list, log_info
 
 
-def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx"):
+def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx",
+                       job=None):
     """Write tuple list to xlsx file.
 
+    job: QueryJob, which may be paused or cancelled between rows.
+
     >>> write_to_xlsx_file([('a', 'b', 'c'), ('e', 'f', 'g')])
 
     +-----+-----+-----+
@@ -888,8 +1386,13 @@ def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx"):
     ws1.append(HEADER_TUPLE)
 
     # Content
-    for i, tuple_row in enumerate(out_tuple_list):
+    progress = Progress('write xlsx', len(out_tuple_list))
+    for tuple_row in out_tuple_list:
+        if job is not None:
+            job.checkpoint()
         ws1.append(tuple_row)
+        progress.update()
+    progress.finish()
     try:
         out_wb.save(filename=xlsx_outfile_name)
         logging.info("{}[ xlsx File ]  结果已写入文件：{}{}".format(
@@ -902,201 +1405,436 @@ def write_to_xlsx_file(out_tuple_list, xlsx_outfile_name="out.xlsx"):
         logging.info("\n{}[ xlsx File ]  结果已写入临时文件：{}{}".format(THIN_BAR, alt_xlsx_outfile, THIN_BAR))
 
 
-def data_validation(data_file, query_file):
+class ValidationReport(object):
+    """数据校验结果：每个文件每类问题的数目、前几个示例及所在行范围。
+
+    每类问题只保留 MAX_EXAMPLE_NUM 个示例及行范围，报告大小与文件大小无关。
+
+    >>> report = ValidationReport()
+    >>> report.add("query.xlsx", "blank_cell", 12, "第 3 列")
+    >>> report.log()
+    >>> report.to_json()
+    """
+    # rule: (level, message)
+    RULES = {
+        'column_num': ('error', '列数目有误'),
+        'no_latin_name': ('error', 'latin 名缺失'),
+        'latin_name_one_word': ('error',
+                                'latin 名需要至少包含: genus + species'),
+        'short_row': ('warning', '行内容过短'),
+        'blank_cell': ('warning', '存在缺失的单元格'),
+        'not_in_data_file': ('warning', 'latin 名不在 data 文件中'),
+    }
+
+    def __init__(self, max_examples=None):
+        self.max_examples = (MAX_EXAMPLE_NUM if max_examples is None
+                             else max_examples)
+        # (file_name, rule): {'count': 0, 'examples': [], 'row_ranges': []}
+        self.result_dict = {}
+
+    def add(self, file_name, rule, row_num, value=None):
+        """Record one problem found at row row_num (1 based)."""
+        key = (file_name, rule)
+        if key not in self.result_dict:
+            if rule not in self.RULES:
+                raise ValueError('Unknown validation rule: %s' % rule)
+            self.result_dict[key] = {'count': 0, 'examples': [],
+                                     'row_ranges': [], 'more_rows': False}
+        result = self.result_dict[key]
+        result['count'] += 1
+        if len(result['examples']) < self.max_examples:
+            result['examples'].append((row_num, value))
+        row_ranges = result['row_ranges']
+        if row_ranges and row_ranges[-1][1] + 1 >= row_num:
+            row_ranges[-1][1] = max(row_ranges[-1][1], row_num)
+        elif len(row_ranges) < self.max_examples:
+            row_ranges.append([row_num, row_num])
+        else:
+            result['more_rows'] = True
+
+    @property
+    def has_errors(self):
+        return any(self.RULES[rule][0] == 'error'
+                   for _, rule in self.result_dict)
+
+    def to_dict(self):
+        """Return the report as a list of dicts, errors first."""
+        level_order = {'error': 0, 'warning': 1}
+        return [dict(file=file_name, rule=rule,
+                     level=self.RULES[rule][0],
+                     message=self.RULES[rule][1],
+                     **self.result_dict[(file_name, rule)])
+                for file_name, rule in sorted(
+                    self.result_dict,
+                    key=lambda _: (level_order[self.RULES[_[1]][0]], _))]
+
+    def to_json(self, json_file=None):
+        """Return the report as JSON, also written to json_file if given."""
+        report_json = json.dumps(self.to_dict(), ensure_ascii=False,
+                                 indent=2)
+        if json_file is not None:
+            with io.open(json_file, 'w', encoding='utf-8') as f:
+                f.write(report_json)
+        return report_json
+
+    def format_lines(self):
+        """Return report as text lines (one line by rule, then examples)."""
+        lines = []
+        for result in self.to_dict():
+            row_ranges = ', '.join(
+                ('%d' % start_row if start_row == end_row
+                 else '%d-%d' % (start_row, end_row))
+                for start_row, end_row in result['row_ranges'])
+            if result['more_rows']:
+                row_ranges += ', ...'
+            lines.append('[ {} ] {}：{}（共 {} 处，行：{}）'.format(
+                result['level'].upper(), result['file'], result['message'],
+                result['count'], row_ranges))
+            for row_num, value in result['examples']:
+                if value is None:
+                    lines.append('    -> 行 {}'.format(row_num))
+                else:
+                    lines.append('    -> 行 {}：{}'.format(row_num, value))
+            if result['count'] > len(result['examples']):
+                lines.append('    -> ... 另有 {} 处'.format(
+                    result['count'] - len(result['examples'])))
+        return lines
+
+    def log(self):
+        """Log report, one call for all lines."""
+        lines = self.format_lines()
+        if not lines:
+            logging.info('[ OK ] data 文件及 query 文件未发现问题')
+        elif self.has_errors:
+            logging.error('\n'.join(lines))
+        else:
+            logging.warning('\n'.join(lines))
+
+
+def _check_rows(report, file_name, row_list, latin_name_index,
+                skip_header=False):
+    """Check rows of one file, return set of stripped latin names."""
+    latin_name_set = set()
+    for i, row_tuple in enumerate(row_list):
+        row_num = i + 1
+        for j, cell in enumerate(row_tuple):
+            if not cell:
+                report.add(file_name, 'blank_cell', row_num,
+                           '第 {} 列'.format(j + 1))
+        # First row of data file is header
+        if skip_header and row_num == 1:
+            continue
+        if len(row_tuple) <= latin_name_index:
+            report.add(file_name, 'short_row', row_num, len(row_tuple))
+            continue
+        # If line is blank line, skip
+        if not row_tuple[0] and not row_tuple[2]:
+            continue
+        latin_name = row_tuple[latin_name_index]
+        if not latin_name:
+            report.add(file_name, 'no_latin_name', row_num)
+            continue
+        if len(latin_name.split()) < 2:
+            report.add(file_name, 'latin_name_one_word', row_num, latin_name)
+        latin_name_set.add(latin_name.strip())
+    return latin_name_set
+
+
+def data_validation(data_file, query_file, report_file=None,
+                    data_row_list=None, query_row_list=None):
     """Validate data and query files before program run.
 
     This will save time. If there is error in data file, program may crush
     after long time run. So it's better to validate data file before running.
+
+    Return the ValidationReport, files can be queried if it has no error.
+    report_file: JSON file to write the validation report to.
+    data_row_list, query_row_list: Rows of the files already read.
     """
-    error_list = list()
+    report = ValidationReport()
 
     # Get file tuple list
-    data_file_tuple_list = XlsxFile(data_file).xlsx_matrix
-    query_file_tuple_list = XlsxFile(query_file).xlsx_matrix
+    data_file_tuple_list = data_row_list
+    if data_file_tuple_list is None:
+        data_file_tuple_list = XlsxFile(data_file).xlsx_matrix
+    query_file_tuple_list = query_row_list
+    if query_file_tuple_list is None:
+        query_file_tuple_list = XlsxFile(query_file).xlsx_matrix
 
     logging.info("{}数据校验开始 ...".format(THIN_BAR))
 
-    critical_error = False
+    # Check if number of columns of data and query files is correct
+    for file_name, tuple_list, header_tuple in (
+            (data_file, data_file_tuple_list, DATA_FILE_HEADER_TUPLE),
+            (query_file, query_file_tuple_list, QUERY_FILE_HEADER_TUPLE)):
+        column_num = len(tuple_list[0]) if tuple_list else 0
+        if column_num != len(header_tuple):
+            report.add(file_name, 'column_num', 1,
+                       '当前为 {}，应该为 {}（{}）'.format(
+                           column_num, len(header_tuple),
+                           ' | '.join(header_tuple)))
+
+    latin_names_in_data_file = _check_rows(
+        report, data_file, data_file_tuple_list, 2, skip_header=True)
+    latin_names_in_query_file = _check_rows(
+        report, query_file, query_file_tuple_list, 3)
 
-    # Check if latin name is missing in data file
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 检查 data 文件（{}）中的 latin 名是否有缺失 ... '.format(data_file))
-    latin_names_in_data_file = []
-    for i, each_tuple in enumerate(data_file_tuple_list[1:]):
-        # If line is blank line, skip
-        try:
-            if not each_tuple[0] and not each_tuple[2]:
-                continue
-        except Exception as e:
-            error_list.append('Line %s: %s' % (i + 1, e))
-        if each_tuple[2]:
-            latin_name = each_tuple[2]
-            if len(latin_name.split()) < 2:
-                error_list.append('  （{} 行）latin 名需要至少包含: genus + species：{}'.format(i + 2, latin_name))
-                critical_error = True
-            latin_names_in_data_file.append(each_tuple[2].strip())
-        else:
-            error_list.append('  （{} 行）latin 名缺失'.format(i + 1, data_file))
-            critical_error = True
-
-    if len(error_list) > MAX_ERROR_NUM:
-        error_list = error_list[:MAX_ERROR_NUM]
-        error_list.append('... ...')
-        error_list.append('错误过多（大于 {} 个），是否文件错误？'.format(MAX_ERROR_NUM))
-        logging.error('\n'.join(error_list))
-        return False
-
-    # Check if latin name is missing in query file
-    logging.info(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 检查 query 文件（{}）中的 latin 名是否有缺失 ... '.format(query_file))
-    latin_names_in_query_file = []
+    # Check if latin names in query file in data file
+    reported_latin_name_set = set()
     for i, each_tuple in enumerate(query_file_tuple_list):
-        # If line is blank line, skip
+        if len(each_tuple) <= 3 or not each_tuple[3]:
+            continue
+        latin_name = each_tuple[3].strip()
+        if latin_name in latin_names_in_query_file and \
+                latin_name not in latin_names_in_data_file and \
+                latin_name not in reported_latin_name_set:
+            reported_latin_name_set.add(latin_name)
+            report.add(query_file, 'not_in_data_file', i + 1, latin_name)
+
+    report.log()
+    if report_file is not None:
+        report.to_json(report_file)
+    if report.has_errors:
+        logging.error('[ ERROR ] 请确保 data 文件及 query 文件中均无 latin 名缺失'
+                      '，且列数目正确！')
+    logging.info(BAR)
+    return report
+
+
+class JobCancelled(Exception):
+    """任务已被取消。"""
+
+
+class QueryJob(object):
+    """一个查询任务（data 文件、query 文件、输出文件），可暂停、继续和取消。
+
+    任务在查询每个物种、处理及写入每一行之前调用 checkpoint()：暂停时在此
+    等待，取消后抛出 JobCancelled。状态改变及日志通过 listener 发出（任务
+    本身，或一条日志文字）。
+
+    xlsx_preview_list: 预览这些文件时用的 XlsxPreview，文件未改变时任务继续用
+    它们读取，不再重新打开文件。
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    CANCELLED = 'cancelled'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_TEXT = {
+        PENDING: '等待中',
+        RUNNING: '运行中',
+        PAUSED: '已暂停',
+        CANCELLED: '已取消',
+        DONE: '已完成',
+        FAILED: '失败',
+    }
+
+    _job_id_counter = itertools.count(1)
+
+    def __init__(self, data_file, query_file, output_file, listener=None,
+                 xlsx_preview_list=None):
+        self.job_id = next(QueryJob._job_id_counter)
+        self.data_file = data_file
+        self.query_file = query_file
+        self.output_file = output_file
+        self.listener = listener
+        self.xlsx_preview_list = xlsx_preview_list
+        self.status = QueryJob.PENDING
+        self.message = '任务已加入队列'
+        self.cache = None
+        self._cancel_event = threading.Event()
+        # Cleared while the job is paused
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._lock = threading.Lock()
+
+    @property
+    def status_text(self):
+        return QueryJob.STATUS_TEXT[self.status]
+
+    @property
+    def is_finished(self):
+        return self.status in (QueryJob.CANCELLED, QueryJob.DONE,
+                               QueryJob.FAILED)
+
+    def _notify(self, item):
+        if self.listener is not None:
+            self.listener(item)
+
+    def _set_status(self, status, message):
+        with self._lock:
+            self.status = status
+            self.message = message
+        self._notify(self)
+
+    def _set_message(self, message):
+        self.message = message
+        self._notify(self)
+
+    def cancel(self):
+        """取消任务：等待中的任务不再运行，运行中的任务在下一个 checkpoint
+        停止。"""
+        self._cancel_event.set()
+        self._resume_event.set()
+        with self._lock:
+            if self.status != QueryJob.PENDING:
+                return
+        self._set_status(QueryJob.CANCELLED, '任务已取消')
+
+    def pause(self):
+        with self._lock:
+            if self.status != QueryJob.RUNNING:
+                return
+            self._resume_event.clear()
+        self._set_status(QueryJob.PAUSED, '任务已暂停')
+
+    def resume(self):
+        with self._lock:
+            if self.status != QueryJob.PAUSED:
+                return
+            self._resume_event.set()
+        self._set_status(QueryJob.RUNNING, '任务继续运行 ...')
+
+    def checkpoint(self):
+        """暂停时等待继续；已取消时抛出 JobCancelled。"""
+        self._resume_event.wait()
+        if self._cancel_event.is_set():
+            raise JobCancelled('任务已取消：{}'.format(self.query_file))
+
+    def run(self, cache):
+        """在工作线程中运行任务，cache 为该任务使用的 QueryCache。"""
+        self.cache = cache
+        with self._lock:
+            if self._cancel_event.is_set():
+                return
+        self._set_status(QueryJob.RUNNING, '开始进行数据校验 ...')
+        time_start = time.time()
+        _job_local.job_id = self.job_id
+
         try:
-            if not each_tuple[0] and not each_tuple[2]:
-                continue
-        except Exception as e:
-            error_list.append('Line %s: %s' % (i + 1, e))
-        if each_tuple[3]:
-            latin_name = each_tuple[3]
-            if len(latin_name.split()) < 2:
-                error_list.append('  （{} 行）latin 名需要至少包含: genus + species：{}'.format(i + 1, latin_name))
-                critical_error = True
-            latin_names_in_query_file.append(latin_name.strip())
-        else:
-            error_list.append('  （{} 行）latin 名缺失'.format(i + 1, query_file))
-            critical_error = True
-
-    if len(error_list) > MAX_ERROR_NUM:
-        error_list = error_list[:MAX_ERROR_NUM]
-        error_list.append('... ...')
-        error_list.append('错误过多（大于 {} 个），是否文件错误？'.format(MAX_ERROR_NUM))
-        logging.error('\n'.join(error_list))
-        return False
-
-    if critical_error:
-        error_list.append('[ ERROR ] 请确保 data 文件及 query 文件中均无 latin 名缺失！')
-        logging.info('\n'.join(error_list))
-        return False
-
-    # Check if number of lines of data file is correct
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 开始校验 data 文件的列数目是否正确 ...')
-    if len(data_file_tuple_list[0]) != len(DATA_FILE_HEADER_TUPLE):
-        error_list.append(
-            '[ ERROR ] data 文件的列数目有误：当前为 {}，应该为 {}（{}）'.format(
-                len(data_file_tuple_list[0]),
-                len(QUERY_FILE_HEADER_TUPLE),
-                QUERY_FILE_HEADER_TUPLE))
-        logging.info('\n'.join(error_list))
-        return False
-
-    # Check if number of lines of query file is correct
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 开始校验 query 文件的列数目是否正确 ...')
-    if len(query_file_tuple_list[0]) != len(QUERY_FILE_HEADER_TUPLE):
-        error_list.append(
-            '[ ERROR ] data 文件的列数目有误：当前为 {}，应该为 {}（{}) '.format(
-                len(query_file_tuple_list[0]),
-                len(DATA_FILE_HEADER_TUPLE),
-                DATA_FILE_HEADER_TUPLE))
-        logging.info('\n'.join(error_list))
-        return False
-
-    # Check if is there any missing cell in data file
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 检查 data 文件中是否有缺失的单元格 ...')
-    for i, row in enumerate(data_file_tuple_list):
-        for j, cell in enumerate(row):
-            if not cell:
-                error_list.append(
-                    '    -> data 文件中存在缺失的单元格: [%s:  行: %s, 列: %s]' %
-                    (data_file, i + 1, j + 1))
-
-    if len(error_list) > MAX_ERROR_NUM:
-        error_list = error_list[:MAX_ERROR_NUM]
-        error_list.append('... ...')
-        error_list.append('错误过多（大于 {} 个），是否文件错误？'.format(MAX_ERROR_NUM))
-        logging.error('\n'.join(error_list))
-        return False
-
-    # Check if is there any missing cell in query file
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 检查 query 文件中是否有缺失的单元格 ...')
-    for i, row in enumerate(query_file_tuple_list):
-        for j, cell in enumerate(row):
-            if not cell:
-                error_list.append(
-                    '    -> query 文件中存在缺失的单元格: [%s:  行: %s, 列: %s]' %
-                    (query_file, i + 1, j + 1))
+            data_row_list = read_xlsx_rows(self.data_file,
+                                           self.xlsx_preview_list)
+            query_row_list = read_xlsx_rows(self.query_file,
+                                            self.xlsx_preview_list)
 
-    if len(error_list) > MAX_ERROR_NUM:
-        error_list = error_list[:MAX_ERROR_NUM]
-        error_list.append('... ...')
-        error_list.append('错误过多（大于 {} 个），是否文件错误？'.format(MAX_ERROR_NUM))
-        logging.error('\n'.join(error_list))
-        return False
+            # Data validation
+            report = data_validation(data_file=self.data_file,
+                                     query_file=self.query_file,
+                                     data_row_list=data_row_list,
+                                     query_row_list=query_row_list)
+            if report.has_errors:
+                self._notify('数据校验失败')
+                self._set_status(
+                    QueryJob.FAILED, "数据校验失败！（{} 类错误）".format(
+                        sum(_['level'] == 'error' for _ in report.to_dict())))
+                return
+            self.checkpoint()
+            self._set_message('开始进行预处理，请耐心等待 ... ')
+            query = Query(self.query_file, self.data_file, cache, self,
+                          query_row_list=query_row_list,
+                          data_row_list=data_row_list)
 
-    # Check if latin names in query file in data file
-    error_list.append(THIN_BAR_NO_NEWLINE)
-    error_list.append('[ Start ] 检查 query 文件中的 latin 名是否在 data 文件中也存在 ...')
-    tmp_latin_name_set = set([])
-    latin_names_set_from_data_file = set(latin_names_in_data_file)
-    for i, latin_name in enumerate(latin_names_in_query_file):
-        if latin_name not in latin_names_set_from_data_file:
-            if latin_name not in tmp_latin_name_set:
-                tmp_latin_name_set.add(latin_name)
-                error_list.append(
-                    '    -> query 文件（%s）中的 latin 名（%s）不在 data 文件中 [行 %s]' %
-                    (query_file, latin_name, i + 1))
-    error_list.append(THIN_BAR_NO_NEWLINE)
-
-    if len(error_list) > MAX_ERROR_NUM:
-        error_list = error_list[:MAX_ERROR_NUM]
-        error_list.append('... ...')
-        error_list.append('错误过多（大于 {} 个），是否文件错误？'.format(MAX_ERROR_NUM))
-        logging.error('\n'.join(error_list))
-        return False
-
-    # # Check if Latin names in built-in Latin name list
-    # try:
-    #     with open(DEFAULT_LATIN_NAME_FILE, 'r') as f:
-    #         default_latin_names_list_1 = [x.strip() for x in f.readlines()
-    #                                       if x.strip()]
-    #     with open(DEFAULT_LATIN_NAME_FILE_2, 'r') as f:
-    #         default_latin_names_list_2 = [x.strip() for x in f.readlines()
-    #                                       if x.strip()]
-    #     default_latin_names = set(default_latin_names_list_1
-    #                               + default_latin_names_list_2)
-    # except IOError as e:
-    #     logging.warning(
-    #         'Pass latin name check because no built-in latin name file '
-    #         'was found: %s. (%s)' % (DEFAULT_LATIN_NAME_FILE, e))
-    # else:
-    #     logging.info('[ Start ] Validating if latin names from data file in '
-    #                  'built-in latin name list...')
-    #     tmp_warning_set = set([])
-    #     for i, latin_name in enumerate(latin_names_in_data_file):
-    #         if latin_name not in default_latin_names:
-    #             if latin_name not in tmp_warning_set:
-    #                 tmp_warning_set.add(latin_name)
-    #                 logging.warning(
-    #                     '[ WARNING ] [%s:  Line %s]  %s  ' %
-    #                     (data_file, i+1, latin_name))
-    #     logging.info(THIN_BAR_NO_NEWLINE)
-    #     logging.info('[ Start ] Validating if latin names from query file in'
-    #                  ' built-in latin name list...')
-    #     tmp_warning_set = set([])
-    #     for i, latin_name in enumerate(latin_names_in_query_file):
-    #         if latin_name not in default_latin_names:
-    #             if latin_name not in tmp_warning_set:
-    #                 tmp_warning_set.add(latin_name)
-    #                 logging.warning(
-    #                     '[ WARNING ] [%s:  Line %s]  %s  ' %
-    #                     (query_file, i+1, latin_name))
-    error_list.append(BAR)
-    logging.info('\n'.join(error_list))
-    return True
+            self._set_message('开始进行多进程处理，请耐心等待 ... ')
+            out_tuple_list, log_info = query.do_multi_query()
+
+            write_to_xlsx_file(out_tuple_list,
+                               xlsx_outfile_name=self.output_file, job=self)
+            write_result = '已将 {} 条记录写入到输出文件中；{}！'.format(
+                len(out_tuple_list), self.output_file)
+            log_info += '\n{}'.format(write_result)
+            self._notify(log_info)
+
+            time_end = time.time()
+            self._set_status(QueryJob.DONE, '任务完成，共花费时间: %.2f 秒'
+                             % (time_end - time_start))
+        except JobCancelled as e:
+            self._notify('{}'.format(e))
+            self._set_status(QueryJob.CANCELLED, '任务已取消')
+        except Exception as e:
+            logging.error(e)
+            self._notify('ERROR')
+            self._set_status(QueryJob.FAILED, "失败！")
+        finally:
+            _job_local.job_id = None
+            # The previews are not needed any more
+            self.xlsx_preview_list = None
+
+
+class JobManager(object):
+    """用 JOB_WORKER_NUM 个工作线程按提交顺序运行 QueryJob。
+
+    >>> job_manager = JobManager(listener=queue.put)
+    >>> job = job_manager.submit('data.xlsx', 'query_1.xlsx', 'out_1.xlsx')
+    >>> job_manager.submit('data.xlsx', 'query_2.xlsx', 'out_2.xlsx')
+    >>> job.pause()
+    >>> job.resume()
+    >>> job.cancel()
+
+    每个任务使用自己的 QueryCache，任务之间互不影响。任务完成后，它的缓存并入
+    warm cache，之后的任务从 warm cache 的副本开始：已查询过的物种不再联网，
+    data 文件未改变时也不再重新读取。取消或失败的任务的缓存不会并入。
+    """
+    def __init__(self, worker_num=None, listener=None):
+        self.worker_num = worker_num or JOB_WORKER_NUM
+        self.listener = listener
+        self.job_list = []
+        self._job_queue = Queue.Queue()
+        self._warm_cache = QueryCache()
+        self._worker_list = []
+        self._lock = threading.Lock()
+
+    def submit(self, data_file, query_file, output_file,
+               xlsx_preview_list=None):
+        """把任务加入队列，返回 QueryJob。"""
+        job = QueryJob(data_file, query_file, output_file, self.listener,
+                       xlsx_preview_list)
+        with self._lock:
+            self.job_list.append(job)
+            if len(self._worker_list) < self.worker_num:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._worker_list.append(worker)
+        self._job_queue.put(job)
+        job._notify(job)
+        return job
+
+    def get_job(self, job_id):
+        for job in self.job_list:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def cancel_all(self):
+        for job in list(self.job_list):
+            if not job.is_finished:
+                job.cancel()
+
+    def shutdown(self, cancel=True):
+        """停止工作线程。cancel 为 False 时，先运行完队列中的任务。"""
+        if cancel:
+            self.cancel_all()
+        with self._lock:
+            for _ in self._worker_list:
+                self._job_queue.put(None)
+            self._worker_list = []
+
+    def _work(self):
+        while True:
+            job = self._job_queue.get()
+            if job is None:
+                return
+            if job.is_finished:
+                continue
+            with self._lock:
+                cache = self._warm_cache.copy()
+            job.run(cache)
+            if job.status != QueryJob.DONE:
+                continue
+            with self._lock:
+                self._warm_cache.update(cache)
 
 
 def arg_parse():
@@ -1160,26 +1898,70 @@ class TextEmit(object):
 
 
 class TextHandler(logging.Handler):
-    """This class allows you to log to a Tkinter Text or ScrolledText widget"""
+    """This class allows you to log to a Tkinter Text or ScrolledText widget
+
+    Records are put in a bounded queue (any thread), and the Tk loop writes
+    them to the widget in batches every GUI_LOG_FLUSH_MS milliseconds, at
+    most GUI_LOG_MAX_LINES_PER_FLUSH lines at a time. If records come faster
+    than that, the oldest waiting records are dropped (they are still in
+    log.txt), and the widget keeps only the last GUI_LOG_MAX_LINES lines.
+    Must be created in the Tk thread.
+    """
 
-    def __init__(self, text):
+    def __init__(self, text, flush_ms=None, max_lines=None,
+                 max_lines_per_flush=None):
         # run the regular Handler __init__
         logging.Handler.__init__(self)
         # Store a reference to the Text it will log to
         self.text = text
+        self.flush_ms = flush_ms or GUI_LOG_FLUSH_MS
+        self.max_lines = max_lines or GUI_LOG_MAX_LINES
+        self.max_lines_per_flush = (max_lines_per_flush
+                                    or GUI_LOG_MAX_LINES_PER_FLUSH)
+        self._record_queue = deque(maxlen=self.max_lines)
+        self._queue_lock = threading.Lock()
+        self._dropped_num = 0
+        self.text.after(self.flush_ms, self.flush_to_widget)
 
     def emit(self, record):
         msg = self.format(record)
-
-        def append():
+        with self._queue_lock:
+            if len(self._record_queue) == self._record_queue.maxlen:
+                self._dropped_num += 1
+            self._record_queue.append(msg)
+
+    def _take_lines(self):
+        """Take waiting lines for one flush, with a line for dropped ones."""
+        line_list = []
+        with self._queue_lock:
+            if self._dropped_num:
+                line_list.append('... 日志过多，省略 {} 条（完整日志见 '
+                                 'log.txt）'.format(self._dropped_num))
+                self._dropped_num = 0
+            while self._record_queue and \
+                    len(line_list) < self.max_lines_per_flush:
+                line_list.append(self._record_queue.popleft())
+        return line_list
+
+    def flush_to_widget(self):
+        """Write waiting lines to the widget in one insert (Tk thread)."""
+        line_list = self._take_lines()
+        if line_list:
             self.text.configure(state='normal')
-            self.text.insert(tk.END, msg + '\n')
+            self.text.insert(tk.END, '\n'.join(line_list) + '\n')
+            # Keep only the last max_lines lines
+            line_num = int(self.text.index('end-1c').split('.')[0])
+            if line_num > self.max_lines:
+                self.text.delete('1.0', '%d.0' % (line_num - self.max_lines))
             self.text.configure(state='disabled')
             # Autoscroll to the bottom
             self.text.yview(tk.END)
+        self.text.after(self.flush_ms, self.flush_to_widget)
+
 
-        # This is necessary because we can't modify the Text from other threads
-        self.text.after(0, append)
+# A page of rows read by XlsxPreview in a background thread, error is the
+# exception raised if the file could not be read
+PreviewPage = namedtuple("PreviewPage", ["preview", "error"])
 
 
 class Application(tk.Frame):
@@ -1193,10 +1975,19 @@ class Application(tk.Frame):
         self.set_style()
         self.create_widgets()
         self.configure_layout()
-        self.bind_command()
         self.queue = Queue.Queue()
+        self.job_manager = JobManager(listener=self.queue.put)
+        add_progress_listener(self.queue.put)
+        self.bind_command()
         self.data_file = ''
         self.query_file = ''
+        # {file name: XlsxPreview}
+        self._preview_dict = {}
+        self._shown_preview = None
+        self._shown_file_kind = ''
+        self._shown_row_num = 0
+        self._preview_loading = False
+        self.master.after(GUI_PROGRESS_POLL_MS, self.process_queue)
 
     def set_style(self):
         """Set style for widgets."""
@@ -1267,6 +2058,38 @@ class Application(tk.Frame):
             textvariable=self.log_label_value,
             style='log.TLabel')
 
+        # Bottom
+        self.progress_bar = ttk.Progressbar(
+            self.content,
+            orient='horizontal',
+            mode='determinate')
+
+        self.progress_label_value = tk.StringVar()
+        self.progress_label = ttk.Label(
+            self.content,
+            textvariable=self.progress_label_value)
+
+        self.job_tree = ttk.Treeview(
+            self.content,
+            columns=('query_file', 'output_file', 'status', 'progress',
+                     'message'),
+            height=4)
+        self.job_tree.heading('#0', text='Job')
+        self.job_tree.heading('query_file', text='Query File')
+        self.job_tree.heading('output_file', text='Output File')
+        self.job_tree.heading('status', text='Status')
+        self.job_tree.heading('progress', text='Progress')
+        self.job_tree.heading('message', text='Message')
+        self.job_tree.column('#0', width=60, stretch=False)
+
+        self.pause_button = ttk.Button(
+            self.content,
+            text='Pause / Resume')
+
+        self.cancel_button = ttk.Button(
+            self.content,
+            text='Cancel')
+
     def configure_layout(self):
         """Configure layout of widgets."""
         # grid
@@ -1288,6 +2111,14 @@ class Application(tk.Frame):
         self.log_label.grid(
             row=2, column=4, columnspan=4, sticky='w')
 
+        self.progress_bar.grid(row=3, column=0, columnspan=4, sticky='we')
+        self.progress_label.grid(
+            row=3, column=4, columnspan=4, sticky='w')
+
+        self.job_tree.grid(row=4, column=0, columnspan=6, sticky='wens')
+        self.pause_button.grid(row=4, column=6, sticky='n')
+        self.cancel_button.grid(row=4, column=7, sticky='n')
+
         # rowconfigure and columnconfigure
         self.master.rowconfigure(0, weight=1)
         self.master.columnconfigure(0, weight=1)
@@ -1295,6 +2126,8 @@ class Application(tk.Frame):
         self.content.rowconfigure(0, weight=0)
         self.content.rowconfigure(1, weight=1)
         self.content.rowconfigure(2, weight=0)
+        self.content.rowconfigure(3, weight=0)
+        self.content.rowconfigure(4, weight=0)
         self.content.columnconfigure(0, weight=1)
         self.content.columnconfigure(1, weight=1)
         self.content.columnconfigure(2, weight=1)
@@ -1321,8 +2154,12 @@ class Application(tk.Frame):
             lambda event: self._choose_data_file())
 
         self.query_content_area.insert('end', HELP.encode('utf-8'))
+        self.query_content_area['yscrollcommand'] = self._on_preview_scroll
 
         self.execute_button['command'] = self._do_query
+        self.pause_button['command'] = self._pause_or_resume_jobs
+        self.cancel_button['command'] = self._cancel_jobs
+        self.master.protocol('WM_DELETE_WINDOW', self._on_close)
 
     @property
     def _candidate_query_files(self):
@@ -1346,21 +2183,8 @@ class Application(tk.Frame):
                 not os.path.isfile(self.query_file):
             sys.stderr.write('query 文件无效：{}. 请重新选择\n'.format(self.query_file))
             self.log_label_value.set('Error:  No query content!')
-        xlsx_matrix = XlsxFile(self.query_file).xlsx_matrix
-        query_content = "{}预览前 50 行内容:{}\n\n".format(BAR, BAR)
-        for i, each_tuple in enumerate(xlsx_matrix[:50]):
-            try:
-                line_content = ' | '.join([unicode(_) for _ in each_tuple])
-                query_content += ("[%d]  %s\n%s\n"
-                                  % (i + 1, line_content, LINE_SPLITER))
-            except UnicodeEncodeError as e:
-                query_content = "query 文件无效，无法预览\n{}".format(e)
-                break
-            except BaseException as e:
-                query_content = "query 文件无效，无法预览\n{}".format(e)
-                break
-        self.query_content_area.delete("0.1", "end-1c")
-        self.query_content_area.insert("end", query_content)
+            return
+        self._show_preview(self.query_file, 'query')
         self.input_status_label_value.set('query 文件已选择:  {}'.format(self.query_file))
 
     def _choose_data_file(self):
@@ -1372,31 +2196,93 @@ class Application(tk.Frame):
         if not data_file_path or not os.path.isfile(data_file_path):
             sys.stderr.write('data 文件无效：{}. 请重新选择\n'.format(data_file_path))
             self.log_label_value.set('Error:  No data file content!')
-        xlsx_matrix = XlsxFile(data_file_path).xlsx_matrix
-        query_content = "{}预览前 50 行内容:{}\n\n".format(BAR, BAR)
-        for i, each_tuple in enumerate(xlsx_matrix[:50]):
-            try:
-                line_content = ' | '.join([unicode(_) for _ in each_tuple])
-                query_content += ("[%d]  %s\n%s\n"
-                                  % (i + 1, line_content, LINE_SPLITER))
-            except UnicodeEncodeError as e:
-                query_content = "data 文件无效，无法预览！\n{}".format(e)
-                break
-            except BaseException as e:
-                query_content = "data 文件无效，无法预览！\n{}".format(e)
-                break
-        self.query_content_area.delete("0.1", "end-1c")
-        self.query_content_area.insert("end", query_content)
+            return
+        self._show_preview(data_file_path, 'data')
         self.input_status_label_value.set('data 文件已选择：{}'.format(data_file_path))
         self.data_file = data_file_path
 
+    def _show_preview(self, excel_file, file_kind):
+        """预览文件：已读取的行直接显示，其余的行在后台线程中逐页读取。
+
+        同一个文件（未被修改）的 XlsxPreview 会被再次使用，运行任务时也用它
+        继续读取。
+        """
+        preview = self._preview_dict.get(excel_file)
+        if preview is None or not preview.is_up_to_date():
+            if preview is not None:
+                preview.close()
+            preview = XlsxPreview(excel_file)
+            self._preview_dict[excel_file] = preview
+        self._shown_preview = preview
+        self._shown_file_kind = file_kind
+        self._shown_row_num = 0
+        self._preview_loading = False
+        self.query_content_area.delete("0.1", "end-1c")
+        self.query_content_area.insert(
+            "end", "{}预览 {} 文件内容（滚动到底部时读取更多行）:{}\n\n".format(
+                BAR, file_kind, BAR))
+        self._show_more_preview_rows()
+
+    def _show_more_preview_rows(self):
+        """显示下一页；该页还未读取时，在后台线程中读取。"""
+        preview = self._shown_preview
+        if preview is None or self._preview_loading:
+            return
+        if self._shown_row_num < len(preview.row_list):
+            self._append_preview_rows()
+        elif not preview.exhausted:
+            self._preview_loading = True
+            thread = threading.Thread(target=self._read_preview_page,
+                                      args=(preview,))
+            thread.daemon = True
+            thread.start()
+
+    def _read_preview_page(self, preview):
+        """Run in a background thread, the page is shown by process_queue()."""
+        try:
+            preview.read_page()
+            self.queue.put(PreviewPage(preview, None))
+        except Exception as e:
+            self.queue.put(PreviewPage(preview, e))
+
+    def _show_preview_page(self, preview_page):
+        # Another file may have been chosen while the page was read
+        if preview_page.preview is not self._shown_preview:
+            return
+        self._preview_loading = False
+        if preview_page.error is not None:
+            self.query_content_area.insert(
+                "end", "{} 文件无效，无法预览！\n{}".format(
+                    self._shown_file_kind, preview_page.error))
+            return
+        self._append_preview_rows()
+
+    def _append_preview_rows(self):
+        preview = self._shown_preview
+        row_list = preview.row_list[
+            self._shown_row_num:self._shown_row_num + preview.page_rows]
+        first_row_num = self._shown_row_num + 1
+        self._shown_row_num += len(row_list)
+        preview_content = ''
+        for i, each_tuple in enumerate(row_list, first_row_num):
+            line_content = ' | '.join(['{}'.format(_) for _ in each_tuple])
+            preview_content += ("[%d]  %s\n%s\n"
+                                % (i, line_content, LINE_SPLITER))
+        if preview.exhausted and self._shown_row_num == len(preview.row_list):
+            preview_content += "\n（共 {} 行）\n".format(self._shown_row_num)
+        self.query_content_area.insert("end", preview_content)
+
+    def _on_preview_scroll(self, first, last):
+        """yscrollcommand of the preview area: read more rows at the end."""
+        self.query_content_area.vbar.set(first, last)
+        if float(last) >= 1.0:
+            self._show_more_preview_rows()
+
     def _do_query(self):
         """Main GUI program and core function."""
         if not Application.check_dependencies():
             return
 
-        self.log_label_value.set('任务开始 ...')
-
         out_xlsx_file = self.out_file_entry.get().strip()
 
         logging.info('{}植物标本信息处理软件{}'.format(BAR, BAR))
@@ -1415,16 +2301,98 @@ class Application(tk.Frame):
             self.log_label_value.set('缺少参数')
             return
 
-        ThreadedTask(self.data_file, self.query_file, out_xlsx_file, self.log_label_value, self.queue).start()
-        self.master.after(1000, self.process_queue)
+        # Queued after the running jobs, several query files may be queued
+        # Rows read for preview are not read again
+        job = self.job_manager.submit(
+            self.data_file, self.query_file, out_xlsx_file,
+            [self._preview_dict.get(self.query_file),
+             self._preview_dict.get(self.data_file)])
+        logging.info('任务 #{} 已加入队列：{}'.format(job.job_id, self.query_file))
+
+    def _selected_jobs(self):
+        """任务列表中选中的任务，未选中时为正在运行及暂停的任务。"""
+        job_list = [self.job_manager.get_job(int(_))
+                    for _ in self.job_tree.selection()]
+        if not job_list:
+            job_list = [_ for _ in self.job_manager.job_list
+                        if _.status in (QueryJob.RUNNING, QueryJob.PAUSED)]
+        return [_ for _ in job_list if _ is not None]
+
+    def _pause_or_resume_jobs(self):
+        for job in self._selected_jobs():
+            if job.status == QueryJob.PAUSED:
+                job.resume()
+            else:
+                job.pause()
+
+    def _cancel_jobs(self):
+        for job in self._selected_jobs():
+            job.cancel()
+
+    def _on_close(self):
+        self.job_manager.shutdown()
+        for preview in self._preview_dict.values():
+            preview.close()
+        self.master.destroy()
 
     def process_queue(self):
-        try:
-            log_info = self.queue.get(0)
-            logging.info(log_info)
-        except Queue.Empty:
-            print("blank")
-            self.master.after(1000, self.process_queue)
+        """在 Tk 主线程中处理工作线程放入队列的任务状态、进度和日志。"""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if isinstance(item, QueryJob):
+                self._show_job(item)
+            elif isinstance(item, ProgressEvent):
+                self._show_progress(item)
+            elif isinstance(item, PreviewPage):
+                self._show_preview_page(item)
+            else:
+                logging.info(item)
+        self.master.after(GUI_PROGRESS_POLL_MS, self.process_queue)
+
+    def _show_job(self, job):
+        item_id = '%d' % job.job_id
+        if self.job_tree.exists(item_id):
+            self.job_tree.set(item_id, 'status', job.status_text)
+            self.job_tree.set(item_id, 'message', job.message)
+        else:
+            self.job_tree.insert('', 'end', item_id, text='#%d' % job.job_id,
+                                 values=(job.query_file, job.output_file,
+                                         job.status_text, '', job.message))
+        self.log_label_value.set('[ #{} ] {}'.format(job.job_id, job.message))
+        if job.is_finished and self._progress_job_id in (None, job.job_id):
+            self.progress_bar.stop()
+
+    @property
+    def _progress_job_id(self):
+        """进度条显示的任务：选中的任务，未选中时为最早运行的任务。"""
+        job_list = self._selected_jobs()
+        return job_list[0].job_id if job_list else None
+
+    def _show_progress(self, progress_event):
+        """每个任务的进度显示在任务列表中。进度条只显示一个任务的进度：总数
+        已知时显示百分比，否则进度条来回滚动。
+        """
+        item_id = '%s' % progress_event.job_id
+        if self.job_tree.exists(item_id):
+            self.job_tree.set(item_id, 'progress',
+                              format_progress(progress_event))
+        if progress_event.job_id != self._progress_job_id:
+            return
+        self.progress_label_value.set(format_progress(progress_event))
+        if progress_event.total or progress_event.finished:
+            if str(self.progress_bar['mode']) != 'determinate':
+                self.progress_bar.stop()
+                self.progress_bar['mode'] = 'determinate'
+            self.progress_bar['maximum'] = progress_event.total or 1
+            self.progress_bar['value'] = (
+                progress_event.total or 1 if progress_event.finished
+                else progress_event.done)
+        elif str(self.progress_bar['mode']) != 'indeterminate':
+            self.progress_bar['mode'] = 'indeterminate'
+            self.progress_bar.start()
 
     @staticmethod
     def check_dependencies():
@@ -1446,49 +2414,11 @@ class Application(tk.Frame):
         return dependency_ok
 
 
-class ThreadedTask(threading.Thread):
-    def __init__(self, data_file, query_file, output_file, log_label_widget, queue):
-        threading.Thread.__init__(self)
-        self.data_file = data_file
-        self.query_file = query_file
-        self.out_xlsx_file = output_file
-        self.log_label_value = log_label_widget
-        self.queue = queue
-
-    def run(self):
-        time_start = time.time()
-
-        try:
-            # Data validation
-            self.log_label_value.set('开始进行数据校验 ...')
-            ok = data_validation(data_file=self.data_file, query_file=self.query_file)
-            if not ok:
-                self.queue.put('数据校验失败')
-                self.log_label_value.set("数据校验失败！")
-                return
-            self.log_label_value.set('开始进行预处理，请耐心等待 ... ')
-            query = Query(self.query_file, self.data_file)
-
-            self.log_label_value.set('开始进行多进程处理，请耐心等待 ... ')
-            out_tuple_list, log_info = query.do_multi_query()
-
-            write_to_xlsx_file(out_tuple_list, xlsx_outfile_name=self.out_xlsx_file)
-            write_result = '已将 {} 条记录写入到输出文件中；{}！'.format(
-                len(out_tuple_list), self.out_xlsx_file)
-            self.log_label_value.set(write_result)
-            log_info += '\n{}'.format(write_result)
-
-            time_end = time.time()
-            self.log_label_value.set('任务完成，共花费时间: %.2f 秒' % (time_end - time_start))
-            self.queue.put(log_info)
-        except Exception as e:
-            logging.error(e.message)
-            self.queue.put('ERROR')
-            self.log_label_value.set("失败！")
-
-
 def main():
     """Main function."""
+    # Before arg_parse(): logging before a handler is set up would add the
+    # default one, and basicConfig() would do nothing
+    setup_logging()
     args = arg_parse()
     query_file, offline_data_file, output_file = (
         args.query_file,
@@ -1510,6 +2440,7 @@ def main():
 
 def gui_main():
     """Main program for GUI."""
+    setup_logging()
     app = Application()
     app.mainloop()
 
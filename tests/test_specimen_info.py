@@ -1,4 +1,989 @@
-from __future__ import (absolute_import, unicode_literal, print_function,
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, unicode_literals, print_function,
                         division)
+import io
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import datetime
+import functools
+import threading
+import multiprocessing
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
 import pytest
 
+from specimen_info import specimen_info
+
+
+DESCRIPTION_PARAGRAPHS = [
+    ('一年生或二年生草本，高10-30厘米。茎俯仰或上升，基部多少分枝，常带淡紫'
+     '红色，被1(-2)列毛。叶片宽卵形或卵形，长1.5-2.5厘米，宽1-1.5厘米，顶'
+     '端渐尖或急尖，基部渐狭或近心形，全缘；基生叶具长柄，上部叶常无柄或具'
+     '短柄。疏聚伞花序顶生；花梗细，长7-14毫米；萼片5，卵状披针形；花瓣白'
+     '色，长椭圆形，比萼片短。蒴果卵形，稍长于宿存萼；种子多数，卵圆形至近'
+     '圆形，稍扁，红褐色。'),
+    ('乔木，高达45米，胸径1.5米；树皮红褐色，下部灰褐色，裂成不规则的鳞状块'
+     '片。针叶2针一束，稀3针一束，长12-20厘米，细柔，微扭曲。雄球花淡红褐'
+     '色，圆柱形，弯垂；雌球花单生或2-4个聚生于新枝近顶端。球果卵圆形或圆'
+     '锥状卵圆形，有短梗，下垂。'),
+    ('寄生小灌木，高0.3-0.8米。寄主为壳斗科植物。茎圆柱状，节稍膨大。叶对生'
+     '，革质。花单性，雌雄异株。果椭圆状，成熟时淡黄色'),
+    '',
+    '无关键词的段落',
+]
+
+
+def legacy_find_keyword_info(one_paragraph_content):
+    """The regular expressions used before TraitExtractor."""
+    patterns = [('[^，。]*高[^，。]*', ' | '),
+                ('[^，。]*胸径[^，。]*', ' | '),
+                ('[^。]*茎[^。]*', '。 | '),
+                ('[^。]*叶[^。]*', '。 | '),
+                ('[^。]*花[^。]*', '。 | '),
+                ('[^。]*果[^。]*', '。 | '),
+                ('[^。]*寄主[^。]*', '。 | ')]
+    return tuple(
+        separator.join(re.compile(pattern).findall(one_paragraph_content))
+        for pattern, separator in patterns)
+
+
+@pytest.mark.parametrize('paragraph', DESCRIPTION_PARAGRAPHS)
+def test_find_keyword_info_same_as_regular_expressions(paragraph):
+    assert (specimen_info.WebInfo._find_keyword_info(paragraph) ==
+            legacy_find_keyword_info(paragraph))
+
+
+def test_trait_extractor_extra_trait():
+    extractor = specimen_info.TraitExtractor(
+        specimen_info.TRAIT_KEYWORDS + (('parasite', ('寄生',), 'clause'),))
+    trait_dict = extractor.extract(DESCRIPTION_PARAGRAPHS[2])
+    assert trait_dict['parasite'] == '寄生小灌木'
+    assert trait_dict['height'] == '高0.3-0.8米'
+
+
+def test_trait_extractor_invalid_scope():
+    with pytest.raises(ValueError):
+        specimen_info.TraitExtractor((('height', ('高',), 'word'),))
+
+
+@pytest.mark.parametrize('html_text', [
+    '<p><b>Stellaria</b> <b>media</b> (L.) Cyr.<span>Ess.</span></p>',
+    '<p>a<p>b</p>c</p>',
+    '<p><b>x</b>y</p><p></p><p/>',
+    '<p>\n  <b>X</b></p><p>  <i>q</i></p>',
+    '<p><!-- c -->t</p>',
+    '<div><p></div>text<p>a &amp; b<br>c</p>',
+])
+def test_paragraph_parser_same_as_beautifulsoup(html_text):
+    web_info = specimen_info.WebInfo('Stellaria media', response=html_text,
+                                     html_extractor='bs4')
+    paragraph_parser = specimen_info.ParagraphParser()
+    paragraph_parser.feed(html_text)
+    paragraph_parser.close()
+    assert paragraph_parser.paragraph_list == web_info.all_paragraph_tuple
+
+
+def test_reparse_web_cache_from_page_archive(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    page = ('<p><b>Stellaria</b> <b>media</b> (L.) Cyr.<span>Ess.</span></p>'
+            '<p>%s</p>' % DESCRIPTION_PARAGRAPHS[0])
+    page_archive = specimen_info.WebPageArchive('web_pages.sqlite')
+    page_archive.put('Stellaria media', page, {'etag': '"abc"'})
+    assert page_archive.get('Stellaria media') == page
+    page_archive.close()
+
+    assert specimen_info.reparse_web_cache('web_pages.sqlite') == 1
+    web_cache = specimen_info.open_web_cache()
+    assert (web_cache.get('Stellaria media') ==
+            list(specimen_info.WebInfo('Stellaria media',
+                                       response=page).pretty_info_tuple))
+    assert web_cache.get_validators('Stellaria media')['etag'] == '"abc"'
+    web_cache.close()
+
+
+def test_sqlite_web_cache_imports_json_cache_once(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    web_info_tuple = ('Stellaria', 'media') + ('',) * 9
+    json_web_cache = specimen_info.JSONWebCache('web_cache.json')
+    json_web_cache.put('Stellaria media', web_info_tuple)
+    json_web_cache.close()
+    # Written again over the existing file
+    json_web_cache = specimen_info.JSONWebCache('web_cache.json')
+    json_web_cache.put('Pinus massoniana', web_info_tuple)
+    json_web_cache.close()
+    assert tmpdir.listdir() == [tmpdir.join('web_cache.json')]
+
+    web_cache = specimen_info.SQLiteWebCache('web_cache.sqlite',
+                                             'web_cache.json')
+    assert sorted(web_cache.keys()) == ['Pinus massoniana', 'Stellaria media']
+    assert web_cache.get('Stellaria media') == list(web_info_tuple)
+    web_cache.close()
+
+    json_web_cache = specimen_info.JSONWebCache('web_cache.json')
+    json_web_cache.put('Pinus armandii', web_info_tuple)
+    json_web_cache.close()
+    web_cache = specimen_info.SQLiteWebCache('web_cache.sqlite',
+                                             'web_cache.json')
+    assert len(web_cache) == 2
+    web_cache.close()
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_write_to_xlsx_file_alt_file_on_error(tmpdir, streaming):
+    # A directory in the way of the output file cannot be opened
+    tmpdir.mkdir('out.xlsx')
+    out_tuple_iter = iter([('a', 1, 'c'), ('e', 2, 'g')])
+    specimen_info.write_to_xlsx_file(
+        out_tuple_iter, str(tmpdir.join('out.xlsx')), streaming=streaming)
+
+    xlsx_file = specimen_info.XlsxFile(str(tmpdir.join('out.alt.xlsx')),
+                                       read_only=True)
+    row_list = list(xlsx_file.iter_rows())
+    assert row_list[0] == specimen_info.HEADER_TUPLE
+    assert [_[:3] for _ in row_list[1:]] == [('a', 1, 'c'), ('e', 2, 'g')]
+    xlsx_file.close()
+
+
+def test_xlsx_stream_writer_cell_types(tmpdir):
+    row = ('a & <b>', ' x\x01 ', 3, 2.5, True, None,
+           datetime.datetime(2016, 1, 2, 12, 30),
+           datetime.date(2016, 1, 2), '', 2 ** 40, float('nan'),
+           float('-inf'))
+    with specimen_info.XlsxStreamWriter('Specimen') as xlsx_writer:
+        xlsx_writer.append(row)
+        xlsx_writer.save(str(tmpdir.join('out.xlsx')))
+
+    xlsx_file = specimen_info.XlsxFile(str(tmpdir.join('out.xlsx')))
+    assert xlsx_file.ws_title == 'Specimen'
+    assert xlsx_file.xlsx_matrix == [
+        ('a & <b>', ' x ', 3, 2.5, True, None,
+         datetime.datetime(2016, 1, 2, 12, 30),
+         datetime.datetime(2016, 1, 2), '', 2 ** 40, 'nan', '-inf')]
+
+
+def test_xlsx_stream_writer_removes_unsaved_rows():
+    with pytest.raises(ValueError):
+        with specimen_info.XlsxStreamWriter() as xlsx_writer:
+            xlsx_writer.append(('a', 1))
+            raise ValueError
+    assert not os.path.exists(xlsx_writer._sheet_file)
+
+
+def make_final_info(serial_number, barcode, species):
+    row = ['' for _ in specimen_info.FinalInfo._fields]
+    row[1], row[2], row[16] = serial_number, barcode, species
+    return specimen_info.FinalInfo._make(row)
+
+
+def test_write_to_sqlite3_upsert_on_barcode(tmpdir):
+    sqlite3_file = str(tmpdir.join('specimen.sqlite'))
+    specimen_info.write_to_sqlite3(
+        [make_final_info(1, '00000001', 'media'),
+         make_final_info(2, '00000002', 'old'),
+         make_final_info(2, '00000002', 'new')], sqlite3_file)
+    # Running again only updates rows with the same barcode
+    specimen_info.write_to_sqlite3(
+        iter([make_final_info(3, '00000003', 'alba'),
+              make_final_info(1, '00000001', 'aquatica')]), sqlite3_file)
+
+    conn = sqlite3.connect(sqlite3_file)
+    assert conn.execute(
+        'SELECT serial_number, barcode, species FROM specimen '
+        'ORDER BY barcode').fetchall() == [
+            (1, '00000001', 'aquatica'), (2, '00000002', 'new'),
+            (3, '00000003', 'alba')]
+    conn.close()
+
+
+def test_write_to_sqlite3_cleans_up_old_table(tmpdir):
+    sqlite3_file = str(tmpdir.join('specimen.sqlite'))
+    conn = sqlite3.connect(sqlite3_file)
+    conn.execute('CREATE TABLE specimen (id INTEGER PRIMARY KEY, %s)'
+                 % ', '.join(specimen_info.FinalInfo._fields))
+    conn.executemany(
+        'INSERT INTO specimen (serial_number, barcode, species) '
+        'VALUES (?, ?, ?)', [(1, '00000001', 'a'), (1, '00000001', 'b')])
+    conn.commit()
+    conn.close()
+
+    specimen_info.write_to_sqlite3([make_final_info(2, '00000002', 'c')],
+                                   sqlite3_file)
+    specimen_info.write_to_sqlite3([make_final_info(1, '00000001', 'd')],
+                                   sqlite3_file)
+
+    conn = sqlite3.connect(sqlite3_file)
+    assert conn.execute(
+        'SELECT barcode, species FROM specimen ORDER BY barcode'
+    ).fetchall() == [('00000001', 'd'), ('00000002', 'c')]
+    conn.close()
+
+
+def test_write_to_sqlite3_raises_on_error(tmpdir, monkeypatch):
+    sqlite3_file = str(tmpdir.join('specimen.sqlite'))
+    monkeypatch.setattr(specimen_info, 'SQLITE_CHUNK_SIZE', 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        specimen_info.write_to_sqlite3(
+            [make_final_info(1, '00000001', 'media'),
+             make_final_info(2, None, 'alba')], sqlite3_file)
+    with pytest.raises(sqlite3.ProgrammingError):
+        specimen_info.write_to_sqlite3([('too', 'short')], sqlite3_file)
+
+    # Chunks committed before the error are kept
+    conn = sqlite3.connect(sqlite3_file)
+    assert conn.execute('SELECT barcode FROM specimen').fetchall() == [
+        ('00000001',)]
+    conn.close()
+
+
+def test_query_manifest_only_new_or_changed_rows(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {
+        'Stellaria media': tuple('%d' % _ for _ in range(19))})
+    query_tuple_list = [('1', '1', 'Stellaria media', '1'),
+                        ('2', '2', 'Stellaria  media', '2')]
+
+    def run():
+        xlsx_writer = specimen_info.XlsxStreamWriter()
+        for one_query_tuple in query_tuple_list:
+            xlsx_writer.append(one_query_tuple)
+        xlsx_writer.save('query.xlsx')
+        query_manifest = specimen_info.QueryManifest('specimen.sqlite')
+        q = specimen_info.Query('query.xlsx', 'data.xlsx', query_manifest)
+        out_tuple_list = q.do_multi_query()
+        specimen_info.write_to_sqlite3(out_tuple_list, 'specimen.sqlite')
+        query_manifest.save()
+        query_manifest.close()
+        return [_.barcode for _ in out_tuple_list]
+
+    assert run() == ['00000001', '00000002']
+    assert run() == []
+    query_tuple_list[1] = ('2', '2', 'Stellaria media', '3')
+    query_tuple_list.append(('3', '3', 'Stellaria media', '1'))
+    assert run() == ['00000002', '00000003']
+
+
+def write_xlsx(file_name, row_list):
+    xlsx_writer = specimen_info.XlsxStreamWriter()
+    for row in row_list:
+        xlsx_writer.append(row)
+    xlsx_writer.save(file_name)
+
+
+def test_incremental_query_not_recorded_if_write_fails(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {
+        'Stellaria media': tuple('%d' % _ for _ in range(19))})
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1'),
+                              ('2', '2', 'Stellaria media', '1')])
+    write_to_sqlite3 = specimen_info.write_to_sqlite3
+
+    def failing_write_to_sqlite3(out_tuple_list, sqlite3_file):
+        write_to_sqlite3(out_tuple_list[:1], sqlite3_file)
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(specimen_info, 'write_to_sqlite3',
+                        failing_write_to_sqlite3)
+    with pytest.raises(sqlite3.OperationalError):
+        specimen_info.incremental_query('query.xlsx', 'data.xlsx',
+                                        'out.xlsx', 'specimen.sqlite')
+    assert not tmpdir.join('out.xlsx').check()
+
+    monkeypatch.setattr(specimen_info, 'write_to_sqlite3', write_to_sqlite3)
+    assert specimen_info.incremental_query(
+        'query.xlsx', 'data.xlsx', 'out.xlsx', 'specimen.sqlite') == 2
+    assert [_[2] for _ in specimen_info.XlsxFile(
+        'out.xlsx').xlsx_matrix[1:]] == ['00000001', '00000002']
+    assert specimen_info.incremental_query(
+        'query.xlsx', 'data.xlsx', 'out.xlsx', 'specimen.sqlite') == 0
+
+
+def test_data_validation_rows_reused_by_query(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1'),
+                              ('2', '2', 'Stellaria  media', '2'),
+                              ('3', '3', 'Pinus massoniana', '1')])
+    opened_file_list = []
+    xlsx_file_init = specimen_info.XlsxFile.__init__
+
+    def counting_init(self, excel_file, *args, **kwargs):
+        opened_file_list.append(excel_file)
+        xlsx_file_init(self, excel_file, *args, **kwargs)
+
+    monkeypatch.setattr(specimen_info.XlsxFile, '__init__', counting_init)
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    assert validator.query_species_name_set == set([
+        'Stellaria media', 'Stellaria  media', 'Pinus massoniana'])
+    q = specimen_info.Query('query.xlsx', 'data.xlsx', validator=validator)
+    out_tuple_list = q.do_multi_query()
+    assert sorted(opened_file_list) == ['data.xlsx', 'query.xlsx']
+
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    assert (specimen_info.Query('query.xlsx', 'data.xlsx').do_multi_query()
+            == out_tuple_list)
+    assert out_tuple_list[0].chinese_name == '繁缕'
+
+
+def test_data_validation_keeps_rows_only_for_stale_index(tmpdir,
+                                                         monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1')])
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    assert len(validator.data_row_list) == 2
+    # Checking for the index does not create it
+    assert not os.path.exists('data.xlsx.col2.index')
+    specimen_info.Query('query.xlsx', 'data.xlsx',
+                        validator=validator).do_multi_query()
+    assert validator.data_row_list is None
+    specimen_info._xlsx_data_cache_dict.close()
+
+    # Index is up to date now, the rows are not kept
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    assert validator.data_row_list is None
+    out_tuple_list = specimen_info.Query(
+        'query.xlsx', 'data.xlsx', validator=validator).do_multi_query()
+    assert out_tuple_list[0].chinese_name == '繁缕'
+    specimen_info._xlsx_data_cache_dict.close()
+
+    monkeypatch.setattr(specimen_info, 'USE_OFFLINE_INDEX', False)
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    assert len(validator.data_row_list) == 2
+
+
+def test_data_validation_missing_latin_name(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1'),
+                              ('2', '2', None, '2')])
+    with pytest.raises(ValueError):
+        specimen_info.data_validation('data.xlsx', 'query.xlsx')
+
+
+def test_validation_report_capped_and_merged():
+    report = specimen_info.ValidationReport(max_examples=2)
+    for row_num in (3, 4, 5, 9, 20, 30):
+        report.add('query.xlsx', 'blank_cell', row_num, 'Column 1')
+    chunk_report = specimen_info.ValidationReport(max_examples=2)
+    chunk_report.add('query.xlsx', 'no_latin_name', 31)
+    chunk_report.add('query.xlsx', 'blank_cell', 31, 'Column 3')
+    report.merge(chunk_report)
+
+    error_dict, warning_dict = report.to_dict()
+    assert error_dict['rule'] == 'no_latin_name'
+    assert warning_dict['count'] == 7
+    assert warning_dict['examples'] == [(3, 'Column 1'), (4, 'Column 1')]
+    assert warning_dict['row_ranges'] == [[3, 5], [9, 9]]
+    assert warning_dict['more_rows']
+    assert report.has_errors
+    assert report.count('blank_cell') == 7
+    assert len(report.format_lines()) == 6
+
+
+@pytest.mark.parametrize('process_num', [1, 2, None])
+def test_data_validation_report_in_chunks(tmpdir, monkeypatch, process_num):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, 'VALIDATION_CHUNK_ROWS', 3)
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [
+        ('%d' % _, '%d' % _, 'Stellaria media' if _ % 4 else 'Pinus sp',
+         '' if _ % 3 else '1')
+        for _ in range(1, 11)])
+    validator = specimen_info.DataValidator('data.xlsx', 'query.xlsx',
+                                            process_num)
+    # One process per CPU by default
+    assert validator.process_num == (process_num or
+                                     multiprocessing.cpu_count())
+    validator.validate('report.json')
+    report = validator.report
+    assert not report.has_errors
+    assert report.count('blank_cell', 'query.xlsx') == 7
+    assert report.count('not_in_data_file') == 1
+    assert len(validator.query_row_list) == 10
+
+    report_dict_list = json.loads(tmpdir.join('report.json').read_text(
+        'utf-8'))
+    assert [(_['rule'], _['row_ranges']) for _ in report_dict_list] == [
+        ('blank_cell', [[1, 2], [4, 5], [7, 8], [10, 10]]),
+        ('not_in_data_file', [[4, 4]]),
+        ('unknown_latin_name', [[4, 4]])]
+
+
+def test_offline_data_index_rebuilt_only_on_change(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, 'OFFLINE_INDEX_ROW_CACHE_SIZE', 2)
+    header_row = ['header %d' % _ for _ in range(19)]
+    data_row = ['1', '繁缕', 'Stellaria media'] + ['%d' % _
+                                                  for _ in range(3, 19)]
+    write_xlsx('data.xlsx', [header_row, data_row])
+    rebuilt_file_list = []
+    rebuild = specimen_info.OfflineDataIndex.rebuild
+
+    def counting_rebuild(self):
+        rebuilt_file_list.append(self.index_file)
+        rebuild(self)
+
+    monkeypatch.setattr(specimen_info.OfflineDataIndex, 'rebuild',
+                        counting_rebuild)
+    index = specimen_info.OfflineDataIndex('data.xlsx')
+    assert index['Stellaria media'] == tuple(data_row)
+    index.close()
+    assert rebuilt_file_list == ['data.xlsx.col2.index']
+
+    # Same content with a new mtime: checked by SHA1, not rebuilt
+    os.utime('data.xlsx', (1, 1))
+    index = specimen_info.OfflineDataIndex('data.xlsx')
+    assert index['Stellaria media'] == tuple(data_row)
+    index.close()
+    # Other key column, other index file
+    index = specimen_info.OfflineDataIndex('data.xlsx', key_column_index=1)
+    assert '繁缕' in index
+    index.close()
+    assert rebuilt_file_list == ['data.xlsx.col2.index',
+                                 'data.xlsx.col1.index']
+
+    write_xlsx('data.xlsx', [header_row, data_row,
+                             data_row[:2] + ['Pinus massoniana'] +
+                             data_row[3:]])
+    index = specimen_info.OfflineDataIndex('data.xlsx')
+    assert len(rebuilt_file_list) == 3
+    assert len(index) == 3
+    # Only the last rows looked up are kept
+    for key in ['Stellaria media', 'Pinus massoniana', 'Stellaria media',
+                'Pinus armandii']:
+        index.get(key)
+    assert list(index._row_cache) == ['Pinus massoniana', 'Stellaria media']
+    index.close()
+
+
+
+def test_offline_data_index_missing_data_file(tmpdir, monkeypatch, caplog):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1')])
+    with pytest.raises(SystemExit):
+        specimen_info.Query('query.xlsx', 'nodata.xlsx').do_multi_query()
+    assert 'No such xlsx file: nodata.xlsx' in caplog.text
+    assert not os.path.exists('nodata.xlsx.col2.index')
+
+def test_latin_name_index_lookup(tmpdir):
+    name_file = tmpdir.join('latin_names.txt')
+    name_file.write_text('Stellaria\r\nStellaria media\r\n'
+                         'Stellaria  alsine\r\nStellariopsis x\r\n'
+                         'Pinus massoniana\r\n\r\n', 'utf-8')
+    index_file = str(tmpdir.join('latin_names.idx'))
+    assert specimen_info.LatinNameIndex.build([str(name_file)],
+                                              index_file) == 5
+    latin_name_index = specimen_info.LatinNameIndex(index_file)
+    assert len(latin_name_index) == 5
+    assert 'Stellaria media' in latin_name_index
+    assert ' Stellaria   alsine' in latin_name_index
+    assert 'Stellaria medi' not in latin_name_index
+    assert 'Zelkova' not in latin_name_index
+    assert list(latin_name_index.genus_names('Stellaria')) == [
+        'Stellaria', 'Stellaria alsine', 'Stellaria media']
+    assert list(latin_name_index.genus_names('Pinus')) == [
+        'Pinus massoniana']
+    assert not latin_name_index.has_genus('Stell')
+    latin_name_index.close()
+
+
+def test_shipped_latin_name_index_up_to_date(tmpdir):
+    index_file = str(tmpdir.join('latin_names.idx'))
+    specimen_info.LatinNameIndex.build(index_file=index_file)
+    with open(index_file, 'rb') as f:
+        built_index = f.read()
+    with open(specimen_info.LATIN_NAME_INDEX_FILE, 'rb') as f:
+        assert f.read() == built_index
+
+
+def test_latin_name_matcher_resolve_and_suggest():
+    matcher = specimen_info.LatinNameMatcher(
+        ['Stellaria media', 'Pinus massoniana', 'Pinus tabuliformis',
+         'Abies fargesii', 'Abies fargesia'],
+        specimen_info.get_latin_name_index())
+    assert matcher.resolve('Stelaria  media') == 'Stellaria media'
+    assert matcher.resolve('Stellaria media (L.) Cyr.') == 'Stellaria media'
+    assert matcher.resolve('Pinus massonianna') == 'Pinus massoniana'
+    # Another species of the reference list, not a misspelling
+    assert matcher.resolve('Pinus armandii') is None
+    # Two data file names as close
+    assert matcher.resolve('Abies fargesib') is None
+    assert matcher.resolve_all(['Stelaria media', 'Zzz zzz']) == {
+        'Stelaria media': 'Stellaria media', 'Zzz zzz': None}
+
+    suggestion_list = matcher.suggest('Qurcus acutisima')
+    assert suggestion_list[0][0] == 'Quercus acutissima'
+    assert 0.8 < suggestion_list[0][1] < 1
+    assert matcher.suggest('Pinus armandii')[0] == ('Pinus armandii', 1.0)
+
+
+def test_query_joins_misspelled_species(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [('1', '1', 'Stellaria media', '1'),
+                              ('2', '2', 'Stelaria media', '1'),
+                              ('3', '3', 'Pinus armandii', '1')])
+    monkeypatch.setattr(specimen_info, 'ARCHIVE_WEB_PAGES', False)
+    monkeypatch.setattr(specimen_info.WebInfoCacheMultithreading, '_fetch',
+                        lambda self, species_name_list: None)
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    assert validator.report.count('fuzzy_matched') == 1
+    assert validator.report.count('not_in_data_file') == 1
+    out_tuple_list = specimen_info.Query(
+        'query.xlsx', 'data.xlsx', validator=validator).do_multi_query()
+    assert [_.chinese_name for _ in out_tuple_list] == ['繁缕', '繁缕', '']
+
+    monkeypatch.setattr(specimen_info, 'FUZZY_MATCH', False)
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    out_tuple_list = specimen_info.Query('query.xlsx',
+                                         'data.xlsx').do_multi_query()
+    assert [_.chinese_name for _ in out_tuple_list] == ['繁缕', '', '']
+
+
+QUERY_MODE_CASES = {
+    'one batch': (1000, [
+        ('1', 1, 'Stellaria media', '1'),
+        ('2', '2', 'Stellaria media', '2'),
+        ('3', 123456789, 'Pinus massoniana', '1')]),
+    'species repeated across batches': (2, [
+        ('%d' % _, _, ['Stellaria media', 'Pinus massoniana',
+                       'Stellaria  media'][_ % 3], '%d' % _)
+        for _ in range(1, 10)]),
+    'species missing in data file or web cache': (2, [
+        ('1', '1', 'Stelaria media', '1'),
+        ('2', '2', 'Pinus armandii', '1'),
+        ('3', '3', 'Pinus', '1'),
+        ('4', '4', ' Pinus  massoniana ', '3'),
+        ('5', '5', 'Abies fabri var. minensis', '1')]),
+}
+
+
+@pytest.mark.parametrize('case', sorted(QUERY_MODE_CASES))
+def test_batch_query_same_as_row_query(tmpdir, monkeypatch, case):
+    monkeypatch.chdir(tmpdir)
+    query_batch_size, query_row_list = QUERY_MODE_CASES[case]
+    monkeypatch.setattr(specimen_info, 'QUERY_BATCH_SIZE', query_batch_size)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9,
+        'Abies fabri var. minensis': ('Abies', 'fabri', '', 'var.',
+                                      'minensis') + ('',) * 6})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    monkeypatch.setattr(specimen_info, 'ARCHIVE_WEB_PAGES', False)
+    monkeypatch.setattr(specimen_info.WebInfoCacheMultithreading, '_fetch',
+                        lambda self, species_name_list: None)
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)],
+        ['2', '马尾松', 'Pinus massoniana'] + ['%d' % _
+                                             for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', query_row_list)
+    q = specimen_info.Query('query.xlsx', 'data.xlsx')
+    row_out_tuple_list = q.do_row_query()
+    assert len(row_out_tuple_list) == len(query_row_list)
+    assert q.do_batch_query() == row_out_tuple_list
+
+
+@pytest.fixture
+def progress_event_list(monkeypatch):
+    monkeypatch.setattr(specimen_info, 'PROGRESS_INTERVAL', 0)
+    monkeypatch.setattr(specimen_info, '_progress_listener_list', [])
+    progress_event_list = []
+    specimen_info.add_progress_listener(progress_event_list.append)
+    return progress_event_list
+
+
+def test_query_and_writer_progress(tmpdir, monkeypatch, progress_event_list):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {
+        'Stellaria media': ('Stellaria', 'media') + ('',) * 9})
+    monkeypatch.setattr(specimen_info, '_xlsx_data_cache_dict', {})
+    write_xlsx('data.xlsx', [
+        ['header %d' % _ for _ in range(19)],
+        ['1', '繁缕', 'Stellaria media'] + ['%d' % _ for _ in range(3, 19)]])
+    write_xlsx('query.xlsx', [('%d' % _, '%d' % _, 'Stellaria media', '1')
+                              for _ in range(5)])
+    validator = specimen_info.data_validation('data.xlsx', 'query.xlsx')
+    q = specimen_info.Query('query.xlsx', 'data.xlsx', validator=validator)
+    specimen_info.write_to_xlsx_file(q.iter_multi_query(), 'out.xlsx')
+
+    finished_event_dict = dict((_.stage, _) for _ in progress_event_list
+                               if _.finished)
+    assert finished_event_dict['query'].done == 5
+    assert finished_event_dict['query'].total == 5
+    assert finished_event_dict['write xlsx'].done == 5
+    assert finished_event_dict['write xlsx'].total is None
+    query_event_list = [_ for _ in progress_event_list
+                        if _.stage == 'query' and not _.finished]
+    assert query_event_list and query_event_list[-1].eta is not None
+
+
+def test_progress_status_line():
+    stream = io.StringIO()
+    status_line = specimen_info.ProgressStatusLine(stream)
+    event = specimen_info.ProgressEvent('fetch', 120, 1000, 35.2, 25.0, False)
+    assert (specimen_info.format_progress(event)
+            == '[ fetch ]  120/1000  12.0%  35.2/s  ETA 0:00:25')
+    status_line(event)
+    status_line(event._replace(done=1000, eta=0.0, finished=True))
+    status_line(event._replace(stage='query', total=None))
+    assert stream.getvalue().split('\n') == [
+        '\r[ fetch ]  120/1000  12.0%  35.2/s  ETA 0:00:25'
+        '\r[ fetch ]  1000/1000  100.0%  35.2/s  done     ',
+        '\r[ query ]  120  35.2/s  ETA 0:00:25']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    pass
+
+
+class StubSpeciesHandler(BaseHTTPRequestHandler):
+    """Serve a species page, or drop the connection when the server is
+    down. Pages have server.etag as ETag, if set."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.request_path_list.append(self.path)
+        if self.server.down:
+            self.close_connection = True
+            return
+        if self.server.etag is not None and \
+                self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        genus, _, species = self.path.rpartition('/')[2].partition('%20')
+        body = ('<p><b>%s</b> <b>%s</b> L.<span>Sp.</span></p><p>%s</p>'
+                % (genus, species, self.server.description)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.etag is not None:
+            self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSpeciesHandler)
+    server.daemon_threads = True
+    server.down = False
+    server.etag = None
+    server.description = '草本，高1米。茎直立。叶对生。花白色。'
+    server.request_path_list = []
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    monkeypatch.setattr(specimen_info, 'WEB_BASE_URL',
+                        'http://127.0.0.1:%d/frps/' % server.server_port)
+    monkeypatch.setattr(specimen_info, 'HTTP_RETRIES', 0)
+    monkeypatch.setattr(specimen_info, 'POOL_NUM', 4)
+    monkeypatch.setattr(specimen_info, '_http_session', None)
+    monkeypatch.setattr(specimen_info, '_web_data_cache_dict', {})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+SPECIES_NAME_LIST = ['Genus%d species%d' % (_, _) for _ in range(10)]
+
+
+def fetch_species(resume=False):
+    specimen_info._web_data_cache_dict.clear()
+    specimen_info.WebInfoCacheMultithreading(
+        None, species_name_list=SPECIES_NAME_LIST,
+        resume=resume).get_web_dict_multithreading()
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'json'])
+def test_fetch_interrupted_keeps_fetched_species(stub_server, monkeypatch,
+                                                 backend):
+    monkeypatch.setattr(specimen_info, 'WEB_CACHE_BACKEND', backend)
+    fetch = specimen_info.WebInfoCacheMultithreading._fetch
+
+    def fetch_then_interrupt(self, species_name_list):
+        fetch(self, species_name_list[:6])
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(specimen_info.WebInfoCacheMultithreading, '_fetch',
+                        fetch_then_interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        fetch_species()
+    web_cache = specimen_info.open_web_cache()
+    assert len(web_cache) == 6
+    assert sorted(web_cache.get_fetch_job_species_names()) == sorted(
+        _ for _ in SPECIES_NAME_LIST if _ not in web_cache)
+    web_cache.close()
+    assert os.path.exists('web_cache.json.fetch_job') == (backend == 'json')
+
+    # The species left by the interrupted fetch, not the ones of the query
+    monkeypatch.setattr(specimen_info.WebInfoCacheMultithreading, '_fetch',
+                        fetch)
+    del stub_server.request_path_list[:]
+    specimen_info._web_data_cache_dict.clear()
+    specimen_info.WebInfoCacheMultithreading(
+        None, species_name_list=[], resume=True).get_web_dict_multithreading()
+    assert len(stub_server.request_path_list) == 4
+    assert len(specimen_info._web_data_cache_dict) == 4
+    web_cache = specimen_info.open_web_cache()
+    assert len(web_cache) == 10
+    assert web_cache.get_fetch_job_species_names() == []
+    web_cache.close()
+    assert not os.path.exists('web_cache.json.fetch_job')
+
+    # Nothing left to resume: the missing species of the query
+    del stub_server.request_path_list[:]
+    fetch_species(resume=True)
+    assert stub_server.request_path_list == []
+    assert len(specimen_info._web_data_cache_dict) == 10
+
+
+def test_fetch_network_down_resumes_missing_species(stub_server):
+    fetch_species()
+    stub_server.down = True
+    web_cache = specimen_info.open_web_cache()
+    assert web_cache.get_fetch_job_species_names() == []
+    web_cache.close()
+
+    # Server goes down after 10 pages: the other 5 species are left
+    species_name_list = SPECIES_NAME_LIST + ['Other%d species' % _
+                                             for _ in range(5)]
+    specimen_info.WebInfoCacheMultithreading(
+        None, species_name_list=species_name_list
+    ).get_web_dict_multithreading()
+    web_cache = specimen_info.open_web_cache()
+    assert len(web_cache) == 10
+    assert sorted(web_cache.get_fetch_job_species_names()) == sorted(
+        species_name_list[10:])
+    web_cache.close()
+
+    stub_server.down = False
+    del stub_server.request_path_list[:]
+    specimen_info.WebInfoCacheMultithreading(
+        None, species_name_list=species_name_list, resume=True
+    ).get_web_dict_multithreading()
+    assert len(stub_server.request_path_list) == 5
+    web_cache = specimen_info.open_web_cache()
+    assert len(web_cache) == 15
+    assert web_cache.get_fetch_job_species_names() == []
+    web_cache.close()
+
+
+def test_http_session_is_shared_and_retries(stub_server, monkeypatch):
+    monkeypatch.setattr(specimen_info, 'HTTP_RETRIES', 2)
+    monkeypatch.setattr(specimen_info, 'HTTP_BACKOFF', 0)
+    session = specimen_info.get_http_session()
+    assert specimen_info.get_http_session() is session
+    adapter = session.get_adapter('https://example.org/')
+    assert session.get_adapter(specimen_info.WEB_BASE_URL) is adapter
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert adapter.max_retries.backoff_factor == 0
+    assert 503 in adapter.max_retries.status_forcelist
+
+    url = specimen_info.get_species_url('Stellaria media')
+    session.get(url)
+    session.get(url)
+    assert len(stub_server.request_path_list) == 2
+    stub_server.down = True
+    with pytest.raises(specimen_info.requests.ConnectionError):
+        session.get(url)
+    # The first try and 2 retries
+    assert len(stub_server.request_path_list) == 5
+
+
+def test_fetch_progress_counts_failed_species(stub_server,
+                                              progress_event_list):
+    stub_server.down = True
+    fetch_species()
+    fetch_event = progress_event_list[-1]
+    assert fetch_event.stage == 'fetch' and fetch_event.finished
+    assert fetch_event.done == fetch_event.total == len(SPECIES_NAME_LIST)
+
+
+@pytest.mark.parametrize('engine', ['pipeline', 'asyncio'])
+def test_fetch_engine_same_as_threads(stub_server, monkeypatch, engine):
+    if engine == 'asyncio':
+        pytest.importorskip('aiohttp')
+    fetch_species()
+    thread_web_data_cache_dict = dict(specimen_info._web_data_cache_dict)
+    assert len(thread_web_data_cache_dict) == len(SPECIES_NAME_LIST)
+    os.remove(specimen_info.LOCAL_SQLITE_CACHE_FILE)
+    os.remove(specimen_info.LOCAL_PAGE_ARCHIVE_FILE)
+
+    # Parsing processes import the module again, spawn shows it on Linux
+    monkeypatch.setattr(
+        specimen_info, 'ProcessPoolExecutor', functools.partial(
+            specimen_info.ProcessPoolExecutor,
+            mp_context=multiprocessing.get_context('spawn')))
+    monkeypatch.setattr(specimen_info, 'FETCH_ENGINE', engine)
+    monkeypatch.setattr(specimen_info, 'PARSE_PROCESS_NUM', 2)
+    del stub_server.request_path_list[:]
+    fetch_species()
+    assert len(stub_server.request_path_list) == len(SPECIES_NAME_LIST)
+    assert specimen_info._web_data_cache_dict == thread_web_data_cache_dict
+    # Importing the module does not set up logging
+    assert not os.path.exists('log.txt')
+
+
+def test_main_logs_to_log_file(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    # Without the handlers added by pytest, as when run from command line
+    root_logger = logging.getLogger()
+    monkeypatch.setattr(root_logger, 'handlers', [])
+    monkeypatch.setattr(sys, 'argv', ['specimen_info', '--reparse'])
+    root_level = root_logger.level
+    try:
+        specimen_info.main()
+    finally:
+        for handler in root_logger.handlers:
+            handler.close()
+        root_logger.setLevel(root_level)
+    with io.open('log.txt', encoding='utf-8') as f:
+        log_text = f.read()
+    assert 'Plant Speciem Info Input Program' in log_text
+    assert 'You are using one or more default name(s).' in log_text
+    assert 'Page archive does not exist' in log_text
+    assert 'WARNING:root:' not in log_text
+
+
+def test_fetch_pipeline_interrupted_stops_workers(stub_server, monkeypatch):
+    shutdown_wait_list = []
+
+    class RecordingExecutor(specimen_info.ProcessPoolExecutor):
+        def shutdown(self, wait=True):
+            shutdown_wait_list.append(wait)
+            super(RecordingExecutor, self).shutdown(wait)
+
+    def interrupt_save(self, *args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(specimen_info, 'ProcessPoolExecutor',
+                        RecordingExecutor)
+    monkeypatch.setattr(specimen_info, 'FETCH_ENGINE', 'pipeline')
+    monkeypatch.setattr(specimen_info, 'PARSE_PROCESS_NUM', 1)
+    # Fetching threads would block on the full page queue
+    monkeypatch.setattr(specimen_info, 'PIPELINE_QUEUE_SIZE', 1)
+    monkeypatch.setattr(specimen_info.WebInfoCacheMultithreading,
+                        '_save_web_info', interrupt_save)
+    with pytest.raises(KeyboardInterrupt):
+        fetch_species()
+    assert shutdown_wait_list == [False]
+    time_end = time.time() + 10
+    while any(_.name.startswith('pipeline-fetch-')
+              for _ in threading.enumerate()):
+        assert time.time() < time_end
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_revalidate_only_reparses_changed_pages(stub_server, monkeypatch,
+                                                engine):
+    if engine == 'asyncio':
+        pytest.importorskip('aiohttp')
+    monkeypatch.setattr(specimen_info, 'FETCH_ENGINE', engine)
+    monkeypatch.setattr(specimen_info, 'REVALIDATE_AFTER_DAYS', 0)
+    stub_server.etag = '"v1"'
+    fetch_species()
+    web_cache = specimen_info.open_web_cache()
+    species_name = SPECIES_NAME_LIST[0]
+    assert web_cache.get_validators(species_name)['etag'] == '"v1"'
+    web_cache.close()
+
+    def get_fetched_at_dict():
+        conn = sqlite3.connect(specimen_info.LOCAL_SQLITE_CACHE_FILE)
+        fetched_at_dict = dict(conn.execute(
+            'SELECT species_name, fetched_at FROM web_cache'))
+        conn.close()
+        return fetched_at_dict
+
+    def revalidate():
+        specimen_info._web_data_cache_dict.clear()
+        specimen_info.WebInfoCacheMultithreading(
+            None, species_name_list=SPECIES_NAME_LIST, revalidate=True
+        ).get_web_dict_multithreading()
+        return dict(specimen_info._web_data_cache_dict)
+
+    # Not modified: only the fetch time is refreshed
+    web_data_cache_dict = dict(specimen_info._web_data_cache_dict)
+    fetched_at_dict = get_fetched_at_dict()
+    del stub_server.request_path_list[:]
+    assert revalidate() == web_data_cache_dict
+    assert len(stub_server.request_path_list) == len(SPECIES_NAME_LIST)
+    assert all(fetched_at > fetched_at_dict[name]
+               for name, fetched_at in get_fetched_at_dict().items())
+
+    # Changed page: parsed again with the new validators
+    stub_server.etag = '"v2"'
+    stub_server.description = '乔木，高达45米。'
+    new_web_data_cache_dict = revalidate()
+    assert new_web_data_cache_dict != web_data_cache_dict
+    assert sorted(new_web_data_cache_dict) == sorted(web_data_cache_dict)
+    web_cache = specimen_info.open_web_cache()
+    assert web_cache.get_validators(species_name)['etag'] == '"v2"'
+    web_cache.close()
+
+
+def test_async_fetch_pages(stub_server):
+    pytest.importorskip('aiohttp')
+    async_fetch = specimen_info._load_async_fetch()
+    url_dict = dict((_, specimen_info.get_species_url(_))
+                    for _ in SPECIES_NAME_LIST)
+    url_dict['Missing species'] = 'http://127.0.0.1:1/frps/Missing'
+    result_dict = {}
+    callback_thread_set = set()
+
+    def on_page_fetched(key, text, headers, error):
+        callback_thread_set.add(threading.current_thread())
+        result_dict[key] = (text, error)
+
+    async_fetch.fetch_pages(url_dict, on_page_fetched, concurrency=3)
+    assert sorted(result_dict) == sorted(url_dict)
+    assert all(text and error is None for name, (text, error)
+               in result_dict.items() if name != 'Missing species')
+    text, error = result_dict['Missing species']
+    assert text is None and error is not None
+    # Pages are parsed out of the event loop, one at a time
+    assert len(callback_thread_set) == 1
+    assert threading.current_thread() not in callback_thread_set
@@ -1,4 +1,297 @@
-from __future__ import (absolute_import, unicode_literal, print_function,
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, unicode_literals, print_function,
                         division)
+import os
+import time
+import logging
+import threading
+
 import pytest
+import openpyxl
+
+from specimen_info import specimen_info_gui
+
+
+def write_xlsx(file_name, row_list):
+    wb = openpyxl.Workbook()
+    for row in row_list:
+        wb.active.append(row)
+    wb.save(file_name)
+
+
+DATA_ROW_LIST = [
+    ['S%03d' % _, '中文名%d' % _, 'Genus%d species%d' % (_, _)] +
+    ['%d' % _] * 16 for _ in range(1, 4)]
+
+
+def test_offline_data_index_rebuilt_only_on_change(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    write_xlsx('data.xlsx', DATA_ROW_LIST)
+    read_from_file_list = []
+    rebuild = specimen_info_gui.OfflineDataIndex.rebuild
+
+    def counting_rebuild(self):
+        read_from_file_list.append(self.data_row_list is None)
+        rebuild(self)
+
+    monkeypatch.setattr(specimen_info_gui.OfflineDataIndex, 'rebuild',
+                        counting_rebuild)
+    index = specimen_info_gui.OfflineDataIndex('data.xlsx')
+    assert index.index_file == 'data.xlsx.col0.index'
+    assert index['S002'] == tuple(DATA_ROW_LIST[1])
+    index.close()
+    index = specimen_info_gui.OfflineDataIndex(
+        'data.xlsx', data_row_list=[tuple(_) for _ in DATA_ROW_LIST])
+    assert index.data_row_list is not None
+    index.close()
+
+    write_xlsx('data.xlsx', DATA_ROW_LIST[:2])
+    index = specimen_info_gui.OfflineDataIndex(
+        'data.xlsx', data_row_list=[tuple(_) for _ in DATA_ROW_LIST[:2]])
+    assert len(index) == 2 and 'S003' not in index
+    # Rows are dropped once written to the index
+    assert index.data_row_list is None
+    index.close()
+    assert read_from_file_list == [True, False]
+
+
+
+def test_offline_data_index_missing_data_file(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    with pytest.raises(ValueError):
+        specimen_info_gui.OfflineDataIndex('nodata.xlsx')
+    assert not os.path.exists('nodata.xlsx.col0.index')
+
+def test_xlsx_preview_pages(tmpdir):
+    row_list = [('row %d' % _, _) for _ in range(7)]
+    write_xlsx(str(tmpdir.join('query.xlsx')), row_list)
+    preview = specimen_info_gui.XlsxPreview(str(tmpdir.join('query.xlsx')),
+                                            page_rows=3)
+    assert preview.read_page() == row_list[:3]
+    assert preview.read_all() == row_list
+    # Only the pages shown are kept, the next page is read again
+    assert preview.row_list == row_list[:3]
+    assert preview.read_page() == row_list[3:6]
+    assert preview.read_page() == row_list[6:]
+    assert preview.exhausted and preview.read_page() == []
+    assert preview.read_all() == row_list
+    assert preview.is_up_to_date()
+    preview.close()
+    assert not preview.is_up_to_date()
+
+
+def test_read_xlsx_rows_from_preview(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    write_xlsx('query.xlsx', [('a', 1), ('b', 2)])
+    write_xlsx('data.xlsx', DATA_ROW_LIST)
+    preview = specimen_info_gui.XlsxPreview('query.xlsx')
+    preview.read_page()
+    opened_file_list = []
+    xlsx_file_init = specimen_info_gui.XlsxFile.__init__
+
+    def counting_init(self, excel_file, read_only=False):
+        opened_file_list.append((excel_file, read_only))
+        xlsx_file_init(self, excel_file, read_only)
+
+    monkeypatch.setattr(specimen_info_gui.XlsxFile, '__init__', counting_init)
+    assert specimen_info_gui.read_xlsx_rows(
+        'query.xlsx', [None, preview]) == [('a', 1), ('b', 2)]
+    assert specimen_info_gui.read_xlsx_rows(
+        'data.xlsx', [None, preview]) == [tuple(_) for _ in DATA_ROW_LIST]
+    assert opened_file_list == [('data.xlsx', True)]
+
+    # Changed since the preview: read from the file
+    write_xlsx('query.xlsx', [('c', 3)])
+    os.utime('query.xlsx', (1, 1))
+    assert specimen_info_gui.read_xlsx_rows('query.xlsx', [preview]) == [
+        ('c', 3)]
+    preview.close()
+
+
+class FakeWebInfo(object):
+    """WebInfo without network. Each fetch is added to fetched_name_list,
+    then waits for a release of the web_gate semaphore."""
+    web_gate = None
+    fetched_name_list = None
+
+    def __init__(self, species_name):
+        FakeWebInfo.fetched_name_list.append(species_name)
+        FakeWebInfo.web_gate.acquire()
+        self.pretty_info_tuple = tuple(species_name.split()) + ('',) * 9
+
+
+@pytest.fixture
+def job_files(tmpdir, monkeypatch):
+    """data.xlsx, and query_<N>.xlsx querying species N of it."""
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(FakeWebInfo, 'web_gate', threading.Semaphore(100))
+    monkeypatch.setattr(FakeWebInfo, 'fetched_name_list', [])
+    monkeypatch.setattr(specimen_info_gui, 'WebInfo', FakeWebInfo)
+    monkeypatch.setattr(specimen_info_gui, '_progress_listener_list', [])
+    write_xlsx('data.xlsx', [specimen_info_gui.DATA_FILE_HEADER_TUPLE] +
+               DATA_ROW_LIST)
+    for data_row in DATA_ROW_LIST:
+        write_xlsx('query_%s.xlsx' % data_row[0][-1],
+                   [(data_row[0], '1', '0001', data_row[2], '1')])
+    return FakeWebInfo
+
+
+def wait_until(condition, timeout=10):
+    time_end = time.time() + timeout
+    while not condition():
+        assert time.time() < time_end
+        time.sleep(0.01)
+
+
+def submit_jobs(job_manager, query_num_list):
+    return [job_manager.submit('data.xlsx', 'query_%d.xlsx' % _,
+                               'out_%d.xlsx' % _) for _ in query_num_list]
+
+
+def test_job_manager_shares_cache_of_done_jobs_only(job_files, monkeypatch):
+    job_manager = specimen_info_gui.JobManager(worker_num=1)
+    fetch = FakeWebInfo.__init__
+
+    def fetch_then_cancel(self, species_name):
+        fetch(self, species_name)
+        if species_name == 'Genus2 species2':
+            job_list[1].cancel()
+
+    monkeypatch.setattr(FakeWebInfo, '__init__', fetch_then_cancel)
+    job_list = submit_jobs(job_manager, [1, 2])
+    wait_until(lambda: all(_.is_finished for _ in job_list))
+    assert [_.status for _ in job_list] == [
+        specimen_info_gui.QueryJob.DONE, specimen_info_gui.QueryJob.CANCELLED]
+    # Each job has its own cache, starting from the done jobs before it
+    assert sorted(job_list[0].cache.web_data_cache_dict) == [
+        'Genus1 species1']
+    assert sorted(job_list[1].cache.web_data_cache_dict) == [
+        'Genus1 species1', 'Genus2 species2']
+    assert sorted(job_manager._warm_cache.web_data_cache_dict) == [
+        'Genus1 species1']
+
+    job_list.extend(submit_jobs(job_manager, [3]))
+    wait_until(lambda: job_list[2].is_finished)
+    job_manager.shutdown()
+    assert job_list[2].status == specimen_info_gui.QueryJob.DONE
+    assert 'Genus3 species3' not in job_list[0].cache.web_data_cache_dict
+    assert 'Genus3 species3' in job_manager._warm_cache.web_data_cache_dict
+    # The data file index is reused
+    assert job_list[2].cache.xlsx_data_cache_dict is \
+        job_list[0].cache.xlsx_data_cache_dict
+
+
+def test_job_pause_resume_and_cancel(job_files, monkeypatch):
+    job_event_list = []
+    job_manager = specimen_info_gui.JobManager(worker_num=1,
+                                               listener=job_event_list.append)
+    monkeypatch.setattr(FakeWebInfo, 'web_gate', threading.Semaphore(0))
+    job_list = submit_jobs(job_manager, [1, 2, 3])
+    cancelled_job, pending_job, paused_job = job_list
+    wait_until(lambda: len(FakeWebInfo.fetched_name_list) == 1)
+    # Not started yet: never runs
+    pending_job.cancel()
+    assert pending_job.status == pending_job.CANCELLED
+    # Running: stops at the next checkpoint
+    cancelled_job.cancel()
+    FakeWebInfo.web_gate.release()
+    wait_until(lambda: len(FakeWebInfo.fetched_name_list) == 2)
+    assert cancelled_job.status == cancelled_job.CANCELLED
+
+    paused_job.pause()
+    assert paused_job.status == paused_job.PAUSED
+    FakeWebInfo.web_gate.release()
+    time.sleep(0.2)
+    assert paused_job.status == paused_job.PAUSED
+    paused_job.resume()
+    wait_until(lambda: paused_job.is_finished)
+    job_manager.shutdown()
+
+    assert paused_job.status == paused_job.DONE
+    assert pending_job.cache is None
+    assert FakeWebInfo.fetched_name_list == ['Genus1 species1',
+                                             'Genus3 species3']
+    assert [_ for _ in ('out_1.xlsx', 'out_2.xlsx', 'out_3.xlsx')
+            if os.path.isfile(_)] == ['out_3.xlsx']
+    assert all(_ in job_event_list for _ in job_list)
+
+
+def test_progress_events_of_each_job(job_files):
+    progress_event_list = []
+    specimen_info_gui.add_progress_listener(progress_event_list.append)
+    job_manager = specimen_info_gui.JobManager(worker_num=2)
+    job_list = submit_jobs(job_manager, [1, 2])
+    wait_until(lambda: all(_.is_finished for _ in job_list))
+    job_manager.shutdown()
+    for job in job_list:
+        assert job.status == job.DONE
+        assert set(_.stage for _ in progress_event_list
+                   if _.job_id == job.job_id and _.finished) >= set(
+                       ['fetch', 'query'])
+    assert set(_.job_id for _ in progress_event_list) == set(
+        _.job_id for _ in job_list)
+
+
+class FakeText(object):
+    """Text widget without display, keeps the text in a string."""
+
+    def __init__(self):
+        self.content = ''
+        self.after_list = []
+
+    def after(self, ms, func):
+        self.after_list.append(func)
+
+    def configure(self, **kwargs):
+        pass
+
+    def insert(self, index, text):
+        self.content += text
+
+    def index(self, index):
+        # Line of the last character, Tk adds a newline at the end
+        return '%d.0' % (self.content.count('\n') + 1)
+
+    def delete(self, index_1, index_2):
+        line_num = int(index_2.split('.')[0])
+        self.content = ''.join(
+            self.content.splitlines(True)[line_num - 1:])
+
+    def yview(self, index):
+        pass
+
+
+def emit_lines(handler, line_num):
+    for _ in range(1, line_num + 1):
+        handler.emit(logging.makeLogRecord({'msg': 'line %d' % _}))
+
+
+def test_text_handler_drops_oldest_lines():
+    handler = specimen_info_gui.TextHandler(FakeText(), max_lines=3,
+                                            max_lines_per_flush=2)
+    emit_lines(handler, 5)
+    line_list = handler._take_lines()
+    assert len(line_list) == 2
+    assert '省略 2 条' in line_list[0] and line_list[1] == 'line 3'
+    assert handler._take_lines() == ['line 4', 'line 5']
+    assert handler._take_lines() == []
+    # Dropped lines are reported once
+    emit_lines(handler, 1)
+    assert handler._take_lines() == ['line 1']
+
 
+def test_text_handler_keeps_last_lines_in_widget():
+    text = FakeText()
+    handler = specimen_info_gui.TextHandler(text, max_lines=3,
+                                            max_lines_per_flush=2)
+    emit_lines(handler, 3)
+    handler.flush_to_widget()
+    assert text.content == 'line 1\nline 2\n'
+    emit_lines(handler, 2)
+    handler.flush_to_widget()
+    assert text.content == 'line 2\nline 3\nline 1\n'
+    handler.flush_to_widget()
+    assert text.content == 'line 3\nline 1\nline 2\n'
+    # Flushed again on each run of the Tk loop
+    assert text.after_list == [handler.flush_to_widget] * 4